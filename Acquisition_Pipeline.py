@@ -0,0 +1,232 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import threading
+import time
+import cv2
+from Droplet_Segmentation import frameToImages, analyzeImage, analyzeFrame
+from Step_Profiler import activeProfiler, profiling, timed
+
+try:
+    import Queue as queue #python 2
+except ImportError:
+    import queue #python 3
+
+'''
+Helpers that let arrayAcquisition_ShutterControl in Inkjet_Acquisition_Analysis.py overlap the
+slow python side of acquisition (image conversion, png encoding, disk writes) with the hardware
+(shutter, camera and stage), and let the images be analyzed while the array is still being imaged.
+'''
+
+#%%
+def writeImage(label,img,native_depth=False):
+
+    '''
+    writeImage: saves an image to file, as cv2.imwrite, and returns the sha1 of the file contents
+    (see Array_Manifest.py) without reading the file back. If native_depth is True the image is saved
+    at its own bit depth (16-bit png for 12/16-bit cameras), otherwise it is converted to 8 bits
+    '''
+
+    with timed('encode'):
+        if not native_depth:
+            img=img.astype('uint8') #convert image to a format that imwrite can use
+        ok,encoded=cv2.imencode(os.path.splitext(label)[1],img) #same encoder cv2.imwrite uses for the extension
+    if not ok:
+        raise IOError('Could not encode image {}'.format(label))
+
+    data=encoded.tobytes()
+    with timed('write'):
+        with open(label,'wb') as f: #save image
+            f.write(data)
+
+    return hashlib.sha1(data).hexdigest()
+
+#%%
+class ImageWriter(object):
+
+    '''
+    ImageWriter: saves images to file on a background thread.
+
+    Images are handed over with put() and written in the same order by a single writer thread.
+    The queue between the two is bounded, so if the disk falls behind the camera put() waits for
+    a free spot instead of holding every image of the array in memory.
+    cv2 releases the GIL while it encodes, so the writes run alongside stage moves and snaps.
+    The writes are timed into the profiler switched on on the thread that creates the writer (see Step_Profiler.py).
+
+    inputs:
+        maxsize: maximum number of images waiting to be written (default 8)
+        native_depth: see writeImage (default False)
+
+    usage:
+        writer=ImageWriter()
+        writer.put(label,img) #for each image, or writer.put(label,img,callback) to have callback(sha1)
+                              #called from the writer thread once the image is saved
+        writer.close() #waits for all images to be written, raises the first error from the writer thread
+    '''
+
+    def __init__(self,maxsize=8,native_depth=False):
+        self.queue=queue.Queue(maxsize)
+        self.native_depth=native_depth
+        self.nwritten=0 #number of images written so far
+        self.error=None #first error raised by the writer thread
+        self.profiler=activeProfiler() #handed over to the writer thread
+        self.thread=threading.Thread(target=self._run)
+        self.thread.daemon=True #do not keep python open if the acquisition is interrupted
+        self.thread.start()
+
+    def put(self,label,img,callback=None):
+
+        '''
+        put: queue an image to be written to the file path in label
+        '''
+
+        if self.error is not None:
+            raise self.error
+        self.queue.put((label,img,callback)) #waits while the queue is full
+
+    def close(self):
+
+        '''
+        close: wait for all queued images to be written and stop the writer thread
+        '''
+
+        self.queue.put(None) #tells the writer thread there are no more images
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+
+        with profiling(self.profiler):
+            self._write()
+
+    def _write(self):
+
+        while True:
+            item=self.queue.get()
+            if item is None:
+                break
+
+            label,img,callback=item
+            if self.error is not None: #keep emptying the queue so put() does not block forever
+                continue
+            try:
+                sha1=writeImage(label,img,self.native_depth)
+                self.nwritten=self.nwritten+1
+                if callback is not None:
+                    callback(sha1)
+            except Exception as e:
+                self.error=e
+
+#%%
+class DropletCountStream(object):
+
+    '''
+    DropletCountStream: counts the objects in fluorescent images on a background thread while
+    the rest of the array is still being imaged.
+
+    Frames go straight from mmc.getImage() to submit(), without being saved and read back, and
+    are analyzed with the same steps as DropletCellCount (see analyzeImage in Droplet_Segmentation.py).
+    The results come out of results() in the order the frames were submitted. The steps are timed into the
+    profiler switched on on the thread that creates the stream (see Step_Profiler.py).
+
+    inputs:
+        directory: folder the images are saved to, used to fill in the file path column
+        array_label: label of the array, used to fill in the file name column
+        pixels_to_um: pixels per micron for the objective lens used (see pixelScale)
+        diam_min, diam_max: min and max expected diameter of the cells, in microns
+        maxsize: maximum number of frames waiting to be analyzed (default 16). submit() waits
+        for a free spot once this many are waiting.
+        native_depth: if True, frames are segmented at the bit depth of the camera (see analyzeFrame)
+        instead of being converted to 8 bits first (default False)
+        dist_fraction: fraction of the max of the distance transform used as sure foreground (see 
+        segmentImage in Droplet_Segmentation.py), default 0.2
+
+    usage:
+        stream=DropletCountStream(directory,array_label,pixels_to_um,diam_min,diam_max)
+        stream.submit(nimgs_fl,img) #for each fluorescent image, from the acquisition
+        stream.close() #once the acquisition is finished
+        for row, messages in stream.results(): #row has one entry per column of the .csv file
+            ...
+    '''
+
+    def __init__(self,directory,array_label,pixels_to_um,diam_min,diam_max,maxsize=16,native_depth=False,dist_fraction=0.2):
+        self.directory=directory
+        self.array='array'+str(array_label)
+        self.pixels_to_um=pixels_to_um
+        self.diam_min=diam_min
+        self.diam_max=diam_max
+        self.native_depth=native_depth
+        self.dist_fraction=dist_fraction
+        self.latencies=[] #time from submit() to the result being ready, for each frame, in s
+        self.profiler=activeProfiler() #handed over to the analysis thread
+
+        self.frames=queue.Queue(maxsize)
+        self.output=queue.Queue()
+        self.thread=threading.Thread(target=self._run)
+        self.thread.daemon=True
+        self.thread.start()
+
+    def submit(self,nimg,frame):
+
+        '''
+        submit: queue a fluorescent frame to be analyzed. nimg is the number of the image (1, 2, ...)
+        '''
+
+        self.frames.put((nimg,frame,time.time()))
+
+    def close(self):
+
+        '''
+        close: no more frames will be submitted. results() stops after the last one is analyzed
+        '''
+
+        self.frames.put(None)
+
+    def results(self):
+
+        '''
+        results: generator of (row, messages) for each frame, as soon as it has been analyzed.
+        Errors from the analysis thread are raised here.
+        '''
+
+        while True:
+            item=self.output.get()
+            if item is None:
+                return
+            if isinstance(item,Exception):
+                raise item
+            yield item
+
+    def _run(self):
+
+        with profiling(self.profiler):
+            self._analyze()
+
+    def _analyze(self):
+
+        while True:
+            item=self.frames.get()
+            if item is None:
+                self.output.put(None)
+                break
+
+            nimg,frame,submitted=item
+            try:
+                index=str(nimg).zfill(4) #number of the image
+                imgName=self.array+'_FLimage'+index+'.png' #name the image is saved under
+                imgPath=self.directory+'/'+imgName
+
+                if self.native_depth:
+                    row,messages=analyzeFrame(frame,index,imgPath,imgName,self.pixels_to_um,self.diam_min,self.diam_max,
+                                              self.dist_fraction)
+                else:
+                    img,img_gray=frameToImages(frame)
+                    row,messages=analyzeImage(img,img_gray,index,imgPath,imgName,self.pixels_to_um,self.diam_min,self.diam_max,
+                                              self.dist_fraction)
+
+                self.latencies.append(time.time()-submitted)
+                self.output.put((row,messages))
+            except Exception as e:
+                self.output.put(e)
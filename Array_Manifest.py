@@ -0,0 +1,276 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+import time
+
+'''
+Manifest of what has been done for one array, so arrayAcquisition_ShutterControl and
+DropletCellCount in Inkjet_Acquisition_Analysis.py can carry on from where they stopped.
+
+The manifest is saved next to the images as array{label}_manifest.jsonl. Every captured image adds one
+line to the end of the file as soon as it is done, so the manifest is up to date even if the serial link
+or the camera fails halfway through an array. Analyzed images are added in blocks (see flush), since the
+analysis can be run again from the images. When the file is read back, later lines replace earlier lines
+for the same image. Reading the file never changes it: the lines that were replaced are only removed by
+compact(), which DropletCellCount calls once it has finished with an array that is not being acquired.
+'''
+
+#%%
+def fileHash(filename):
+
+    '''
+    fileHash: sha1 of the contents of a file, hex string
+    '''
+
+    sha1=hashlib.sha1()
+    with open(filename,'rb') as f:
+        for block in iter(lambda: f.read(1<<20), b''):
+            sha1.update(block)
+
+    return sha1.hexdigest()
+
+#%%
+def manifestPath(directory,array_label):
+
+    '''
+    manifestPath: file path of the manifest of an array
+    '''
+
+    return '{}/array{}_manifest.jsonl'.format(directory,array_label)
+
+#%%
+class ArrayManifest(object):
+
+    '''
+    ArrayManifest: record of the images captured and analyzed for one array.
+
+    Images are identified by their number as a character string ('0001') and their channel ('BF' or 'FL').
+
+    inputs:
+        directory: folder the images of the array are saved to (the manifest is saved there too)
+        array_label: label of the array
+
+    usage:
+        manifest=ArrayManifest(directory,array_label)
+        manifest.recordAcquisition(nimgs) #when the acquisition starts
+        manifest.recordCapture('0001','FL',filename,(x,y),expFL,sha1)
+        manifest.isCaptured('0001','FL')
+        manifest.recordAnalysis('0001',sha1,params,row)
+        manifest.recordAnalysis('0002',sha1,params,row,flush=False) #written with the next flush()
+        manifest.flush()
+        manifest.analysisResult('0001',sha1,params) #row if it is still current, otherwise None
+        manifest.isAnalyzed('0001',params)
+        manifest.compact() #by the program writing the manifest, once it is done with it
+    '''
+
+    def __init__(self,directory,array_label):
+        self.filename=manifestPath(directory,array_label)
+        self.directory=directory
+        self.captures={} #(image, channel): capture record
+        self.analyses={} #image: analysis record
+        self.acquisition=None #last acquisition record, with the number of images of the array
+        self.pending=[] #records not written to the file yet
+        self.lock=threading.Lock() #images can be recorded from the writer thread
+
+        self._load()
+
+    def _load(self):
+
+        ###read the records from the file, returns the number of lines
+        self.captures={}
+        self.analyses={}
+        self.acquisition=None
+        nlines=0
+        if os.path.exists(self.filename):
+            with open(self.filename) as f:
+                for line in f:
+                    nlines=nlines+1
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError: #last line cut off when the program stopped
+                        continue
+
+        return nlines
+
+    def _apply(self,record):
+
+        if record['event']=='capture':
+            self.captures[(record['image'],record['channel'])]=record
+        elif record['event']=='analysis':
+            self.analyses[record['image']]=record
+        elif record['event']=='acquisition':
+            self.acquisition=record
+
+    def compact(self):
+
+        '''
+        compact: rewrites the file with only the current record of each image, if some records were replaced.
+        The file is read again first, and is left as it is while an acquisition of the array is still
+        capturing images (see isAcquiring). Only call it from the program writing the manifest: records
+        another program adds between the file being read and it being replaced are lost
+        '''
+
+        with self.lock:
+            self._write()
+            nlines=self._load()
+            if self.isAcquiring() or nlines<=len(self.captures)+len(self.analyses)+(self.acquisition is not None):
+                return
+
+            records=[] if self.acquisition is None else [self.acquisition]
+            records.extend(sorted(self.captures.values(),key=lambda record: record['time']))
+            records.extend(sorted(self.analyses.values(),key=lambda record: record['time']))
+            temp=self.filename+'.tmp'
+            with open(temp,'w') as f:
+                for record in records:
+                    f.write(json.dumps(record,sort_keys=True)+'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.rename(temp,self.filename)
+            except OSError: #windows does not replace existing files
+                os.remove(self.filename)
+                os.rename(temp,self.filename)
+
+    def _append(self,record,flush=True):
+
+        with self.lock:
+            self._apply(record)
+            self.pending.append(record)
+            if flush:
+                self._write()
+
+    def _write(self):
+
+        if not self.pending:
+            return
+        with open(self.filename,'a') as f:
+            f.write(''.join(json.dumps(record,sort_keys=True)+'\n' for record in self.pending))
+            f.flush()
+            os.fsync(f.fileno()) #on disk before carrying on with the next image
+        self.pending=[]
+
+    def flush(self):
+
+        '''
+        flush: writes the records added with flush=False to the file, with one fsync for all of them
+        '''
+
+        with self.lock:
+            self._write()
+
+    def recordAcquisition(self,nimgs):
+
+        '''
+        recordAcquisition: records the start of an acquisition of the array, with its number of images
+        '''
+
+        self._append({'event': 'acquisition',
+                      'images': nimgs,
+                      'time': time.time()})
+
+    def acquisitionSize(self):
+
+        '''
+        acquisitionSize: number of images of the array from the last recorded acquisition, or None if
+        no acquisition was recorded (e.g. images acquired before the manifest recorded it)
+        '''
+
+        if self.acquisition is None:
+            return None
+
+        return self.acquisition['images']
+
+    def isAcquiring(self):
+
+        '''
+        isAcquiring: True if an acquisition of the array is recorded and not all of its fluorescent images
+        have been captured, i.e. it is still capturing images or it stopped and was not resumed
+        '''
+
+        nimgs=self.acquisitionSize()
+        if nimgs is None:
+            return False
+
+        return not all(self.isCaptured(str(n).zfill(4),'FL') for n in range(1,nimgs+1))
+
+    def recordCapture(self,image,channel,filename,position,exposure,sha1=None):
+
+        '''
+        recordCapture: records a captured image
+
+        inputs:
+            image: number of the image, character string
+            channel: 'BF' or 'FL'
+            filename: file the image was saved to, None if it was not saved
+            position: (x, y) stage position of the droplet, in microns
+            exposure: exposure of the image, in ms
+            sha1: hash of the saved file (see fileHash)
+        '''
+
+        self._append({'event': 'capture',
+                      'image': image,
+                      'channel': channel,
+                      'file': filename,
+                      'position': [float(position[0]),float(position[1])],
+                      'exposure': exposure,
+                      'sha1': sha1,
+                      'time': time.time()})
+
+    def isCaptured(self,image,channel):
+
+        '''
+        isCaptured: True if the image has been captured and, if it was saved, the file still exists
+        '''
+
+        record=self.captures.get((image,channel))
+        if record is None:
+            return False
+
+        return record['file'] is None or os.path.exists(record['file'])
+
+    def recordAnalysis(self,image,sha1,params,row,flush=True):
+
+        '''
+        recordAnalysis: records the result of analyzing an image
+
+        inputs:
+            image: number of the image, character string
+            sha1: hash of the image file that was analyzed
+            params: dictionary of the analysis parameters (e.g. pixels_to_um, diam_min, diam_max)
+            row: dictionary with one entry per column of the .csv file
+            flush: if False, the record is only written to the file at the next flush(), so the records
+            of many images are written with one fsync (default True)
+        '''
+
+        self._append({'event': 'analysis',
+                      'image': image,
+                      'sha1': sha1,
+                      'params': params,
+                      'row': row,
+                      'time': time.time()},flush)
+
+    def isAnalyzed(self,image,params):
+
+        '''
+        isAnalyzed: True if the last recorded analysis of the image used the parameters params
+        '''
+
+        record=self.analyses.get(image)
+
+        return record is not None and record['params']==params
+
+    def analysisResult(self,image,sha1,params):
+
+        '''
+        analysisResult: the recorded row for an image if it was analyzed from the same file contents
+        with the same parameters, otherwise None
+        '''
+
+        record=self.analyses.get(image)
+        if record is None or record['sha1']!=sha1 or record['params']!=params:
+            return None
+
+        return record['row']
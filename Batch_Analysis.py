@@ -0,0 +1,247 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import csv
+import multiprocessing
+import os
+import re
+import threading
+import traceback
+from Array_Manifest import ArrayManifest
+from Droplet_Segmentation import CSV_HEADERS, pixelScale, initWorker
+from Inkjet_Acquisition_Analysis import DropletCellCount, analysisParams
+
+try:
+    import Queue as queue #python 2
+except ImportError:
+    import queue #python 3
+
+'''
+Counting every array found in a folder and its subfolders, with DropletCellCount from
+Inkjet_Acquisition_Analysis.py, in one run.
+
+Arrays are found from their fluorescent images, array{label}_FLimage####.png, and the number of images
+of each array is the number of files found, so nrows and ncols are not needed. All arrays share one pool
+of worker processes: a few arrays are analyzed at once, each handing its images to the pool as soon as
+it starts, so the workers are kept busy from one array to the next instead of waiting for the last
+images of each array.
+
+The CellCount_array{label}.csv file of each array is saved in the folder of its images, and one row per
+array (number of images and objects, how many droplets are empty or have one or more objects, how many
+are flagged) is saved to batch_summary.csv in the top folder. An array whose .csv file has a row for
+every image and is newer than all of its images, and whose manifest records every image as analyzed with
+the same parameters (user inputs, magnification, crop, skip_empty, native_depth), is not analyzed again,
+so the batch can be run again as more arrays are acquired or with other options.
+
+Arrays that are still being acquired are left out and listed as 'in progress' in the summary: arrays whose
+manifest records an acquisition that has not captured all of its fluorescent images yet (a fluorescent image
+is only recorded once its file is completely saved), and arrays with gaps in their image numbers.
+
+usage:
+    batchCount(root,'20X',nworkers=8) #from python
+    python Inkjet_Acquisition_Analysis.py batch root 20X --workers 8 #from the command line
+'''
+
+IMAGE_PATTERN=re.compile(r'^array(.+)_FLimage(\d{4,})\.png$') #fluorescent images saved by arrayAcquisition
+SUMMARY_HEADERS=['Directory','Array','Images','Status','Objects','Empty','Single','Multiple','Flagged','CSV File']
+
+#%%
+def findArrays(root):
+
+    '''
+    findArrays: finds the arrays of fluorescent images in a folder and its subfolders
+
+    returns:
+        arrays: list of (directory, array label, number of images, missing image numbers), sorted by
+        directory and label. The number of images is the highest image number found
+    '''
+
+    arrays=[]
+    for directory, subdirectories, files in os.walk(root):
+        subdirectories.sort()
+        numbers={} #image numbers of each array label in this folder
+        for name in files:
+            match=IMAGE_PATTERN.match(name)
+            if match:
+                numbers.setdefault(match.group(1),set()).add(int(match.group(2)))
+        for label in sorted(numbers):
+            nimgs=max(numbers[label])
+            missing=[n for n in range(1,nimgs+1) if n not in numbers[label]]
+            arrays.append((directory,label,nimgs,missing))
+
+    return arrays
+
+#%%
+def isAcquiring(directory,array_label):
+
+    '''
+    isAcquiring: True if the manifest of an array (see ArrayManifest in Array_Manifest.py) records an
+    acquisition of the array that has not captured every fluorescent image yet, i.e. the array is still
+    being acquired, or its acquisition stopped and has not been resumed
+    '''
+
+    return ArrayManifest(directory,array_label).isAcquiring()
+
+#%%
+def countPath(directory,array_label):
+
+    '''
+    countPath: the CellCount_array{label}.csv file of an array in a batch, in the folder of its images
+    '''
+
+    return os.path.join(directory,'CellCount_array{}.csv'.format(array_label))
+
+#%%
+def readCounts(filename):
+
+    '''
+    readCounts: rows of a CellCount_array{label}.csv file, or None if it does not exist or is not complete
+    '''
+
+    if not os.path.isfile(filename):
+        return None
+    with open(filename) as f:
+        reader=csv.DictReader(f)
+        if reader.fieldnames!=CSV_HEADERS:
+            return None
+        return list(reader)
+
+#%%
+def isComplete(directory,array_label,nimgs,params):
+
+    '''
+    isComplete: True if an array already has a .csv file with one row per image, saved after the last
+    change to any of its images, and the manifest of the array (see ArrayManifest in Array_Manifest.py)
+    records every image as last analyzed with the parameters params (see analysisParams in 
+    Inkjet_Acquisition_Analysis.py)
+    '''
+
+    filename=countPath(directory,array_label)
+    rows=readCounts(filename)
+    if rows is None or len(rows)!=nimgs:
+        return False
+
+    saved=os.path.getmtime(filename)
+    for n in range(1,nimgs+1):
+        imgPath=os.path.join(directory,'array{}_FLimage{}.png'.format(array_label,str(n).zfill(4)))
+        if os.path.getmtime(imgPath)>saved:
+            return False
+
+    manifest=ArrayManifest(directory,array_label)
+    for n in range(1,nimgs+1):
+        if not manifest.isAnalyzed(str(n).zfill(4),params):
+            return False
+
+    return True
+
+#%%
+def summaryRow(directory,array_label,nimgs,status):
+
+    '''
+    summaryRow: row of batch_summary.csv for an array, from its .csv file
+    '''
+
+    filename=countPath(directory,array_label)
+    row={'Directory': directory, 'Array': array_label, 'Images': nimgs, 'Status': status, 'CSV File': filename}
+    rows=readCounts(filename)
+    if rows is None or status.startswith('error') or status.startswith('missing') or status=='in progress':
+        return row
+
+    counts=[int(float(r['Cell Count'])) for r in rows]
+    row['Objects']=sum(counts)
+    row['Empty']=sum(1 for c in counts if c==0)
+    row['Single']=sum(1 for c in counts if c==1)
+    row['Multiple']=sum(1 for c in counts if c>1)
+    row['Flagged']=sum(1 for r in rows if r['Flags'])
+
+    return row
+
+#%%
+def batchCount(root,mag,nworkers=multiprocessing.cpu_count(),force=False,summary='batch_summary.csv',
+               narrays=None,**options):
+
+    '''
+    batchCount: counts the objects in every array found in root and its subfolders (see findArrays)
+
+    inputs:
+        root: top folder to look for arrays in
+        mag: objective lens used for image capture, either '10x', '20x', or '40x', the same for all arrays
+        nworkers: number of worker processes shared by all arrays (default: number of cores)
+        force: if True, arrays that are already complete are analyzed again (default False). Arrays analyzed 
+        with other parameters are analyzed again anyway (see isComplete), force is for changes the manifest 
+        does not record, e.g. to the analysis code
+        summary: name of the summary file saved in root (default 'batch_summary.csv')
+        narrays: number of arrays analyzed at once (default: nworkers, at least 2 so the images of the
+        next array are queued while the last images of an array are analyzed)
+        options: other arguments of DropletCellCount, e.g. crop=True, skip_empty=True, cache_dir=...
+        Images are not shown. Arrays that were partly analyzed carry on from where they were (resume=True)
+        unless force is True
+
+    returns:
+        rows: one dictionary per array with the columns of the summary file
+
+    Arrays still being acquired (see isAcquiring) and arrays with missing image numbers are left out and 
+    listed in the summary.
+    '''
+
+    arrays=findArrays(root)
+    params=analysisParams(pixelScale(mag),options.get('native_depth',False),options.get('crop',False),
+                          options.get('skip_empty',False)) #parameters the arrays are analyzed with
+    results={} #summary row of each array, by its place in arrays
+    todo=queue.Queue()
+
+    for k, (directory, label, nimgs, missing) in enumerate(arrays):
+        if isAcquiring(directory,label):
+            print('Array {} in {}: still being acquired, skipped'.format(label,directory))
+            results[k]=summaryRow(directory,label,nimgs,'in progress')
+        elif missing:
+            print('Array {} in {}: images {} missing, skipped'.format(label,directory,missing[:10]))
+            results[k]=summaryRow(directory,label,nimgs,'missing images')
+        elif not force and isComplete(directory,label,nimgs,params):
+            results[k]=summaryRow(directory,label,nimgs,'complete')
+        else:
+            todo.put(k)
+    print('{} arrays found, {} to analyze'.format(len(arrays),todo.qsize()))
+
+    options['show']=False
+    options.setdefault('resume',not force)
+
+    def analyzeArrays(pool):
+        while True:
+            try:
+                k=todo.get_nowait()
+            except queue.Empty:
+                return
+            directory, label, nimgs, missing = arrays[k]
+            try:
+                DropletCellCount(directory,label,1,nimgs,mag,nworkers=nworkers,pool=pool,output_dir=directory,**options)
+                status='analyzed'
+            except Exception as e:
+                traceback.print_exc()
+                status='error: {}'.format(e)
+            results[k]=summaryRow(directory,label,nimgs,status)
+            print('Array {} in {}: {}'.format(label,directory,status))
+
+    if not todo.empty():
+        if narrays is None:
+            narrays=max(2,nworkers)
+        pool=multiprocessing.Pool(nworkers,initializer=initWorker) #shared by all arrays
+        try:
+            threads=[threading.Thread(target=analyzeArrays,args=(pool,)) for t in range(min(narrays,todo.qsize()))]
+            for thread in threads:
+                thread.daemon=True
+                thread.start()
+            for thread in threads:
+                thread.join()
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    rows=[results[k] for k in range(len(arrays))]
+    with open(os.path.join(root,summary),'w') as f:
+        writer=csv.DictWriter(f,fieldnames=SUMMARY_HEADERS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+    return rows
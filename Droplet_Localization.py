@@ -0,0 +1,120 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import cv2
+import numpy as np
+
+'''
+Finding the droplet in the brightfield image of a droplet, for DropletCellCount in
+Inkjet_Acquisition_Analysis.py.
+
+The edge of a printed droplet shows up as a dark ring in the brightfield image. It is found with a
+Hough circle transform on a downsampled copy of the image, and the fluorescent image of the same droplet
+is cropped to the bounding box of the circle before it is segmented, so the segmentation only works on
+the droplet and not on the whole frame. If no droplet is found, nothing was printed at that position
+and the image is left out of the count (empty droplet exclusion).
+'''
+
+#%%
+def pixelNoise(img,step=8):
+
+    '''
+    pixelNoise: standard deviation of the noise of an image, from the differences between neighboring
+    pixels on every step-th row (median absolute deviation, so edges and objects barely change it)
+    '''
+
+    differences=np.diff(img[::step].astype(np.float32),axis=1).ravel()
+
+    return 1.4826*np.median(np.abs(differences-np.median(differences)))/np.sqrt(2)
+
+#%%
+def ringContrast(img,x,y,radius,noise,width=2,band=3):
+
+    '''
+    ringContrast: largest difference between the mean of a ring of pixels and the median of the image, in
+    units of noise, over the rings of radius - band to radius + band pixels. The radius from the Hough
+    transform can be a pixel or two off the edge of the droplet, and a single ring drawn there would miss it
+    '''
+
+    median=np.median(img)
+    contrast=0.0
+    for r in range(max(1,int(round(radius))-band),int(round(radius))+band+1):
+        ring=np.zeros(img.shape,np.uint8)
+        cv2.circle(ring,(int(round(x)),int(round(y))),r,1,width)
+        if ring.any():
+            contrast=max(contrast,abs(img[ring>0].mean()-median)/max(noise,1e-9))
+
+    return contrast
+
+#%%
+def findDroplet(bf,pixels_to_um,diam_min,diam_max,size=128,min_contrast=3.0,ncandidates=5):
+
+    '''
+    findDroplet: finds the droplet in a brightfield image
+
+    inputs:
+        bf: grayscale brightfield image, any bit depth
+        pixels_to_um: pixels per micron for the objective lens used (see pixelScale)
+        diam_min, diam_max: min and max expected diameter of the droplets, in microns
+        size: the image is downsampled to about this many pixels across before the Hough transform (default 128)
+        min_contrast: the edge of a circle must differ from the rest of the image by this many times the 
+        pixel noise (see ringContrast and pixelNoise), so circles found in the noise of an image with no 
+        droplet are rejected (default 3)
+        ncandidates: number of the strongest circles checked for contrast (default 5)
+
+    returns:
+        (x, y, radius) of the droplet in pixels of the full image, or None if no droplet was found
+    '''
+
+    scale=min(1.0,float(size)/max(bf.shape))
+    original=cv2.resize(bf.astype(np.float32),(max(1,int(round(bf.shape[1]*scale))),max(1,int(round(bf.shape[0]*scale)))),
+                        interpolation=cv2.INTER_AREA)
+    small=cv2.normalize(original,None,0,255,cv2.NORM_MINMAX).astype(np.uint8) #HoughCircles only takes 8-bit images
+    small=cv2.medianBlur(small,5)
+
+    min_radius=max(1,int(diam_min/2.0*pixels_to_um*scale))
+    max_radius=max(min_radius+1,int(np.ceil(diam_max/2.0*pixels_to_um*scale)))
+    circles=cv2.HoughCircles(small,cv2.HOUGH_GRADIENT,dp=1,minDist=min_radius,
+                             param1=100,param2=20,minRadius=min_radius,maxRadius=max_radius)
+    if circles is None:
+        return None
+
+    noise=pixelNoise(bf)
+    for x,y,radius in circles[0][:ncandidates]: #strongest first
+        if ringContrast(original,x,y,radius,noise)>=min_contrast:
+            return float(x)/scale, float(y)/scale, float(radius)/scale
+
+    return None
+
+#%%
+def dropletBox(circle,shape,margin=0.1):
+
+    '''
+    dropletBox: bounding box of a droplet found by findDroplet, grown by a margin (fraction of the radius)
+    and clipped to the image
+
+    returns:
+        (top, bottom, left, right) pixel bounds, for img[top:bottom,left:right]
+    '''
+
+    x,y,radius=circle
+    reach=radius*(1+margin)
+    top=max(0,int(np.floor(y-reach)))
+    bottom=min(shape[0],int(np.ceil(y+reach))+1)
+    left=max(0,int(np.floor(x-reach)))
+    right=min(shape[1],int(np.ceil(x+reach))+1)
+
+    return top, bottom, left, right
+
+#%%
+def locateDroplet(bf,pixels_to_um,diam_min,diam_max):
+
+    '''
+    locateDroplet: bounding box of the droplet in a brightfield image (see findDroplet and dropletBox),
+    or None if no droplet was found
+    '''
+
+    circle=findDroplet(bf,pixels_to_um,diam_min,diam_max)
+    if circle is None:
+        return None
+
+    return dropletBox(circle,bf.shape)
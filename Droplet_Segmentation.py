@@ -0,0 +1,734 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import os
+from collections import namedtuple
+import cv2
+import numpy as np
+from skimage import measure
+from Array_Manifest import fileHash
+from Result_Cache import SegmentationCache, segmentationKey
+from Image_Stack import openStack, frameHash, CHANNELS
+from Droplet_Localization import locateDroplet, pixelNoise
+from Step_Profiler import StepProfiler, profiling, timed
+
+'''
+Per-image segmentation steps used by DropletCellCount in Inkjet_Acquisition_Analysis.py.
+
+These are kept in their own file because nothing here touches the microscope or the arduino,
+so the file can be imported by the worker processes of a multiprocessing pool (which re-import
+the module the worker function lives in) without re-connecting to any hardware.
+'''
+
+#column headers of the CellCount_array*.csv file
+CSV_HEADERS=['Image','Cell Count', 'Flags', 'Diameters (microns)', 'Areas (microns^2)','File Path', 'File Name']
+
+#one image to analyze, see analyzeImageFile
+AnalysisTask=namedtuple('AnalysisTask',['index','imgPath','imgName','pixels_to_um','diam_min','diam_max','dist_fraction',
+                                        'cache_dir','segmentation_params','sha1','stack_path','native_depth','crop',
+                                        'empty_contrast','profile'])
+
+#%%
+def pixelScale(mag):
+
+    '''
+    pixelScale: returns the number of pixels per micron for the objective lens used
+
+    inputs:
+        mag: objective lens used for image capture, either '10x', '20x', or '40x'
+
+    returns:
+        pixels_to_um: pixels per micron, 1 if the magnification is not recognized
+    '''
+
+    ###define equivalent area in microns, depending on objective lens used
+    ###specific apertures should be added and pixel to um scale confirmed for future use
+
+    if mag=='40x' or mag=='40X':
+        pixels_to_um=7.68
+    elif mag=='20x' or mag == '20X':
+        pixels_to_um=2.2
+    elif mag=='10x' or mag == '10X':
+        pixels_to_um=1.0568
+    else:
+        print('Magnification incorrectly entered - measurements will be displayed in pixels.')
+        pixels_to_um=1
+
+    return pixels_to_um
+
+#%%
+def loadImage(imgPath):
+
+    '''
+    loadImage: reads a saved image from file
+
+    returns:
+        img: the image as read by cv2.imread (3 channel, needed by cv2.watershed)
+        img_gray: grayscale version of the image
+    '''
+
+    with timed('read'):
+        img=cv2.imread(imgPath) #read image from file
+    # imgrgb=cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    # plt.imshow(imgrgb)
+    # plt.title('Original Image')
+    # plt.xticks([]),plt.yticks([])
+    # plt.show()
+
+    with timed('convert'):
+        img_gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) #convert the image to grayscale
+    # plt.imshow(img_gray,cmap='gray')
+    # plt.title('Grayscale Image')
+    # plt.xticks([]),plt.yticks([])
+    # plt.show()
+
+    return img, img_gray
+
+#%%
+def segmentImage(img,img_gray,dist_fraction=0.2):
+
+    '''
+    segmentImage: Otsu threshold -> morphological opening -> distance transform -> watershed
+
+    inputs:
+        img: 3 channel image (modified in place, watershed boundaries are drawn on it)
+        img_gray: grayscale version of img
+        dist_fraction: fraction of the max value of the distance transform above which pixels are 
+        sure foreground (default 0.2)
+
+    returns:
+        markers: label image from cv2.watershed. 1 is the background, -1 are the boundaries
+    '''
+
+    ###Perform Ostu thresholding to create a binary image
+    with timed('threshold'):
+        ret2,thresh = cv2.threshold(img_gray,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    # plt.imshow(thresh,cmap='gray')
+    # plt.title('Ostu Thresholding')
+    # plt.xticks([]),plt.yticks([])
+    # plt.show()
+
+    markers = watershedRegions(img,thresh,dist_fraction)
+    img[markers == -1] = [255,0,0]
+
+    return markers
+
+#%%
+def watershedRegions(img,thresh,dist_fraction=0.2):
+
+    '''
+    watershedRegions: morphological opening -> distance transform -> watershed, from a binary image
+
+    inputs:
+        img: 3 channel 8-bit image to run the watershed on
+        thresh: binary image (0 or 255, uint8) of the objects, e.g. from Otsu thresholding
+        dist_fraction: see segmentImage
+
+    returns:
+        markers: label image from cv2.watershed. 1 is the background, -1 are the boundaries
+    '''
+
+    ###Perform morphological opening to remove small objects in the image
+    kernel = np.ones((3,3),np.uint8) #define the structuring element
+    with timed('opening'):
+        opening = cv2.morphologyEx(thresh,cv2.MORPH_OPEN,kernel, iterations = 1) #number of iterations can be modified
+    # plt.imshow(opening,cmap='gray')
+    # plt.title('Morphological Opening')
+    # plt.xticks([]),plt.yticks([])
+    # plt.show()
+
+    ###Determine the sure background region for watershed segmentation using dilation
+    with timed('sure background'):
+        sure_bg = cv2.dilate(opening,kernel,iterations=1) #iterations = how many pixels to dilate the objects, can be modified
+    # plt.imshow(opening, cmap="gray")
+    # plt.title('Sure Background')
+    # plt.xticks([]),plt.yticks([])
+    # plt.show()
+
+    ###Determine the sure forground region for watershed segmentation using distance transform
+    with timed('distance transform'):
+        dist_transform = cv2.distanceTransform(opening,cv2.DIST_L2,5)
+        ret, sure_fg = cv2.threshold(dist_transform,dist_fraction*dist_transform.max(),255,0) #threshold distance transform using 20% (dist_fraction) of max value in distance transform, can be modified
+    # plt.imshow(dist_transform, cmap="gray")
+    # plt.title('Distance Transform')
+    # plt.xticks([]),plt.yticks([])
+    # plt.show()
+
+    # plt.imshow(sure_fg, cmap="gray")
+    # plt.title('Sure Foreground')
+    # plt.xticks([]),plt.yticks([])
+    # plt.show()
+
+    ###Determine the unknown region for watershed segmentation by subtracting foreground from background
+    sure_fg = np.uint8(sure_fg)
+    unknown = cv2.subtract(sure_bg,sure_fg)
+    # plt.imshow(unknown, cmap="gray")
+    # plt.title('Unknown Region')
+    # plt.xticks([]),plt.yticks([])
+    # plt.show()
+
+    ### Marker labelling for watershed segmentation
+    with timed('markers'):
+        ret, markers = cv2.connectedComponents(sure_fg)
+        markers = markers+1 # Add one to all labels so that sure background is not 0, but 1
+        markers[unknown==255] = 0 # mark the region of unknown with zero
+    # plt.imshow(markers, cmap="jet")
+    # plt.title('Watershed')
+    # plt.xticks([]),plt.yticks([])
+    # plt.show()
+
+    ###Perform watershed segmenation
+    with timed('watershed'):
+        markers = cv2.watershed(img,markers)
+
+    return markers
+
+#%%
+def otsuThreshold(img_gray):
+
+    '''
+    otsuThreshold: Otsu threshold of a grayscale image of any integer bit depth (cv2.threshold only
+    takes 8-bit images for Otsu), from one np.bincount histogram with a bin for every gray level.
+    Pixels above the threshold are objects, as with cv2.THRESH_BINARY.
+    '''
+
+    hist=np.bincount(img_gray.ravel()).astype(np.float64)
+    levels=np.arange(len(hist))
+
+    ###between class variance for every possible threshold
+    w0=np.cumsum(hist) #pixels at or below the threshold
+    w1=w0[-1]-w0 #pixels above the threshold
+    sum0=np.cumsum(hist*levels)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        variance=w0*w1*(sum0/w0-(sum0[-1]-sum0)/w1)**2
+    variance[~np.isfinite(variance)]=0
+
+    return int(np.argmax(variance))
+
+#%%
+def scaleTo8bit(img_gray):
+
+    '''
+    scaleTo8bit: stretches a grayscale image of any bit depth between its min and max to 0-255, uint8,
+    in one pass (the astype('uint8') used for saving wraps values above 255 around instead)
+    '''
+
+    low,high=float(img_gray.min()),float(img_gray.max())
+    scale=255.0/(high-low) if high>low else 0.0
+
+    return cv2.convertScaleAbs(img_gray,alpha=scale,beta=-low*scale)
+
+#%%
+def loadFrame(imgPath):
+
+    '''
+    loadFrame: reads a saved image from file as a single channel image at the bit depth it was saved with
+    (8 or 16-bit), instead of the 3 channel 8-bit image loadImage returns
+    '''
+
+    with timed('read'):
+        return cv2.imread(imgPath,cv2.IMREAD_ANYDEPTH)
+
+#%%
+def segmentFrame(frame,dist_fraction=0.2):
+
+    '''
+    segmentFrame: same steps as segmentImage, on a grayscale frame at the bit depth of the camera.
+    The Otsu threshold is found on the full range of the frame (see otsuThreshold), and the frame
+    is only scaled to 8 bits for cv2.watershed, which takes nothing else.
+
+    inputs:
+        frame: grayscale image, e.g. uint16 from mmc.getImage(), a stack or loadFrame
+        dist_fraction: see segmentImage
+
+    returns:
+        markers: label image from cv2.watershed. 1 is the background, -1 are the boundaries
+    '''
+
+    with timed('threshold'):
+        thresh=np.uint8(frame>otsuThreshold(frame))*255
+    with timed('convert'):
+        img=cv2.cvtColor(scaleTo8bit(frame),cv2.COLOR_GRAY2BGR) #cv2.watershed needs a 3 channel 8-bit image
+
+    return watershedRegions(img,thresh,dist_fraction)
+
+#%%
+def isEmpty(img_gray,min_contrast=6.0):
+
+    '''
+    isEmpty: True if nothing in a fluorescent image is brighter than the background, so there is no need
+    to segment it. The background level and the pixel noise are measured on the image itself (median of
+    every 4th pixel and pixelNoise in Droplet_Localization.py), and the image is empty if its brightest
+    point, after a 3x3 blur to ignore single hot pixels, is less than min_contrast times the noise above
+    the background (default 6)
+    '''
+
+    with timed('empty check'):
+        background=float(np.median(img_gray[::4,::4]))
+        noise=max(pixelNoise(img_gray),1.0) #at least one gray level, for images with no noise
+
+        return float(cv2.blur(img_gray,(3,3)).max())<background+min_contrast*noise
+
+#%%
+def readAndSegment(imgPath,dist_fraction=0.2,frame=None,native_depth=False,box=None,empty_contrast=None):
+
+    '''
+    readAndSegment: reads an image and segments it
+
+    inputs:
+        imgPath: full path of the image file
+        dist_fraction: see segmentImage
+        frame: the image, if it is already in memory (e.g. a slice of an image stack), instead of imgPath
+        native_depth: if True, the image is segmented at its own bit depth with segmentFrame, otherwise it
+        is converted to 8 bits as arrayAcquisition saves it and segmented with segmentImage (default False)
+        box: (top, bottom, left, right) of the droplet (see locateDroplet in Droplet_Localization.py), only
+        this part of the image is segmented. default None (the whole image)
+        empty_contrast: if given, images that are empty (see isEmpty, with min_contrast=empty_contrast) 
+        are not segmented. default None (every image is segmented)
+
+    returns:
+        markers: label image from cv2.watershed, the size of the box if one is given, 
+        or None if the image is empty
+    '''
+
+    if native_depth:
+        if frame is None:
+            frame=loadFrame(imgPath)
+        if box is not None:
+            frame=frame[box[0]:box[1],box[2]:box[3]]
+        if empty_contrast is not None and isEmpty(frame,empty_contrast):
+            return None
+        return segmentFrame(frame,dist_fraction)
+
+    if frame is None:
+        img, img_gray = loadImage(imgPath)
+    else:
+        if box is not None: #crop before converting, so only the droplet is copied
+            frame=frame[box[0]:box[1],box[2]:box[3]]
+            box=None
+        img, img_gray = frameToImages(frame)
+    if box is not None:
+        img=np.ascontiguousarray(img[box[0]:box[1],box[2]:box[3]]) #cv2.watershed needs a contiguous image
+        img_gray=np.ascontiguousarray(img_gray[box[0]:box[1],box[2]:box[3]])
+    if empty_contrast is not None and isEmpty(img_gray,empty_contrast):
+        return None
+
+    return segmentImage(img,img_gray,dist_fraction)
+
+#%%
+def brightfieldPath(imgPath):
+
+    '''
+    brightfieldPath: file path of the brightfield image of the same droplet as a fluorescent image
+    '''
+
+    head,tail=os.path.split(imgPath)
+    return os.path.join(head,tail.replace('_FLimage','_BFimage'))
+
+#%%
+def findDropletBox(imgPath,pixels_to_um,crop,stack=None,index=None):
+
+    '''
+    findDropletBox: finds the droplet in the brightfield image that goes with a fluorescent image
+
+    inputs:
+        imgPath: full path of the fluorescent image
+        pixels_to_um: pixels per micron for the objective lens used (see pixelScale)
+        crop: (min, max) expected diameter of the droplets, in microns
+        stack, index: image stack and number of the image (character string) to read the brightfield
+        image from, instead of the file (default None)
+
+    returns:
+        box: (top, bottom, left, right) of the droplet, or None if no droplet was found
+    '''
+
+    if stack is not None:
+        bf=stack[int(index)-1,CHANNELS.index('BF')]
+    else:
+        bf=loadFrame(brightfieldPath(imgPath))
+
+    with timed('find droplet'):
+        return locateDroplet(bf,pixels_to_um,crop[0],crop[1])
+
+#%%
+def noDropletRow(index,imgPath,imgName):
+
+    '''
+    noDropletRow: row of the .csv file and message for an image with no droplet (see findDropletBox).
+    The image is flagged and its count is 0
+    '''
+
+    messages=["No droplet found in brightfield image, excluded from count. Location: {}\n\n".format(brightfieldPath(imgPath))]
+
+    return makeRow(index,0,'No droplet',[],[],imgPath,imgName), messages
+
+#%%
+def emptyRow(index,imgPath,imgName):
+
+    '''
+    emptyRow: row of the .csv file for an image found to be empty by isEmpty, the same row segmenting
+    an empty droplet gives: a count of 0, no flags and no objects
+    '''
+
+    return makeRow(index,0,'',[],[],imgPath,imgName), []
+
+#%%
+def measureRegions(markers,img_gray,pixels_to_um,diam_min,diam_max,imgPath):
+
+    '''
+    measureRegions: counts the objects in a watershed label image and checks their sizes, one region
+    at a time with skimage regionprops. measureRegionsBatch gives the same results faster.
+
+    returns:
+        cell_count: number of objects found (not including the background region)
+        check: flag to write to the .csv, '' if the image does not need a manual check
+        diameters: list of equivalent diameters, in microns
+        areas: list of areas, in microns^2
+        messages: flag messages to print for this image
+    '''
+
+    #define list which will contain characteristics for each image
+    with timed('regionprops'):
+        regions = measure.regionprops(markers,intensity_image=img_gray)
+
+    ###define some output variables
+
+    cell_count=-1 #a variable to keep track of the objects counted in each image
+                  #starts at -1 since regions counts the background as a separate object
+    size_check= 0 #acts as a flag for size
+    count_check= 0 #acts as a flag for cell count
+    check = '' #initialize check flag
+    diameters=[] #initialize list for diameters
+    areas=[] #initialize list for areas
+    messages=[] #initialize list for flag messages
+
+    ###Determine metrics of identified regions (first one is always the background region)
+    ###If the object is too small or too large to be confidently identified as a bead, flag the image for manual checking
+    for prop in regions:
+
+        if prop.equivalent_diameter/pixels_to_um < diam_min and prop.equivalent_diameter < 0.95*len(img_gray[1]):
+            messages.append("Flagged for manual check: Unidentified object in image. Location: {} \n\n".format(imgPath))
+            size_check = 1 #change the value of the flag
+        if prop.equivalent_diameter/pixels_to_um > diam_max and prop.equivalent_diameter < 0.95*len(img_gray[1]):
+            messages.append("Flagged for manual check: Unidentified object in image. Location: {} \n\n".format(imgPath))
+            size_check = 1 #change the value of the flag
+
+        #print("Label: {} Area: {} um^2 Equivalent Diameter:{} um".format(prop.label, prop.area/(pixels_to_um)**2, prop.equivalent_diameter/pixels_to_um))
+        #uncomment above line to print characteristic for each region in each image
+
+        ###Add diameters and areas to list as long as they are too small to be the background region
+        if prop.equivalent_diameter<0.95*len(img_gray[1]):
+            diameters.append(float(round(prop.equivalent_diameter/pixels_to_um,2)))
+
+        if prop.area<(0.85*len(img_gray[1]))**2:
+            areas.append(float(round(prop.area/(pixels_to_um)**2,2)))
+
+
+        cell_count=cell_count+1 #increasing the cell count variable for each object identified
+
+    ### Flag an object for manual checking if there is more than one cell identified
+    if cell_count>1:
+        messages.append("Flagged for manual check: More than one bead identified. Location: {}\n\n".format(imgPath))
+        count_check = 1 #change the value of the flag
+
+    ### Determine which (if any) flags to write to .csv
+    if size_check>0:
+        check='Size warning'
+    if count_check>0:
+        check='Count warning'
+    if size_check>0 and count_check>0:
+        check = 'Size and count warning'
+
+    return cell_count, check, diameters, areas, messages
+
+#%%
+def regionAreas(markers):
+
+    '''
+    regionAreas: area of every region of a watershed label image, in pixels, counted with one
+    np.bincount over the label image. Regions are in label order, the background region (label 1) first,
+    the same regions regionprops gives.
+    '''
+
+    ###count the pixels of each label. watershed boundaries are -1, so shift all labels up by one
+    with timed('measure'):
+        label_areas=np.bincount(markers.ravel()+1)[2:] #area of labels 1, 2, 3, ... (1 is the background)
+
+    return label_areas[label_areas>0].astype(np.float64) #regionprops skips labels with no pixels
+
+#%%
+def flagRegions(area,width,pixels_to_um,diam_min,diam_max,imgPath):
+
+    '''
+    flagRegions: counts the regions and checks their sizes, from their areas (see regionAreas).
+    The equivalent diameter is calculated from the area the same way regionprops does (sqrt(4*area/pi)),
+    and the size checks are done on the whole array of regions.
+
+    inputs:
+        area: area of each region in pixels, from regionAreas
+        width: width of the image in pixels, len(img_gray[1])
+
+    returns:
+        cell_count, check, diameters, areas, messages: see measureRegions
+    '''
+
+    equivalent_diameter=np.sqrt(4*area/np.pi)
+
+    cell_count=len(area)-1 #the background is counted as a separate region
+    size_check= 0 #acts as a flag for size
+    count_check= 0 #acts as a flag for cell count
+    check = '' #initialize check flag
+    messages=[] #initialize list for flag messages
+
+    ###If an object is too small or too large to be confidently identified as a bead, flag the image for manual checking
+    not_background=equivalent_diameter<0.95*width
+    too_small=(equivalent_diameter/pixels_to_um<diam_min) & not_background
+    too_large=(equivalent_diameter/pixels_to_um>diam_max) & not_background
+    nflagged=int(np.count_nonzero(too_small)+np.count_nonzero(too_large))
+    if nflagged>0:
+        messages.extend(["Flagged for manual check: Unidentified object in image. Location: {} \n\n".format(imgPath)]*nflagged)
+        size_check = 1 #change the value of the flag
+
+    ###Add diameters and areas to list as long as they are too small to be the background region
+    diameters=np.round(equivalent_diameter[not_background]/pixels_to_um,2).tolist()
+    areas=np.round(area[area<(0.85*width)**2]/(pixels_to_um)**2,2).tolist()
+
+    ### Flag an object for manual checking if there is more than one cell identified
+    if cell_count>1:
+        messages.append("Flagged for manual check: More than one bead identified. Location: {}\n\n".format(imgPath))
+        count_check = 1 #change the value of the flag
+
+    ### Determine which (if any) flags to write to .csv
+    if size_check>0:
+        check='Size warning'
+    if count_check>0:
+        check='Count warning'
+    if size_check>0 and count_check>0:
+        check = 'Size and count warning'
+
+    return cell_count, check, diameters, areas, messages
+
+#%%
+def measureRegionsBatch(markers,img_gray,pixels_to_um,diam_min,diam_max,imgPath):
+
+    '''
+    measureRegionsBatch: same as measureRegions, but measures all regions at once
+    (regionAreas then flagRegions). Gives the same .csv output as measureRegions.
+
+    returns:
+        cell_count, check, diameters, areas, messages: see measureRegions
+    '''
+
+    width=img_gray.shape[1] #same as len(img_gray[1]), the width of the image
+
+    return flagRegions(regionAreas(markers),width,pixels_to_um,diam_min,diam_max,imgPath)
+
+#%%
+def frameToImages(frame):
+
+    '''
+    frameToImages: converts a frame from mmc.getImage() to the same images loadImage returns for
+    the saved file, without writing the frame to a png and reading it back.
+
+    returns:
+        img: 3 channel version of the frame
+        img_gray: grayscale version of the frame
+    '''
+
+    with timed('convert'):
+        img_gray=frame.astype('uint8') #same conversion arrayAcquisition does before saving the image
+        img=cv2.cvtColor(img_gray, cv2.COLOR_GRAY2BGR) #cv2.imread also reads grayscale pngs as 3 channels
+
+    return img, img_gray
+
+#%%
+def analyzeImage(img,img_gray,index,imgPath,imgName,pixels_to_um,diam_min,diam_max,dist_fraction=0.2):
+
+    '''
+    analyzeImage: segments and measures one image, without plotting anything
+
+    inputs:
+        img, img_gray: images from loadImage or frameToImages
+        index: number of the image, character string
+        imgPath, imgName: full path and name of the image, written to the .csv file
+        dist_fraction: see segmentImage
+
+    returns:
+        row: dictionary with one entry per column of the .csv file
+        messages: flag messages to print for this image
+    '''
+
+    markers = segmentImage(img,img_gray,dist_fraction)
+    area = regionAreas(markers)
+    with timed('flag'):
+        cell_count, check, diameters, areas, messages = flagRegions(area,img_gray.shape[1],pixels_to_um,diam_min,diam_max,imgPath)
+
+    return makeRow(index,cell_count,check,diameters,areas,imgPath,imgName), messages
+
+#%%
+def analyzeFrame(frame,index,imgPath,imgName,pixels_to_um,diam_min,diam_max,dist_fraction=0.2):
+
+    '''
+    analyzeFrame: same as analyzeImage, for a frame at the bit depth of the camera (see segmentFrame)
+
+    returns:
+        row: dictionary with one entry per column of the .csv file
+        messages: flag messages to print for this image
+    '''
+
+    markers = segmentFrame(frame,dist_fraction)
+    area = regionAreas(markers)
+    with timed('flag'):
+        cell_count, check, diameters, areas, messages = flagRegions(area,markers.shape[1],pixels_to_um,diam_min,diam_max,imgPath)
+
+    return makeRow(index,cell_count,check,diameters,areas,imgPath,imgName), messages
+
+#%%
+def makeRow(index,cell_count,check,diameters,areas,imgPath,imgName):
+
+    '''
+    makeRow: dictionary with one entry per column of the .csv file
+    '''
+
+    return {'Image': index,
+            'Cell Count': cell_count,
+            'Flags': check,
+            'Diameters (microns)': diameters,
+            'Areas (microns^2)': areas,
+            'File Path': imgPath,
+            'File Name': imgName}
+
+#%%
+def analyzeImageFile(task):
+
+    '''
+    analyzeImageFile: reads, segments and measures one image from arrayAcquisition.
+    Used as the worker function of the process pool in DropletCellCount, so it takes
+    a single AnalysisTask and does not plot anything.
+
+    If a cache folder is given, the segmentation is looked up in the cache first (see
+    SegmentationCache in Result_Cache.py) and the image is only read and segmented if it is not there.
+
+    inputs:
+        task: AnalysisTask with the fields
+            index, imgPath, imgName: number (character string), full path and name of the image
+            pixels_to_um, diam_min, diam_max: see flagRegions
+            dist_fraction: see segmentImage
+            cache_dir: cache folder, None to not use the cache
+            segmentation_params: dictionary of the parameters the cache key is made from, with the hash 
+            of the image (see segmentationKey in Result_Cache.py)
+            sha1: hash of the image if it is already known, or None to work it out here (see taskHash)
+            stack_path: image stack to read the image from (see Image_Stack.py), or None to read imgPath
+            native_depth: see readAndSegment
+            crop: (min, max) expected diameter of the droplets in microns, to only segment the droplet found in
+            the brightfield image (see findDropletBox), or None to segment the whole image
+            empty_contrast: see readAndSegment, None to segment every image
+            profile: if True, each step is timed (see Step_Profiler.py)
+
+    returns:
+        row: dictionary with one entry per column of the .csv file
+        messages: flag messages to print for this image
+        sha1: hash of the image that was analyzed, for the manifest of the array
+        samples: time of each step (StepProfiler.samples), to merge into the profiler of the array,
+        or None if profile is False
+    '''
+
+    if not task.profile:
+        row, messages, sha1, markers = analyzeTask(task)
+        return row, messages, sha1, None
+
+    profiler=StepProfiler() #the times are sent back to the main process with the result
+    with profiling(profiler):
+        row, messages, sha1, markers = analyzeTask(task)
+
+    return row, messages, sha1, profiler.samples
+
+#%%
+def taskHash(task,stack=None):
+
+    '''
+    taskHash: sha1 of the image of a task, from the contents of its file (see fileHash in Array_Manifest.py)
+    or from its frame in the image stack (see frameHash in Image_Stack.py). task.sha1 if it is already known
+    '''
+
+    if task.sha1 is not None:
+        return task.sha1
+
+    with timed('hash'):
+        if task.stack_path is not None:
+            if stack is None:
+                stack=openStack(task.stack_path)
+            return frameHash(stack[int(task.index)-1,CHANNELS.index('FL')])
+        return fileHash(task.imgPath)
+
+#%%
+def analyzeTask(task,keep_markers=False,stack=None):
+
+    '''
+    analyzeTask: analyzeImageFile without the profiling. The steps for one image shared by the worker 
+    processes and by DropletCellCount with one worker, which also plots the segmented image
+
+    inputs:
+        task: AnalysisTask, see analyzeImageFile
+        keep_markers: if True, the watershed label image is returned too, e.g. to plot it. A cached result 
+        only has its label image read from the cache if keep_markers is True (default False)
+        stack: the image stack of task.stack_path if it is already open (default None, opened here)
+
+    returns:
+        row, messages, sha1: see analyzeImageFile
+        markers: label image from cv2.watershed, None if keep_markers is False or the image was not
+        segmented (no droplet, or empty)
+    '''
+
+    index, imgPath, imgName = task.index, task.imgPath, task.imgName
+    if task.stack_path is not None and stack is None:
+        stack=openStack(task.stack_path)
+    sha1=taskHash(task,stack) #worked out here, in the worker processes, rather than one image at a time before
+
+    cache=None
+    cached=None
+    if task.cache_dir is not None:
+        cache=SegmentationCache(task.cache_dir)
+        cache_key=segmentationKey(sha1,task.segmentation_params)
+        with timed('cache'):
+            if keep_markers:
+                cached=cache.get(cache_key)
+            else:
+                cached=cache.getAreas(cache_key) #the label image is not decompressed
+                if cached is not None:
+                    cached=(None,)+cached
+
+    if cached is not None:
+        markers,area,width=cached
+    else:
+        frame=None
+        if stack is not None: #slice of the memory-mapped stack, no file to decode
+            frame=stack[int(index)-1,CHANNELS.index('FL')]
+        box=None
+        if task.crop is not None:
+            box=findDropletBox(imgPath,task.pixels_to_um,task.crop,stack,index)
+            if box is None:
+                return noDropletRow(index,imgPath,imgName) + (sha1, None)
+        markers = readAndSegment(imgPath,task.dist_fraction,frame,task.native_depth,box,task.empty_contrast)
+        if markers is None: #empty, nothing to segment
+            return emptyRow(index,imgPath,imgName) + (sha1, None)
+        area=regionAreas(markers)
+        width=markers.shape[1]
+        if cache is not None:
+            with timed('cache'):
+                cache.put(cache_key,markers,area,width)
+
+    with timed('flag'):
+        cell_count, check, diameters, areas, messages = flagRegions(area,width,task.pixels_to_um,task.diam_min,task.diam_max,imgPath)
+
+    return makeRow(index,cell_count,check,diameters,areas,imgPath,imgName), messages, sha1, markers if keep_markers else None
+
+#%%
+def initWorker():
+
+    '''
+    initWorker: initializer for the worker processes of the process pool. OpenCV starts its own
+    thread pool inside each process by default, which oversubscribes the cores once there is
+    one worker process per core.
+    '''
+
+    cv2.setNumThreads(1)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import time
+from Shutter_Control import ShutterController
+
+'''
+Connection to the microscope and the shutter arduino, for arrayAcquisition_ShutterControl and
+acquireAndCount in Inkjet_Acquisition_Analysis.py.
+
+Nothing is connected when this file or Inkjet_Acquisition_Analysis.py is imported, so the analysis
+functions can be used on a computer with no microscope (and no MMCorePy or pyserial installed), and
+the worker processes of DropletCellCount start without touching the hardware. The micromanager core and
+the serial port are opened the first time they are used, and MMCorePy and serial are only imported then.
+
+ENSURE ShutterControlv2_lab.ino IS UPLOADED TO BOARD BEFORE OPENING A SESSION!!!
+'''
+
+CONFIG_FILE=r'C:\Program Files\Micro-Manager-2.0gamma\ES_WorkingConfig_Colour.cfg' #configuration file from micromanager
+PORT='COM20' #THIS PORT MAY CHANGE DEPENDING ON WHAT THE ARDUINO IS PLUGGED INTO.
+             #FIND OUT THE NAME OF THE PORT FROM ARDUINO > TOOLS > PORT.
+BAUD=9600
+
+#%%
+class HardwareSession(object):
+
+    '''
+    HardwareSession: the micromanager core, the serial connection to the arduino and the shutter,
+    each opened the first time it is used
+
+    inputs:
+        config_file: micromanager configuration file (default CONFIG_FILE)
+        port: serial port of the arduino (default PORT)
+        baud: baud rate of the serial connection (default 9600)
+        mmc: an already initialized micromanager core to use instead of loading config_file (default None)
+        arduino: an already open serial connection to use instead of opening port (default None)
+
+    attributes:
+        mmc: MMCorePy.CMMCore with all devices initialized
+        arduino: serial.Serial connection to the arduino
+        shutter: ShutterController on the arduino connection (see Shutter_Control.py)
+
+    usage:
+        with HardwareSession() as hardware: #the serial port is closed at the end of the block
+            arrayAcquisition_ShutterControl(...,session=hardware)
+            arrayAcquisition_ShutterControl(...,session=hardware) #same connection for the next array
+
+        hardware=HardwareSession(port='COM5')
+        hardware.open() #connect now instead of at the first image
+        ...
+        hardware.close()
+    '''
+
+    def __init__(self,config_file=CONFIG_FILE,port=PORT,baud=BAUD,mmc=None,arduino=None):
+        self.config_file=config_file
+        self.port=port
+        self.baud=baud
+        self._mmc=mmc
+        self._arduino=arduino
+        self._shutter=None
+
+    @property
+    def mmc(self):
+        if self._mmc is None:
+            import MMCorePy #imported here so the analysis can run without micromanager installed
+            mmc=MMCorePy.CMMCore()
+            print(mmc.getVersionInfo())
+            print(mmc.getAPIVersionInfo())
+
+            #load and initialize devices
+            mmc.loadSystemConfiguration(self.config_file)
+            mmc.initializeAllDevices()
+            self._mmc=mmc
+        return self._mmc
+
+    @property
+    def arduino(self):
+        if self._arduino is None:
+            import serial #imported here so the analysis can run without pyserial installed
+            arduino=serial.Serial(self.port,self.baud)
+            time.sleep(2) #There must be a 2 second delay after estabslishing serial port, reason below
+            #https://arduino.stackexchange.com/questions/58061/problem-sending-string-with-python-to-arduino-through-serial-port
+
+            #print port connected to arduino
+            print(arduino.name)
+            self._arduino=arduino
+        return self._arduino
+
+    @property
+    def shutter(self):
+        if self._shutter is None:
+            self._shutter=ShutterController(self.arduino) #shutter handshake over the serial connection
+        return self._shutter
+
+    def open(self):
+
+        '''
+        open: connects to the microscope and the arduino now, instead of when they are first used
+        '''
+
+        self.mmc
+        self.shutter
+        return self
+
+    def close(self):
+
+        '''
+        close: closes the serial connection to the arduino, if it was opened. The shutter is opened
+        again at its next use
+        '''
+
+        if self._arduino is not None:
+            self._arduino.close()
+            self._arduino=None
+            self._shutter=None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+#%%
+_default=[] #session used when none is given
+
+def defaultSession():
+
+    '''
+    defaultSession: the HardwareSession used by the acquisition functions when they are not given one,
+    made (but not connected) the first time it is asked for
+    '''
+
+    if not _default:
+        _default.append(HardwareSession())
+    return _default[0]
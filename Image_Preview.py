@@ -0,0 +1,121 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import cv2
+import numpy as np
+
+'''
+Displaying images during acquisition and analysis in Inkjet_Acquisition_Analysis.py.
+
+showImage plots an image in the spyder console/plot viewer. matplotlib is only imported the first
+time an image is shown, so runs with show=False never load a display backend.
+
+ContactSheet is the headless alternative: it keeps a small thumbnail of every droplet and writes
+them to a single image per array at the end.
+'''
+
+#%%
+def showImage(img,title=None,cmap='gray'):
+
+    '''
+    showImage: displays an image in the spyder console/plot viewer
+    '''
+
+    import matplotlib.pyplot as plt #imported here so it is only loaded when images are shown
+
+    plt.imshow(img, cmap=cmap)
+    if title is not None:
+        plt.title(title)
+        plt.xticks([]),plt.yticks([])
+    plt.show()
+
+#%%
+def thumbnail(img,size):
+
+    '''
+    thumbnail: grayscale 8-bit copy of an image, downsampled so its longest side is size pixels.
+    The contrast is stretched between the min and max of the image, so 12/16-bit frames are visible.
+    '''
+
+    if img.ndim==3:
+        img=cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+
+    scale=float(size)/max(img.shape)
+    small=cv2.resize(img,(max(1,int(round(img.shape[1]*scale))),max(1,int(round(img.shape[0]*scale)))),
+                     interpolation=cv2.INTER_AREA)
+
+    small=small.astype(np.float32)
+    low,high=small.min(),small.max()
+    if high>low:
+        small=(small-low)*(255.0/(high-low))
+
+    return small.astype(np.uint8)
+
+#%%
+class ContactSheet(object):
+
+    '''
+    ContactSheet: grid of thumbnails of the droplets of an array, with a caption on each, saved as one image.
+
+    inputs:
+        filename: file to save the contact sheet to (e.g. .png)
+        size: longest side of each thumbnail, in pixels (default 128)
+        ncols: number of thumbnails per row of the sheet (default: about square)
+
+    usage:
+        sheet=ContactSheet(filename)
+        sheet.add(nimg,img,caption) #for each droplet, nimg is the number of the image (1, 2, ...)
+        sheet.save() #once the array is done
+    '''
+
+    def __init__(self,filename,size=128,ncols=None):
+        self.filename=filename
+        self.size=size
+        self.ncols=ncols
+        self.thumbnails={} #image number: (thumbnail, caption)
+
+    def add(self,nimg,img,caption=None):
+
+        '''
+        add: adds the thumbnail of an image
+        '''
+
+        if caption is None:
+            caption=str(nimg).zfill(4)
+        self.thumbnails[nimg]=(thumbnail(img,self.size),caption)
+
+    def addFile(self,nimg,filename,caption=None):
+
+        '''
+        addFile: adds the thumbnail of an image file
+        '''
+
+        img=cv2.imread(filename,cv2.IMREAD_GRAYSCALE)
+        if img is not None:
+            self.add(nimg,img,caption)
+
+    def save(self):
+
+        '''
+        save: writes the contact sheet, thumbnails in order of image number. returns False if there is nothing to save
+        '''
+
+        if not self.thumbnails:
+            return False
+
+        numbers=sorted(self.thumbnails)
+        ncols=self.ncols or int(np.ceil(np.sqrt(len(numbers))))
+        nrows=int(np.ceil(len(numbers)/float(ncols)))
+        caption_height=14
+
+        cell_h=max(t.shape[0] for t,c in self.thumbnails.values())+caption_height
+        cell_w=max(t.shape[1] for t,c in self.thumbnails.values())
+        sheet=np.zeros((nrows*cell_h,ncols*cell_w),np.uint8)
+
+        for k,nimg in enumerate(numbers):
+            thumb,caption=self.thumbnails[nimg]
+            top=(k//ncols)*cell_h
+            left=(k%ncols)*cell_w
+            sheet[top:top+thumb.shape[0],left:left+thumb.shape[1]]=thumb
+            cv2.putText(sheet,caption,(left+2,top+cell_h-3),cv2.FONT_HERSHEY_PLAIN,0.8,255,1)
+
+        return cv2.imwrite(self.filename,sheet)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import numpy as np
+
+'''
+Raw image stack of an array, the alternative to one png per channel per droplet for
+arrayAcquisition_ShutterControl and DropletCellCount in Inkjet_Acquisition_Analysis.py.
+
+All images of an array are kept in one .npy file, array{label}_stack.npy in the image directory, shaped
+(droplets, channels, height, width) at the bit depth the camera gives (e.g. uint16). The file is
+memory-mapped: each frame from mmc.getImage() is copied straight into its place in the file, with no
+png encoding, and the analysis reads each frame back as a slice of the file, with no decoding.
+
+Droplet n (image number n, 1, 2, ...) is stack[n-1], channel 0 is BF and channel 1 is FL.
+
+The whole file is set aside when the first frame is written, (droplets x 2 x height x width) pixels,
+e.g. 5.4 GB for 1000 droplets of 1024 x 1344 16-bit frames. Frames that have not been captured are zero.
+'''
+
+CHANNELS=['BF','FL'] #order of the channels in the stack
+
+#%%
+def stackPath(directory,array_label):
+
+    '''
+    stackPath: file path of the image stack of an array
+    '''
+
+    return '{}/array{}_stack.npy'.format(directory,array_label)
+
+#%%
+def frameHash(frame):
+
+    '''
+    frameHash: sha1 of the pixels of a frame, hex string. Used in place of the file hash of a png
+    (see fileHash in Array_Manifest.py) for images kept in a stack
+    '''
+
+    return hashlib.sha1(np.ascontiguousarray(frame).data).hexdigest()
+
+#%%
+def openStack(filename):
+
+    '''
+    openStack: opens an image stack for reading, memory-mapped. stack[n-1, channel] is a view of the
+    frame in the file, only read from disk when it is used
+    '''
+
+    return np.load(filename,mmap_mode='r')
+
+#%%
+class ImageStack(object):
+
+    '''
+    ImageStack: writes the frames of an array into a memory-mapped stack file
+
+    If the file already exists (e.g. when resuming an array) it is opened and the frames in it are kept,
+    otherwise it is created when the first frame is written, with the size and type of that frame.
+
+    inputs:
+        filename: file path of the stack (see stackPath)
+        ndroplets: number of droplets in the array
+
+    usage:
+        stack=ImageStack(stackPath(directory,array_label),ndroplets)
+        sha1=stack.write(nimg,'FL',img) #for each image, returns frameHash(img)
+        stack.close() #flushes the frames to disk
+    '''
+
+    def __init__(self,filename,ndroplets):
+        self.filename=filename
+        self.ndroplets=ndroplets
+        self.stack=None
+        if os.path.exists(filename):
+            self.stack=np.load(filename,mmap_mode='r+')
+            if self.stack.shape[:2]!=(ndroplets,len(CHANNELS)):
+                raise ValueError('Stack {} holds {} droplets, not {}'.format(filename,self.stack.shape[0],ndroplets))
+
+    def write(self,nimg,channel,frame):
+
+        '''
+        write: copies a frame into the stack, as image number nimg (1, 2, ...) of a channel ('BF' or 'FL').
+        returns the sha1 of the frame (see frameHash)
+        '''
+
+        if self.stack is None:
+            shape=(self.ndroplets,len(CHANNELS))+frame.shape
+            self.stack=np.lib.format.open_memmap(self.filename,mode='w+',dtype=frame.dtype,shape=shape)
+        elif frame.shape!=self.stack.shape[2:]:
+            raise ValueError('Frame is {}, the stack holds {} frames'.format(frame.shape,self.stack.shape[2:]))
+
+        self.stack[nimg-1,CHANNELS.index(channel)]=frame
+
+        return frameHash(frame)
+
+    def close(self):
+
+        '''
+        close: writes any frames still in memory to disk
+        '''
+
+        if self.stack is not None:
+            self.stack.flush()
@@ -6,14 +6,26 @@ Created on Thu Apr  9 16:58:06 2020
 @author: emmastanley
 """
 
-import MMCorePy 
+import argparse
+import os
 import time 
-import serial
-import cv2
-import matplotlib.pyplot as plt
 import csv
+import multiprocessing
+import threading
 import numpy as np
-from skimage import color, measure
+from skimage import color
+from Image_Preview import showImage, ContactSheet
+from Acquisition_Pipeline import ImageWriter, DropletCountStream, writeImage
+from Array_Manifest import ArrayManifest
+from Hardware_Session import HardwareSession, defaultSession, CONFIG_FILE, PORT
+from Stage_Motion import StageSettler
+from Scan_Path import rectangularGrid, planPath, pathLength, loadPositions
+from Result_Cache import SegmentationCache
+from Results_Store import ResultsWriter, columnsPath
+from Image_Stack import ImageStack, stackPath, openStack, CHANNELS
+from Sequence_Acquisition import SequenceCamera
+from Step_Profiler import makeProfiler, profiling, startProfiling, stopProfiling, timed
+from Droplet_Segmentation import CSV_HEADERS, pixelScale, AnalysisTask, analyzeImageFile, analyzeTask, taskHash, initWorker
 
 '''
 Image acquisition and image analysis functions for a rectangular array of inkjet-printed
@@ -21,47 +33,49 @@ droplets are contained below.
 
 NOTE: This version of DropletCellCount does not include Empty Droplet Exclusion as discussed in my thesis. 
 - Emma 
-'''
-
-#%%
-########################
-
-mmc = MMCorePy.CMMCore()
-print(mmc.getVersionInfo())
-print(mmc.getAPIVersionInfo())
-
-########################
 
-#ENSURE ShutterControlv2_lab.ino IS UPLOADED TO BOARD BEFORE RUNNING THIS SCRIPT!!!
+Positions where no droplet was printed can be excluded with DropletCellCount(crop=True), which finds the 
+droplet in each brightfield image (see Droplet_Localization.py).
 
-#establish port and baud rate for serial connection
-port = 'COM20' #THIS PORT MAY CHANGE DEPENDING ON WHAT THE ARDUINO IS PLUGGED INTO.
-               #FIND OUT THE NAME OF THE PORT FROM ARDUINO > TOOLS > PORT.
-baud = 9600
-
-#open the serial connection to arduino
-arduino = serial.Serial(port, baud)
-time.sleep(2) #There must be a 2 second delay after estabslishing serial port, reason below
-#https://arduino.stackexchange.com/questions/58061/problem-sending-string-with-python-to-arduino-through-serial-port
+Importing this file does not connect to the microscope or the arduino: the acquisition functions connect 
+the first time they need to (see HardwareSession in Hardware_Session.py), and the analysis functions run 
+on a computer without the hardware. Run from the command line with acquire, count or acquire-count 
+(see main at the bottom of the file).
+'''
 
-#print port connected to arduino 
-print(arduino.name)
+##############################
 
-########################
+###USER INPUT PRIOR TO RUNNING FUNCTIONS
+###used by DropletCellCount, acquireAndCount and batchCount, so images are counted the same way 
+###whether they are analyzed from file or while the array is being acquired
+###Define min and max expected diameter for desired cell type in microns
+DIAM_MIN = 8
+DIAM_MAX = 18
+###Define the fraction of the max of the distance transform used as sure foreground for watershed segmentation
+DIST_FRACTION = 0.2
+###Define min and max expected diameter of the printed droplets in microns, used with crop=True
+DROPLET_DIAM_MIN = 50
+DROPLET_DIAM_MAX = 400
+###Define how far above the noise of the background (in multiples of the noise) a fluorescent image must be
+###to not be empty, used with skip_empty=True
+EMPTY_CONTRAST = 6
 
-#load and initialize devices
-mmc.loadSystemConfiguration('C:\Program Files\Micro-Manager-2.0gamma\ES_WorkingConfig_Colour.cfg') #imports configuration file from micromanager
-mmc.initializeAllDevices() 
+##############################
 
+MANIFEST_BLOCK=64 #number of analysis results written to the manifest of an array at a time
 
 #%%
-def arrayAcquisition_ShutterControl(ncols,nrows,dx,dy,expBF,expFL,array_label,directory):
+def arrayAcquisition_ShutterControl(ncols,nrows,dx,dy,expBF,expFL,array_label,directory,pipelined=False,queue_size=8,
+                                    fl_callback=None,save_images=True,show=True,order='pairs',settle='fixed',
+                                    positions=None,plan='serpentine',resume=False,preview=False,storage='png',
+                                    native_depth=False,session=None,profile=False,camera='snap',channel_config=None,
+                                    settle_time=0.5):
 
     '''
     
     arrayAcquisition: a function that acquires images with the currently initialized micromanager camera and stage
     in an XY array of a specified length and width, and displays the images in the spyder console/plot viewer. 
-    Images are saved to a specified directory with array and image labels (labelled sequentially in order of capture).
+    Images are saved to a specified directory with array and image labels (labelled sequentially in order of the droplets).
     
     the images are acquired from left to right on odd number rows, and right to left on even number rows, 
     and from top to bottom of array (starting in top left corner)
@@ -86,7 +100,8 @@ def arrayAcquisition_ShutterControl(ncols,nrows,dx,dy,expBF,expFL,array_label,di
     
     ShutterControl: opens and closes the shutter for the fluorescent laser via stepper motor. 
     sends a command to the arduino via serial connection and waits for the arduino to send a command
-    corresponding to open or closed position. enables the capture of both brightfield and fluorescent
+    corresponding to open or closed position (see ShutterController in Shutter_Control.py, raises a 
+    ShutterError if the arduino does not reply). enables the capture of both brightfield and fluorescent
     images from the same position on the array.
      
     inputs: 
@@ -98,6 +113,75 @@ def arrayAcquisition_ShutterControl(ncols,nrows,dx,dy,expBF,expFL,array_label,di
         expFL: exposure of camera for fluorescent images, in ms
         array_label: label of the array to append to saved files, character string or number
         directory: full file path of folder to save images to, character string 
+        pipelined: if True, the stage is sent to the next droplet as soon as the fluorescent image 
+        is in memory, and the images are converted and saved by a background writer thread 
+        (see ImageWriter in Acquisition_Pipeline.py) while the stage moves. The settle delay after a 
+        move is counted from when the move was sent, so plotting and saving happen inside it. 
+        default False
+        queue_size: maximum number of images waiting to be saved in pipelined mode (default 8)
+        fl_callback: function called with (image number, image) for each fluorescent image as soon as
+        it is captured, e.g. DropletCountStream.submit (default None)
+        save_images: if False, the images are not saved to file (default True)
+        show: if False, the images are not displayed and matplotlib is not loaded, for runs without 
+        a display (default True). Must be False if the function is not run from the main thread, 
+        since matplotlib is not thread safe
+        order: order of the shutter moves and images (default 'pairs')
+            'pairs': open shutter, BF image, close shutter, FL image at every droplet (2 shutter moves per droplet)
+            'alternate': BF then FL at one droplet, FL then BF at the next, so the shutter only moves 
+            once per droplet
+            'two-pass': all BF images with the shutter open, then the shutter is closed once and 
+            all FL images are captured on the way back through the array in reverse
+        images are numbered by droplet in every order, so DropletCellCount pairs them the same way
+        settle: how to wait for the stage after each move (default 'fixed'), see StageSettler in Stage_Motion.py
+            'fixed': settle_time delay after each move
+            'busy': wait until micromanager reports the stage is no longer busy
+            'sharpness': as 'busy', then snap images until their sharpness stops changing
+        the time waited after each move is saved to array{label}_settle.csv in the image directory
+        positions: XY stage positions of the droplets in microns, relative to the first droplet, for arrays
+        that are not a rectangular grid, e.g. from hexGrid or loadPositions in Scan_Path.py. ncols, nrows, 
+        dx and dy are not used if positions are given. images are numbered by the place of their droplet 
+        in positions. default None (rectangular ncols x nrows grid)
+        plan: order the droplets are visited in (default 'serpentine'), see planPath in Scan_Path.py
+            'serpentine': row by row, alternating direction (the order shown above for a rectangular grid)
+            'layout': the order of positions
+            'nearest': nearest droplet first
+            '2opt': nearest droplet first, then shortened with 2-opt
+        resume: if True, images that are already in the manifest of the array are not captured again, 
+        to carry on after the acquisition was interrupted (default False). Each channel is checked on its 
+        own, so with order='two-pass' the brightfield pass is not repeated after a stop during the 
+        fluorescent pass. The stage must be back on the first droplet, as for a new array, since positions 
+        are relative to it. 
+        preview: if True, a contact sheet with a thumbnail of every droplet is saved for each channel once 
+        the array is done, array{label}_BFpreview.png and array{label}_FLpreview.png in the image directory 
+        (see ContactSheet in Image_Preview.py). A quick check of the array when show is False. default False
+        storage: how the images are saved (default 'png')
+            'png': one png file per channel per droplet
+            'stack': all images in one memory-mapped file, array{label}_stack.npy in the image directory, 
+            at the bit depth of the camera (see ImageStack in Image_Stack.py). Frames are copied straight 
+            into the file, without png encoding. Analyze with DropletCellCount(storage='stack')
+        native_depth: if True, png images are saved at the bit depth of the camera (16-bit png for a 12 or 
+        16-bit camera) instead of with astype('uint8'), which wraps values above 255 around. Analyze with 
+        DropletCellCount(native_depth=True). Stacks are always at the bit depth of the camera. default False
+        session: HardwareSession with the microscope and shutter to use (see Hardware_Session.py), kept open 
+        for the next array. default None (the default session, connected on first use and its serial port 
+        closed once the array is finished)
+        profile: if True, the time of each step of the acquisition (shutter, exposure, snap, get image, show, 
+        encode, write, move, settle) is recorded, and the count, total, median, 90th and 99th percentile time 
+        of each step is printed and saved to array{label}_profile.json and .csv in the image directory 
+        (see Step_Profiler.py). A StepProfiler can be given instead of True. default False
+        camera: how images are taken (default 'snap')
+            'snap': mmc.snapImage() and mmc.getImage() for every image
+            'sequence': the camera runs a continuous sequence acquisition and each image is the first frame 
+            from the circular buffer exposed after the stage settled and the shutter moved (see SequenceCamera 
+            in Sequence_Acquisition.py), without a software round trip per image. The sequence is restarted 
+            when the channel changes, so use it with order='two-pass'. Cannot be used with settle='sharpness'
+        the camera is only set up (exposure, channel_config) when the channel changes, not before every image
+        channel_config: micromanager configuration group and preset to apply for each channel, e.g. 
+        {'BF': ('Channel','BF'), 'FL': ('Channel','FL')}, set along with the exposure (with camera='sequence', while the sequence is stopped). default None
+        settle_time: delay after each move with settle='fixed', in s (default 0.5)
+        
+    every captured image is recorded in array{label}_manifest.jsonl in the image directory, with the
+    stage position, exposure and file hash (see ArrayManifest in Array_Manifest.py)
         
     requirements:
         XY stage and camera must be loaded and initialized 
@@ -108,190 +192,315 @@ def arrayAcquisition_ShutterControl(ncols,nrows,dx,dy,expBF,expFL,array_label,di
         matplotlib
         time
         serial
-        
-    Note: There are some redunancies in the code that can be re-written to create a more concise function. 
-    I did not attempt to re-work it since I was not able to validate that it would still work effectively due to lab shutdowns.
-    -Emma
+        threading
 
     '''    
     
+    ###check the options before connecting to anything
+    if order not in ('pairs','alternate','two-pass'):
+        raise ValueError("order must be 'pairs', 'alternate' or 'two-pass'")
+    if settle not in ('fixed','busy','sharpness'):
+        raise ValueError("settle must be 'fixed', 'busy' or 'sharpness'")
+    if plan not in ('serpentine','layout','nearest','2opt'):
+        raise ValueError("plan must be 'serpentine', 'layout', 'nearest' or '2opt'")
+    if storage not in ('png','stack'):
+        raise ValueError("storage must be 'png' or 'stack'")
+    if camera not in ('snap','sequence'):
+        raise ValueError("camera must be 'snap' or 'sequence'")
+    if camera=='sequence' and settle=='sharpness':
+        raise ValueError("settle='sharpness' snaps images, it cannot be used with camera='sequence'")
+
+    ###microscope and shutter, connected the first time they are used
+    own_session=session is None
+    if own_session:
+        session=defaultSession()
+    mmc=session.mmc
+    shutter=session.shutter
+    
     ###set relative position of stage to 0,0
     mmc.setOriginXY() 
     print(mmc.getXYPosition('XYStage'))  
  
-   
-    colcount=1 #a variable to index the current column
-    rowcount=1 # a variable to index the current row 
-    
-    nobjects=nrows*ncols #determine how many objects are in the array
     nimgs_bf=0 #a variable to keep track of the number of brightfield images captured
     nimgs_fl=0 #a variable to keep track of the number of fluorescent images captured
-
-
-
-    while rowcount<=nrows: #while current row index is within the specified array size
+    
+    settler=StageSettler(mmc,settle,settle_time=settle_time) #waits after moving stage to allow the camera to focus
+    
+    
+    ###droplet positions and the order they are visited in (see Scan_Path.py)
+    if positions is None:
+        positions=rectangularGrid(ncols,nrows,dx,dy)
+    positions=np.asarray(positions,dtype=float)
+    nobjects=len(positions) #determine how many objects are in the array
+    
+    visit_order=planPath(positions,plan)
+    print('Stage travel: {:.0f} um'.format(pathLength(positions,visit_order)))
+    
+    ###each entry is (droplet number, x, y). the droplet number is its place in positions, not in the path
+    path=[(i+1,positions[i,0],positions[i,1]) for i in visit_order]
+    
+    ###record of the captured images, and which images can be skipped when resuming
+    manifest=ArrayManifest(directory,array_label)
+    todo=dict((nimg,['BF','FL']) for nimg, x, y in path) #channels still to capture at each droplet
+    nskipped={'BF': 0, 'FL': 0}
+    if resume:
+        for nimg, x, y in path:
+            index=str(nimg).zfill(4)
+            for channel in CHANNELS:
+                if manifest.isCaptured(index,channel):
+                    todo[nimg].remove(channel)
+                    nskipped[channel]=nskipped[channel]+1
+        path=[(nimg,x,y) for nimg, x, y in path if todo[nimg]]
+        print('{} brightfield and {} fluorescent images already captured, resuming with {} droplets'.format(
+              nskipped['BF'],nskipped['FL'],len(path)))
+        if not path:
+            if own_session:
+                session.close()
+            return
+    manifest.recordAcquisition(nobjects) #so other programs can tell the array is not complete yet (see Batch_Analysis.py)
+    
+    ###channels to capture at each droplet on each pass over the array
+    if order=='pairs': #open-BF-close-FL at every droplet
+        passes=[(path,['BF','FL'])]
+    elif order=='alternate': #BF-close-FL at one droplet, FL-open-BF at the next
+        passes=[(path,None)]
+    else: #two-pass: all BF images with the shutter open, then all FL images on the way back
+        passes=[([visit for visit in path if 'BF' in todo[visit[0]]],['BF']),
+                ([visit for visit in path[::-1] if 'FL' in todo[visit[0]]],['FL'])]
+    
+    
+    if storage=='stack':
+        stack=ImageStack(stackPath(directory,array_label),nobjects) #frames are copied into one memory-mapped file
+    
+    profiler=makeProfiler(profile,array_label) #time of each step, None if not profiling
+    startProfiling(profiler) #before the writer is started, so its thread times into the same profiler
+    
+    use_writer=pipelined and save_images and storage=='png'
+    if use_writer:
+        writer=ImageWriter(queue_size,native_depth) #saves images in the background
+    
+    def captureRecorder(nimg,channel,label,x,y,exposure):
+        if not save_images:
+            filename=None
+        elif storage=='stack':
+            filename=stack.filename
+        else:
+            filename=label
+        def record(sha1): #called once the image is saved
+            manifest.recordCapture(str(nimg).zfill(4),channel,filename,(x,y),exposure,sha1)
+        return record
+    
+    if preview: #thumbnails of each channel, saved once the array is done
+        sheets={'BF': ContactSheet('{}/array{}_BFpreview.png'.format(directory,array_label)),
+                'FL': ContactSheet('{}/array{}_FLpreview.png'.format(directory,array_label))}
+    
+    def saveImage(label,img,record,nimg,channel):
+        if show:
+            with timed('show'):
+                showImage(img) #show image in spyder viewer
+        if preview:
+            with timed('preview'):
+                sheets[channel].add(nimg,img)
         
-        if colcount<=ncols and (rowcount%2)!=0: #if there are more columns in the array and row number is odd
-            
-            ###ensure shutter is open for brightfield image to be acquired
-            
-            arduino.write('a') #send command for opening shutter
-            data = arduino.readline() #read data from serial port
-            while data != 'o\r\n': #wait for shutter to finish opening. \r\n are characters that get appended to data sent from Arduino
-                pass
-            if data == 'o\r\n':
-                print ('Shutter is open')
-                
-            ###acquire brightfield image from camera
-            
-            mmc.setExposure(expBF)
+        if not save_images:
+            record(None)
+        elif storage=='stack':
+            with timed('write'):
+                sha1=stack.write(nimg,channel,img) #a copy into the file, quick enough to do on this thread
+            record(sha1)
+        elif use_writer:
+            with timed('queue'): #only takes time if the writer thread falls behind
+                writer.put(label,img,record) #converted and saved by the writer thread
+        else:
+            record(writeImage(label,img,native_depth)) #save image
+
+
+    if camera=='sequence':
+        sequence=SequenceCamera(mmc) #frames streamed from the camera
+    camera_channel=[None] #channel the camera is set up for
+    snapped=[True] #an image was taken since the last stage move
+    
+    def captureImage(channel,exposure):
+        if camera_channel[0]!=channel: #set up the camera for the channel
+            with timed('exposure'):
+                if camera=='sequence':
+                    sequence.stop() #most cameras do not take property changes while a sequence acquisition runs
+                if channel_config is not None and channel in channel_config:
+                    group,preset=channel_config[channel]
+                    mmc.setConfig(group,preset)
+                    mmc.waitForConfig(group,preset)
+                if camera=='sequence':
+                    sequence.start(exposure)
+                else:
+                    mmc.setExposure(exposure)
+            camera_channel[0]=channel
+        
+        snapped[0]=True
+        if camera=='sequence':
+            with timed('frame'):
+                return sequence.nextFrame()
+        with timed('snap'):
             mmc.snapImage() 
-            img = mmc.getImage()
-            nimgs_bf=nimgs_bf+1 
-            
-            plt.imshow(img, cmap='gray') #show image in spyder viewer
-            plt.show()
-            
-            label='{}/array{}_BFimage{}.png'.format(directory,array_label,str(nimgs_bf).zfill(4))
-            img=img.astype('uint8') #convert image to a format that imwrite can use
-            cv2.imwrite(label,img) #save image
-            
-            print('Brightfield image {} captured.'.format(nimgs_bf))
-            
-            ###close shutter to acquire fluroescent image
-            
-            arduino.write('z') #send command for closing shutter
-            data = arduino.readline()
-            while data != 'c\r\n': #wait for shutter to finish closing. \r\n are characters that get appended to data sent from Arduino
-                pass
-            if data == 'c\r\n':
-                print ('Shutter is closed')
+        with timed('get image'):
+            return mmc.getImage()
     
-            
-            ###acquire fluorescent image from camera
-            
-            mmc.setExposure(expFL)
-            mmc.snapImage() 
-            img = mmc.getImage()
-            nimgs_fl=nimgs_fl+1 
-            
-            plt.imshow(img, cmap='gray') #show image in spyder viewer 
-            plt.show()
-            
-            label='{}/array{}_FLimage{}.png'.format(directory,array_label,str(nimgs_fl).zfill(4))
-            img=img.astype('uint8') #convert image to a format that imwrite can use
-            cv2.imwrite(label,img) #save image
-            
-            print('Fluorescent image {} captured.'.format(nimgs_fl))
-            
-            
-            ###move position of the stage to the next droplet
-            if colcount<ncols: #as long as the column is not the last column in the array
-                mmc.setRelativeXYPosition('XYStage',-dx,0) #move dx units left (camera centers on droplet to the right)
-                print(mmc.getXYPosition('XYStage')) #print position of stage after horizontal movement
+    try:
+        current=(0.0,0.0) #position the stage was last sent to
         
-            colcount=colcount+1 #increase column index
-            
-            time.sleep(0.5) #brief delay after moving stage to allow the camera to focus
+        def moveStage(x,y):
+            with timed('move'):
+                if (y!=current[1] or not snapped[0]) and camera=='snap': #moving to another row, or two moves back to back (no snaps while a sequence acquisition runs)
+                    ###kept before every change of row as in the original acquisition until it is checked on the microscope which moves need it
+                    mmc.snapImage() #the program needs a placeholder as it doesn't want two stage movement commands back to back (not sure why). snapimage does not actually capture an image unless it is followed by getimage.
+                mmc.setXYPosition('XYStage',x,y) #positions are relative to the origin set above
+                print(mmc.getXYPosition('XYStage')) #print position of stage after movement
+            snapped[0]=False
+            return time.time()
+        
+        for visits, channels in passes:
             
+            if not visits: #every image of this pass was captured before resuming
+                continue
             
-        if colcount<=ncols and (rowcount%2)==0: #if there are more columns in the array and the row number is even
-           
-           ###ensure shutter is openfor brightfield image to be acquired
+            ###go to the first droplet of the pass, if the stage is not already there
+            if (visits[0][1],visits[0][2])!=current:
+                moved=moveStage(visits[0][1],visits[0][2])
+                current=(visits[0][1],visits[0][2])
+                with timed('settle'):
+                    settler.settle(moved)
             
-            arduino.write('a') #send command for opening shutter
-            data = arduino.readline()
-            while data != 'o\r\n': #wait for shutter to finish opening.\r\n are characters that get appended to data sent from Arduino
-                pass
-            if data == 'o\r\n':
-                print ('Shutter is open')
+            for k, (nimg, x, y) in enumerate(visits):
                 
-            
-            ###acquire brightfield image from camera
-            
-            mmc.setExposure(expBF)
-            mmc.snapImage() 
-            img = mmc.getImage()
-            nimgs_bf=nimgs_bf+1 
-            
-            plt.imshow(img, cmap='gray') #show image in spyder viewer 
-            plt.show()
-            
-            label='{}/array{}_BFimage{}.png'.format(directory,array_label,str(nimgs_bf).zfill(4))
-            img=img.astype('uint8') #convert image to a format that imwrite can use
-            cv2.imwrite(label,img) #save image
-            
-            
-            print('Brightfield image {} captured.'.format(nimgs_bf))
-            
-            
-            ###close shutter to acquire fluroescent image
-            
-            arduino.write('z') #send command for opening shutter
-            data = arduino.readline()
-            while data != 'c\r\n': #wait for shutter to finish closing. \r\n are characters that get appended to data sent from Arduino
-                pass
-            if data == 'c\r\n':
-                print ('Shutter is closed')
-    
-            ###acquire fluorescent image from camera
-            
-            mmc.setExposure(expFL)
-            mmc.snapImage() 
-            img = mmc.getImage()
-            nimgs_fl=nimgs_fl+1 
-            
-            plt.imshow(img, cmap='gray') #show image in spyder viewer 
-            plt.show()
-            
-            label='{}/array{}_FLimage{}.png'.format(directory,array_label,str(nimgs_fl).zfill(4))
-            img=img.astype('uint8') #convert image to a format that imwrite can use
-            cv2.imwrite(label,img) #save image
-            
-            print('Fluorescent image {} captured.'.format(nimgs_fl))
-            
-            ###move position of the stage
-            if colcount<ncols: #as long as the column is not the last column in the array
-                mmc.setRelativeXYPosition('XYStage', dx,0) #move dx units right (camera centers on droplet to the left)
-                print(mmc.getXYPosition('XYStage')) #print position of stage after horizontal movement
-            
-            colcount=colcount+1 #increase column index
-            
-            time.sleep(0.5) #brief delay after moving stage to allow camera to focus
-            
-            
-            
-        if colcount>ncols: #if the column index exceeds the number of columns in the array 
-            
-            mmc.snapImage() #the program needs a placeholder as it doesn't want two stage movement commands back to back (not sure why). snapimage does not actually capture an image unless it is followed by getimage.
-            
-            mmc.setRelativeXYPosition('XYStage',0,-dy) #move dy units down (to next row)
-            print(mmc.getXYPosition('XYStage')) #print position  of stage after horizontal movement 
-            
-            colcount=1 #reset column index to 1 
-            rowcount=rowcount+1 #increase row index 
-    
-            time.sleep(0.5) #brief delay after moving stage to allow camera to focus
-            
-            
-    arduino.close() #close the serial port connection once while loop is exited 
-    
-    
-    if nimgs_bf!=nimgs_fl:
+                if channels is None: #alternate order, start with the channel the shutter is already set for
+                    if shutter.position=='closed':
+                        droplet_channels=['FL','BF']
+                    else:
+                        droplet_channels=['BF','FL']
+                else:
+                    droplet_channels=channels
+                droplet_channels=[channel for channel in droplet_channels if channel in todo[nimg]]
+                
+                captured=[] #(label, image, message) of the images captured at this droplet
+                
+                for channel in droplet_channels:
+                    
+                    if channel=='BF':
+                        ###ensure shutter is open for brightfield image to be acquired
+                        with timed('shutter'):
+                            shutter.openShutter() #send command for opening shutter and wait for it to finish opening
+                        print ('Shutter is open')
+                        
+                        ###acquire brightfield image from camera
+                        exposure=expBF
+                        img = captureImage(channel,exposure)
+                        nimgs_bf=nimgs_bf+1 
+                        message='Brightfield image {} captured.'.format(nimg)
+                        
+                    else:
+                        ###close shutter to acquire fluroescent image
+                        with timed('shutter'):
+                            shutter.closeShutter() #send command for closing shutter and wait for it to finish closing
+                        print ('Shutter is closed')
+                        
+                        ###acquire fluorescent image from camera
+                        exposure=expFL
+                        img = captureImage(channel,exposure)
+                        nimgs_fl=nimgs_fl+1 
+                        message='Fluorescent image {} captured.'.format(nimg)
+                        
+                        if fl_callback is not None:
+                            fl_callback(nimg,img) #hand the image over straight from memory
+                    
+                    #images are numbered by droplet, so BF and FL images of a droplet always have the same number
+                    label='{}/array{}_{}image{}.png'.format(directory,array_label,channel,str(nimg).zfill(4))
+                    record=captureRecorder(nimg,channel,label,x,y,exposure)
+                    
+                    if pipelined:
+                        captured.append((label,img,message,record,nimg,channel))
+                    else:
+                        saveImage(label,img,record,nimg,channel)
+                        print(message)
+                
+                ###move position of the stage to the next droplet
+                if k+1<len(visits):
+                    nextx,nexty=visits[k+1][1],visits[k+1][2]
+                    moved=moveStage(nextx,nexty)
+                    current=(nextx,nexty)
+                
+                    if pipelined:
+                        ###show and save the images while the stage moves
+                        for label, img, message, record, nimg, channel in captured:
+                            saveImage(label,img,record,nimg,channel)
+                            print(message)
+                    
+                    with timed('settle'):
+                        settler.settle(moved) #brief delay after moving stage to allow the camera to focus
+                        
+                else: #last droplet of a pass
+                    for label, img, message, record, nimg, channel in captured:
+                        saveImage(label,img,record,nimg,channel)
+                        print(message)
+                
+    finally:
+        if camera=='sequence':
+            sequence.stop()
+        if use_writer:
+            writer.close() #wait for the last images to be saved
+        if storage=='stack':
+            stack.close()
+            
+        if own_session:
+            session.close() #close the serial port connection once the array is finished
+        shutter.printLatencies() #time taken by the shutter moves, to tune the servo sweep
+        settler.printSummary() #time spent waiting for the stage
+        settler.writeLog('{}/array{}_settle.csv'.format(directory,array_label))
+        if preview:
+            sheets['BF'].save()
+            sheets['FL'].save()
+        stopProfiling(profiler)
+        if profiler is not None:
+            profiler.printSummary()
+            profiler.writeReport('{}/array{}_profile.json'.format(directory,array_label))
+            profiler.writeReport('{}/array{}_profile.csv'.format(directory,array_label))
+    
+    
+    if nimgs_bf+nskipped['BF']!=nimgs_fl+nskipped['FL']:
         print('Error: Different number of brightfield and fluroescent images captured')
         
-    if nimgs_bf==nimgs_fl:
+    else:
         
-        if nobjects!=nimgs_bf: 
+        if nobjects!=nimgs_bf+nskipped['BF']: 
             print('Error: Not all objects in array were captured.')
         else:
-            print('{} bright field and {} fluorescent images were captured.').format(nimgs_bf, nimgs_fl)
+            print('{} bright field and {} fluorescent images were captured.'.format(nimgs_bf, nimgs_fl))
     
         
     return 
 
 #%%
-def DropletCellCount(directory,array_label,nrows,ncols,mag):
+def analysisParams(pixels_to_um,native_depth=False,crop=False,skip_empty=False):
+    
+    '''
+    analysisParams: dictionary of the analysis parameters DropletCellCount records in the manifest of an 
+    array with the result of each image (see ArrayManifest in Array_Manifest.py), from the user inputs at 
+    the top of the file and the options of DropletCellCount. A recorded result is only used again if its 
+    parameters are the same
+    '''
+    
+    params={'pixels_to_um': pixels_to_um, 'diam_min': DIAM_MIN, 'diam_max': DIAM_MAX, 'dist_fraction': DIST_FRACTION}
+    if native_depth:
+        params['native_depth']=True
+    if crop:
+        params['droplet_diam']=[DROPLET_DIAM_MIN,DROPLET_DIAM_MAX]
+    if skip_empty:
+        params['empty_contrast']=EMPTY_CONTRAST
+    
+    return params
+
+#%%
+def DropletCellCount(directory,array_label,nrows,ncols,mag,nworkers=1,resume=False,cache_dir=None,cache_size=2*1024**3,
+                     show=True,preview=False,columnar=False,storage='png',native_depth=False,crop=False,
+                     skip_empty=False,profile=False,pool=None,output_dir='.'):
     
     '''
     DropletCellCount_Watershed: a function designed to be used for determining
@@ -299,6 +508,7 @@ def DropletCellCount(directory,array_label,nrows,ncols,mag):
     captured with arrayAcquisition
     
     Lines of code to display each step of image processing are included but commented out 
+    (see segmentImage in Droplet_Segmentation.py)
     
     inputs:
         directory: full file path of folder that images from arrayAcquisition were
@@ -308,6 +518,55 @@ def DropletCellCount(directory,array_label,nrows,ncols,mag):
         ncols: number of columns in the array
         nrows: number of rows in the array 
         mag: objective lens used for image capture, either '10x', '20x', or '40x'
+        nworkers: number of processes to analyze the images with (default 1). With more than 
+        one worker the images are split over a multiprocessing pool and the segmented images 
+        are not plotted. The counts and the rows of the .csv file are the same, and in the same 
+        order, as with one worker.
+        resume: if True, images that were analyzed before from the same file contents with the same 
+        parameters are not analyzed again, their rows are taken from the manifest of the array (default False)
+        cache_dir: folder to cache segmentation results in, keyed by image contents and segmentation 
+        parameters (see SegmentationCache in Result_Cache.py). With a cache, changing only diam_min, diam_max 
+        or mag re-flags the images from the cached region areas without segmenting them again (with crop=True 
+        the crop box depends on mag, so changing mag segments the images again). default None (no cache)
+        cache_size: size limit of the cache folder in bytes, least recently used results are deleted
+        once the array is done (default 2 GB)
+        show: if False, the segmented images are not plotted and matplotlib is not loaded (default True).
+        The segmentation is the same either way, plotting only slows the analysis down.
+        preview: if True, a contact sheet with a thumbnail of every fluorescent image captioned with its 
+        count (* if flagged for checking) is saved as CellCount_array{label}_preview.png (default False)
+        columnar: if True, the results are also saved as flat numeric arrays in CellCount_array{label}_columns, 
+        one table of images and one list of object diameters and areas, which loadResults in Results_Store.py 
+        memory-maps and filters across many arrays without parsing the .csv text (default False)
+        storage: 'png' to read the images from their png files, or 'stack' to read them as slices of the 
+        memory-mapped array{label}_stack.npy saved by arrayAcquisition_ShutterControl(storage='stack'), 
+        with no files to decode (default 'png'). The file path and name columns are the png the image 
+        would have been saved to.
+        native_depth: if True, the images are segmented at the bit depth they were saved with (16-bit pngs 
+        from arrayAcquisition_ShutterControl(native_depth=True), or stacks), with the Otsu threshold found on the 
+        full range of the image. Only the copy given to cv2.watershed is scaled to 8 bits (see segmentFrame in 
+        Droplet_Segmentation.py). default False (images converted to 8 bits with astype('uint8') as before)
+        crop: if True, the droplet is found in the brightfield image of each droplet (Hough circle transform 
+        on a downsampled copy, see Droplet_Localization.py) and only the part of the fluorescent image inside 
+        its bounding box is segmented. Images with no droplet are flagged 'No droplet' with a count of 0. 
+        Needs the brightfield images. default False (the whole image is segmented)
+        skip_empty: if True, each fluorescent image is first checked for anything brighter than its own 
+        background level (see isEmpty in Droplet_Segmentation.py), and empty images are given a count of 0 
+        straight away without being segmented. default False
+        profile: if True, the time of each step of the analysis (read, threshold, distance transform, watershed, 
+        measure, ...) is recorded for every image, in the worker processes too, and the count, total, median, 
+        90th and 99th percentile time of each step is printed and saved to CellCount_array{label}_profile.json 
+        and .csv (see Step_Profiler.py). A StepProfiler can be given instead of True, e.g. one with a hook that 
+        sends the times to another metrics collector. default False (the timers do nothing)
+        pool: a multiprocessing pool (started with initializer=initWorker) to analyze the images with, instead 
+        of starting one, e.g. one pool shared by many arrays (see Batch_Analysis.py). It is left running. 
+        nworkers should be its number of processes. default None
+        output_dir: folder the .csv file and the other CellCount_array{label} outputs are saved to 
+        (default '.', the working directory)
+        
+    the result for each image is recorded in array{label}_manifest.jsonl in the image directory, 
+    with the file hash of the image (see ArrayManifest in Array_Manifest.py). The hashes are worked out 
+    by the worker processes along with the analysis, and the results are written to the manifest 
+    MANIFEST_BLOCK images at a time
         
     returns: 
         count: an array where each space corresponds to the number of objects counted in 
@@ -318,227 +577,415 @@ def DropletCellCount(directory,array_label,nrows,ncols,mag):
         import cv2
         import numpy as np
         from skimage import color, measure
+        import multiprocessing
     '''
 
     
-    ##############################
-   
-    ###USER INPUT PRIOR TO RUNNING FUNCTION
-    ###Define min and max expected diameter for desired cell type in microns
-    diam_min = 8
-    diam_max = 18
-    
-    ##############################
+    ###user inputs, set at the top of the file
+    diam_min = DIAM_MIN
+    diam_max = DIAM_MAX
+    dist_fraction = DIST_FRACTION
+    droplet_diam_min = DROPLET_DIAM_MIN
+    droplet_diam_max = DROPLET_DIAM_MAX
+    empty_contrast = EMPTY_CONTRAST
     
     
     nimgs=ncols*nrows #define number of images to pull from file
     count = np.zeros(nimgs) #initialize array for object count data 
     
+    profiler=makeProfiler(profile,array_label) #time of each step, None if not profiling
     
-    ###define equivalent area in microns, depending on objective lens used
-    ###specific apertures should be added and pixel to um scale confirmed for future use 
-    
-    if mag=='40x' or mag=='40X':
-        pixels_to_um=7.68
-    elif mag=='20x' or mag == '20X':
-        pixels_to_um=2.2
-    elif mag=='10x' or mag == '10X':
-        pixels_to_um=1.0568
-    else:
-        pixels_to_um=1
-        print('Magnification incorrectly entered - measurements will be displayed in pixels.')
-        pixels_to_um=1
+    pixels_to_um=pixelScale(mag) #pixels per micron for the objective lens used
  
     ###labels for image path to match the format it was saved as 
     array= 'array'+str(array_label)
     extension = '.png'
     
+    ###segmentation results are cached by image contents and segmentation parameters
+    if cache_dir is not None:
+        cache=SegmentationCache(cache_dir,cache_size)
+    segmentation_params={'dist_fraction': dist_fraction}
+    if native_depth:
+        segmentation_params['native_depth']=True #left out otherwise, so earlier cached results still match
+    if crop:
+        segmentation_params['droplet_diam']=[droplet_diam_min,droplet_diam_max]
+        segmentation_params['pixels_to_um']=pixels_to_um #the droplet sizes are converted to pixels to find the crop box
+    if skip_empty:
+        segmentation_params['empty_contrast']=empty_contrast
+    
+    if storage=='stack':
+        stack_path=stackPath(directory,array_label)
+        stack=openStack(stack_path) #frames are read from the file as they are used
+    elif storage=='png':
+        stack_path=None
+    else:
+        raise ValueError("storage must be 'png' or 'stack'")
+    
+    ###list of images to analyze, in the order they were captured
+    ###the hash of each image (for the cache key and the manifest) is worked out with its analysis, in the workers
+    tasks=[]
+    for i in range(nimgs):
+        index=str(i+1).zfill(4) #number of the image
+        imgName=array+'_FLimage'+index+extension #name of the image
+        imgPath=directory+'/'+imgName #full path of the image
+        tasks.append(AnalysisTask(index=index, imgPath=imgPath, imgName=imgName, pixels_to_um=pixels_to_um, 
+                                  diam_min=diam_min, diam_max=diam_max, dist_fraction=dist_fraction, 
+                                  cache_dir=cache_dir, segmentation_params=segmentation_params, sha1=None, 
+                                  stack_path=stack_path, native_depth=native_depth, 
+                                  crop=(droplet_diam_min,droplet_diam_max) if crop else None,
+                                  empty_contrast=empty_contrast if skip_empty else None, profile=profiler is not None))
+    
+    
+    ###images that were already analyzed with the same parameters can be skipped when resuming
+    manifest=ArrayManifest(directory,array_label)
+    params=analysisParams(pixels_to_um,native_depth,crop,skip_empty)
+    rows=[None]*nimgs #rows of the .csv file that are still current
+    if resume:
+        with profiling(profiler):
+            for i in range(nimgs):
+                tasks[i]=tasks[i]._replace(sha1=taskHash(tasks[i],stack if stack_path is not None else None))
+                rows[i]=manifest.analysisResult(tasks[i].index,tasks[i].sha1,params)
+    todo=[i for i in range(nimgs) if rows[i] is None] #images to analyze
+    if resume:
+        print('{} images already analyzed, analyzing {} images'.format(nimgs-len(todo),len(todo)))
+    
+    
+    def analyzeSerial(i):
+        
+        ###same steps as the worker processes, keeping the segmented image if it is plotted
+        row, messages, sha1, markers = analyzeTask(tasks[i],keep_markers=show,stack=stack if stack_path is not None else None)
     
-    ###CSV file initialization
-    filename='CellCount_'+array+'.csv' 
-    with open(filename,'w') as f: #create a csv file
-        headers=['Image','Cell Count', 'Flags', 'Diameters (microns)', 'Areas (microns^2)','File Path', 'File Name'] #column headers
-        writer=csv.DictWriter(f, fieldnames=headers) 
-        writer.writeheader() #write headers to file
+        if markers is not None:
+            ###Generate coloured representation of processed imaged
+            with timed('label2rgb'):
+                img2=color.label2rgb(markers, bg_label=0)
+            with timed('show'):
+                showImage(img2,'Image'+tasks[i].index,cmap=None)
+        
+        return row, messages, sha1
     
     
-        for i in range(nimgs): ###for each image that was captured in the given array
-            
-            ###Read image from file
-            index=str(i+1).zfill(4) #number of the image
-            imgName=array+'_FLimage'+index+extension #name of the image
-            imgPath=directory+'/'+imgName #full path of the image
-            img=cv2.imread(imgPath) #read image from file            
-            # imgrgb=cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            # plt.imshow(imgrgb)
-            # plt.title('Original Image')
-            # plt.xticks([]),plt.yticks([])
-            # plt.show()
-            
-            img_gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) #convert the image to grayscale 
-            # plt.imshow(img_gray,cmap='gray')
-            # plt.title('Grayscale Image')
-            # plt.xticks([]),plt.yticks([])
-            # plt.show()
-            
-            
-            ###Perform Ostu thresholding to create a binary image
-            ret2,thresh = cv2.threshold(img_gray,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-            # plt.imshow(thresh,cmap='gray')
-            # plt.title('Ostu Thresholding')
-            # plt.xticks([]),plt.yticks([])
-            # plt.show()
-        
-            ###Perform morphological opening to remove small objects in the image
-            kernel = np.ones((3,3),np.uint8) #define the structuring element
-            opening = cv2.morphologyEx(thresh,cv2.MORPH_OPEN,kernel, iterations = 1) #number of iterations can be modified
-            # plt.imshow(opening,cmap='gray')
-            # plt.title('Morphological Opening')
-            # plt.xticks([]),plt.yticks([])
-            # plt.show()
-        
-        
-            ###Determine the sure background region for watershed segmentation using dilation
-            sure_bg = cv2.dilate(opening,kernel,iterations=1) #iterations = how many pixels to dilate the objects, can be modified
-            # plt.imshow(opening, cmap="gray")
-            # plt.title('Sure Background')
-            # plt.xticks([]),plt.yticks([])
-            # plt.show()
-        
-        
-            ###Determine the sure forground region for watershed segmentation using distance transform
-            dist_transform = cv2.distanceTransform(opening,cv2.DIST_L2,5)
-            ret, sure_fg = cv2.threshold(dist_transform,0.2*dist_transform.max(),255,0) #threshold distance transform using 20% of max value in distance transform, can be modified
-            # plt.imshow(dist_transform, cmap="gray")
-            # plt.title('Distance Transform')
-            # plt.xticks([]),plt.yticks([])
-            # plt.show()
-            
-            # plt.imshow(sure_fg, cmap="gray")
-            # plt.title('Sure Foreground')
-            # plt.xticks([]),plt.yticks([])
-            # plt.show()
-        
-        
-            ###Determine the unknown region for watershed segmentation by subtracting foreground from background
-            sure_fg = np.uint8(sure_fg)
-            unknown = cv2.subtract(sure_bg,sure_fg)
-            # plt.imshow(unknown, cmap="gray")
-            # plt.title('Unknown Region')
-            # plt.xticks([]),plt.yticks([])
-            # plt.show()
+    if preview:
+        sheet=ContactSheet(os.path.join(output_dir,'CellCount_'+array+'_preview.png'))
+    if columnar:
+        columns=ResultsWriter(columnsPath(array_label,output_dir),array_label)
     
+    ###CSV file initialization
+    filename=os.path.join(output_dir,'CellCount_'+array+'.csv')
+    with open(filename,'w') as f, profiling(profiler): #create a csv file
+        writer=csv.DictWriter(f, fieldnames=CSV_HEADERS) 
+        writer.writeheader() #write headers to file
         
-            ### Marker labelling for watershed segmentation
-            ret, markers = cv2.connectedComponents(sure_fg)
-            markers = markers+1 # Add one to all labels so that sure background is not 0, but 1
-            markers[unknown==255] = 0 # mark the region of unknown with zero
-            # plt.imshow(markers, cmap="jet")
-            # plt.title('Watershed')
-            # plt.xticks([]),plt.yticks([])
-            # plt.show()
-        
-            ###Perform watershed segmenation
-            markers = cv2.watershed(img,markers)
-            img[markers == -1] = [255,0,0]
-        
-            ###Generate coloured representation of processed imaged
-            img2=color.label2rgb(markers, bg_label=0)
-            plt.imshow(img2)
-            plt.title('Image'+index)
-            plt.xticks([]),plt.yticks([])
-            plt.show()
-        
-            #define list which will contain characteristics for each image
-            regions = measure.regionprops(markers,intensity_image=img_gray)
+        own_pool=None #pool started here, closed once the array is done
+        if (nworkers>1 or pool is not None) and todo:
+            ###split the images over a pool of worker processes
+            ###imap returns the results in the same order as the tasks, so rows are written in image order
+            if pool is None:
+                pool=own_pool=multiprocessing.Pool(nworkers, initializer=initWorker)
+            chunksize=max(1, len(todo)//(4*nworkers)) #a few chunks per worker keeps the workers evenly loaded
+            results=pool.imap(analyzeImageFile, [tasks[i] for i in todo], chunksize)
+        else:
+            results=(analyzeSerial(i)+(None,) for i in todo) #analyzed one at a time, as the results are needed
         
-            ###define some output variables
-            
-            cell_count=-1 #a variable to keep track of the objects counted in each image
-                          #starts at -1 since regions counts the background as a separate object 
-            size_check= 0 #acts as a flag for size
-            count_check= 0 #acts as a flag for cell count
-            check = '' #initialize check flag 
-            diameters=[] #initialize list for diameters
-            areas=[] #initialize list for areas
-            
-            ###Determine metrics of identified regions (first one is always the background region)
-            ###If the object is too small or too large to be confidently identified as a bead, flag the image for manual checking 
-            for prop in regions:
-                
-                if prop.equivalent_diameter/pixels_to_um < diam_min and prop.equivalent_diameter < 0.95*len(img_gray[1]):
-                    print("Flagged for manual check: Unidentified object in image. Location: {} \n\n".format(imgPath))
-                    size_check = 1 #change the value of the flag
-                if prop.equivalent_diameter/pixels_to_um > diam_max and prop.equivalent_diameter < 0.95*len(img_gray[1]):
-                    print("Flagged for manual check: Unidentified object in image. Location: {} \n\n".format(imgPath))
-                    size_check = 1 #change the value of the flag
-                    
-                #print("Label: {} Area: {} um^2 Equivalent Diameter:{} um".format(prop.label, prop.area/(pixels_to_um)**2, prop.equivalent_diameter/pixels_to_um))
-                #uncomment above line to print characteristic for each region in each image
+        try:
+            nanalyzed=0
+            for i in range(nimgs): ###for each image that was captured in the given array
                 
-                ###Add diameters and areas to list as long as they are too small to be the background region
-                if prop.equivalent_diameter<0.95*len(img_gray[1]):
-                    diameters.append(round(prop.equivalent_diameter/pixels_to_um,2))
-                    
-                if prop.area<(0.85*len(img_gray[1]))**2:
-                    areas.append(round(prop.area/(pixels_to_um)**2,2))
+                if rows[i] is None:
+                    row, messages, sha1, samples = next(results)
+                    if samples is not None: #times of the steps from a worker process
+                        profiler.merge(samples)
+                    for message in messages:
+                        print(message)
+                    nanalyzed=nanalyzed+1
+                    with timed('manifest'): #written to file in blocks, one fsync per block
+                        manifest.recordAnalysis(tasks[i].index,sha1,params,row,flush=nanalyzed%MANIFEST_BLOCK==0)
+                    rows[i]=row
+                else:
+                    rows[i]['File Path']=tasks[i].imgPath #in case the images were moved since
+                    rows[i]['File Name']=tasks[i].imgName
                     
-        
-                cell_count=cell_count+1 #increasing the cell count variable for each object identified
+                count[i]=rows[i]['Cell Count']
+                writer.writerow(rows[i]) #writing info to .csv file
                 
-            ### Flag an object for manual checking if there is more than one cell identified   
-            count[i]=cell_count
-            
-            if count[i]>1:
-                print("Flagged for manual check: More than one bead identified. Location: {}\n\n".format(imgPath))
-                count_check = 1 #change the value of the flag
+                if preview:
+                    caption='{} {}{}'.format(tasks[i].index,rows[i]['Cell Count'],'*' if rows[i]['Flags'] else '')
+                    if stack_path is not None:
+                        sheet.add(i+1,stack[i,CHANNELS.index('FL')],caption)
+                    else:
+                        sheet.addFile(i+1,tasks[i].imgPath,caption)
+                if columnar:
+                    columns.add(rows[i])
                 
-            ### Determine which (if any) flags to write to .csv
-            if size_check>0:
-                check='Size warning'
-            if count_check>0:
-                check='Count warning'
-            if size_check>0 and count_check>0:
-                check = 'Size and count warning'
+            if own_pool is not None:
+                own_pool.close()
+        finally:
+            with timed('manifest'):
+                manifest.flush() #the results of the last block, or of the images analyzed before an error
+            if own_pool is not None:
+                own_pool.terminate()
+                own_pool.join()
                 
-            ###writing info to .csv file
-            writer.writerow({'Image': index, 
-                             'Cell Count': cell_count, 
-                             'Flags': check,
-                             'Diameters (microns)': diameters,
-                             'Areas (microns^2)': areas,
-                             'File Path': imgPath,
-                             'File Name': imgName})
+    with profiling(profiler), timed('manifest'):
+        manifest.compact() #remove the records that were replaced, unless the array is still being acquired
+    if cache_dir is not None:
+        cache.prune() #keep the cache under its size limit
+    if preview:
+        sheet.save()
+    if columnar:
+        columns.save()
+    if profiler is not None:
+        profiler.printSummary()
+        profiler.writeReport(os.path.join(output_dir,'CellCount_'+array+'_profile.json'))
+        profiler.writeReport(os.path.join(output_dir,'CellCount_'+array+'_profile.csv'))
             
               
     return count
 #%%
+def acquireAndCount(ncols,nrows,dx,dy,expBF,expFL,array_label,directory,mag,save_images=True,pipelined=True,order='pairs',
+                    positions=None,plan='serpentine',preview=False,columnar=False,storage='png',native_depth=False,
+                    session=None,profile=False,camera='snap'):
     
-###Examples for running the functions
+    '''
+    acquireAndCount: acquires an array with arrayAcquisition_ShutterControl and counts the objects in 
+    each fluorescent image while the rest of the array is still being imaged. 
     
-nrows= 4
-ncols= 3
-dx=dy=900 #um
-directory='C:\Users\Admin\Desktop\Emma\Test imgs\Mar4Beads'
-array_label= 'arduino_mar4_beads_20X_4'
-exposure_bf = 100 #ms
-exposure_fl = 60 #ms
-
-mag='40X'
-
-#acquisition function
-arrayAcquisition_ShutterControl(ncols, nrows, dx, dy, exposure_bf, exposure_fl, array_label,directory)
-
-#analysis function
-count= DropletCellCount(directory,array_label,nrows,ncols,mag)
-
-
-
-
-
-
-
-
-
+    Each fluorescent image goes straight from the camera to the same analysis as DropletCellCount
+    (see DropletCountStream in Acquisition_Pipeline.py), so the images do not need to be saved 
+    and read back. The acquisition runs on a background thread and does not display the images. 
+    
+    This is a generator: the result for each droplet is given out as soon as it is ready, and is also 
+    written to CellCount_array{label}.csv in the same format as DropletCellCount. While the array is 
+    acquired the rows are in the order the images were captured; once it is done the file is rewritten 
+    in image order, as DropletCellCount saves it. If save_images is False the file path column holds 
+    the path the image would have been saved to.
+    
+    inputs:
+        ncols, nrows, dx, dy, expBF, expFL, array_label, directory: as arrayAcquisition_ShutterControl
+        mag: objective lens used for image capture, either '10x', '20x', or '40x'
+        save_images: if False, the images are not saved to file (default True)
+        pipelined: see arrayAcquisition_ShutterControl (default True)
+        order: see arrayAcquisition_ShutterControl (default 'pairs'). the results come out in the 
+        order the fluorescent images are captured, which is reversed for 'two-pass'
+        positions, plan, preview, storage, session, camera: see arrayAcquisition_ShutterControl
+        native_depth: if True, the images are saved and counted at the bit depth of the camera, see 
+        arrayAcquisition_ShutterControl and DropletCellCount (default False)
+        columnar: see DropletCellCount (default False), the columns are saved in image order once the array is done
+        profile: if True, the steps of the acquisition and of the analysis are timed together (see 
+        arrayAcquisition_ShutterControl and DropletCellCount), and the report is saved to 
+        CellCount_array{label}_profile.json and .csv once the array is done. default False
+        
+    yields:
+        row: dictionary with one entry per column of the .csv file, e.g. row['Cell Count'] and row['Flags']
+        
+    example:
+        for row in acquireAndCount(ncols,nrows,dx,dy,expBF,expFL,array_label,directory,mag):
+            print(row['Image'], row['Cell Count'], row['Flags'])
+            
+    libraries required:
+        threading
+        csv
+    '''
+    
+    pixels_to_um=pixelScale(mag) #pixels per micron for the objective lens used
+    profiler=makeProfiler(profile,array_label) #one profiler for all threads, None if not profiling
+    startProfiling(profiler) #before the stream is started, so its thread times into the same profiler
+    stream=DropletCountStream(directory,array_label,pixels_to_um,DIAM_MIN,DIAM_MAX,native_depth=native_depth,
+                              dist_fraction=DIST_FRACTION) #same user inputs as DropletCellCount
+    
+    errors=[] #error raised by the acquisition thread, if any
+    
+    def acquire():
+        try:
+            with profiling(profiler): #handed over to the acquisition thread
+                arrayAcquisition_ShutterControl(ncols,nrows,dx,dy,expBF,expFL,array_label,directory,
+                                                pipelined=pipelined,fl_callback=stream.submit,
+                                                save_images=save_images,show=False,order=order,
+                                                positions=positions,plan=plan,preview=preview,storage=storage,
+                                                native_depth=native_depth,session=session,camera=camera)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            stream.close() #no more images coming
+            
+    thread=threading.Thread(target=acquire)
+    thread.daemon=True
+    thread.start()
+    
+    rows=[] #in the order the images were captured
+    
+    ###CSV file initialization
+    filename='CellCount_array'+str(array_label)+'.csv' 
+    with open(filename,'w') as f: #create a csv file
+        writer=csv.DictWriter(f, fieldnames=CSV_HEADERS) 
+        writer.writeheader() #write headers to file
+        
+        for row, messages in stream.results():
+            for message in messages:
+                print(message)
+            writer.writerow(row) #writing info to .csv file
+            f.flush() #so the file is up to date while the array is being imaged
+            rows.append(row)
+            yield row
+            
+    thread.join()
+    stopProfiling(profiler)
+    
+    ###images are not captured in image order with order='two-pass' or a planned path
+    ordered=sorted(rows,key=lambda row: row['Image'])
+    if ordered!=rows:
+        with open(filename,'w') as f:
+            writer=csv.DictWriter(f, fieldnames=CSV_HEADERS) 
+            writer.writeheader()
+            for row in ordered:
+                writer.writerow(row)
+    if columnar:
+        columns=ResultsWriter(columnsPath(array_label),array_label)
+        for row in ordered:
+            columns.add(row)
+        columns.save()
+    if profiler is not None:
+        profiler.printSummary()
+        profiler.writeReport('CellCount_array'+str(array_label)+'_profile.json')
+        profiler.writeReport('CellCount_array'+str(array_label)+'_profile.csv')
+    if errors:
+        raise errors[0]
+        
+#%%
+def main(argv=None):
+    
+    '''
+    main: command line entry point, runs the acquisition, the analysis, or both
+    
+    usage:
+        python Inkjet_Acquisition_Analysis.py acquire ncols nrows dx dy expBF expFL array_label directory [options]
+        python Inkjet_Acquisition_Analysis.py count directory array_label nrows ncols mag [options]
+        python Inkjet_Acquisition_Analysis.py acquire-count ncols nrows dx dy expBF expFL array_label directory mag [options]
+        python Inkjet_Acquisition_Analysis.py batch root mag [options] #every array in root and its subfolders
+        python Inkjet_Acquisition_Analysis.py COMMAND --help #list of options
+        
+    example (4 x 3 array of droplets 900 um apart, 100 ms BF and 60 ms FL exposure):
+        python Inkjet_Acquisition_Analysis.py acquire 3 4 900 900 100 60 arduino_mar4_beads_20X_4 "C:/Users/Admin/Desktop/Emma/Test imgs/Mar4Beads"
+        python Inkjet_Acquisition_Analysis.py count "C:/Users/Admin/Desktop/Emma/Test imgs/Mar4Beads" arduino_mar4_beads_20X_4 4 3 40X
+        
+    the images are not displayed unless --show is given, and the microscope and arduino are only 
+    connected for the acquire commands (see HardwareSession in Hardware_Session.py)
+    '''
+    
+    parser=argparse.ArgumentParser(description='Acquisition and analysis of arrays of inkjet-printed droplets')
+    commands=parser.add_subparsers(dest='command')
+    
+    def addAcquisition(command):
+        command.add_argument('ncols',type=int,help='number of columns in the array')
+        command.add_argument('nrows',type=int,help='number of rows in the array')
+        command.add_argument('dx',type=float,help='horizontal distance between droplets, in microns')
+        command.add_argument('dy',type=float,help='vertical distance between droplets, in microns')
+        command.add_argument('expBF',type=float,help='exposure of bright field images, in ms')
+        command.add_argument('expFL',type=float,help='exposure of fluorescent images, in ms')
+        command.add_argument('array_label',help='label of the array appended to saved files')
+        command.add_argument('directory',help='folder to save the images to')
+        command.add_argument('--order',default='pairs',choices=['pairs','alternate','two-pass'])
+        command.add_argument('--camera',default='snap',choices=['snap','sequence'],
+                             help="'sequence' streams frames from a sequence acquisition, use with --order two-pass")
+        command.add_argument('--plan',default='serpentine',choices=['serpentine','layout','nearest','2opt'])
+        command.add_argument('--positions',help='.csv file of droplet positions (see loadPositions in Scan_Path.py)')
+        command.add_argument('--config',default=CONFIG_FILE,help='micromanager configuration file')
+        command.add_argument('--port',default=PORT,help='serial port of the arduino')
+    
+    def addAnalysis(command):
+        command.add_argument('--workers',type=int,default=1,help='number of processes to analyze the images with')
+        command.add_argument('--columnar',action='store_true')
+        command.add_argument('--crop',action='store_true')
+        command.add_argument('--skip-empty',action='store_true')
+    
+    def addCommon(command):
+        command.add_argument('--profile',action='store_true',help='time each step and save a report')
+        command.add_argument('--storage',default='png',choices=['png','stack'])
+        command.add_argument('--native-depth',action='store_true')
+        command.add_argument('--preview',action='store_true')
+        command.add_argument('--show',action='store_true',help='display the images (needs matplotlib)')
+    
+    acquire=commands.add_parser('acquire',help='acquire an array (arrayAcquisition_ShutterControl)')
+    addAcquisition(acquire)
+    addCommon(acquire)
+    acquire.add_argument('--settle',default='fixed',choices=['fixed','busy','sharpness'])
+    acquire.add_argument('--settle-time',type=float,default=0.5,help="delay after each move with --settle fixed, in s")
+    acquire.add_argument('--pipelined',action='store_true')
+    acquire.add_argument('--resume',action='store_true',help='skip droplets already captured')
+    
+    count=commands.add_parser('count',help='count the objects in each image of an array (DropletCellCount)')
+    count.add_argument('directory',help='folder the images were saved to')
+    count.add_argument('array_label',help='label of the array appended to saved files')
+    count.add_argument('nrows',type=int,help='number of rows in the array')
+    count.add_argument('ncols',type=int,help='number of columns in the array')
+    count.add_argument('mag',help="objective lens used, '10x', '20x' or '40x'")
+    addAnalysis(count)
+    addCommon(count)
+    count.add_argument('--resume',action='store_true',help='skip images already analyzed')
+    count.add_argument('--cache-dir',help='folder to cache segmentation results in')
+    
+    batch=commands.add_parser('batch',help='count every array found in a folder and its subfolders (batchCount)')
+    batch.add_argument('root',help='folder to look for arrays in')
+    batch.add_argument('mag',help="objective lens used, '10x', '20x' or '40x'")
+    addAnalysis(batch)
+    batch.set_defaults(workers=multiprocessing.cpu_count())
+    batch.add_argument('--force',action='store_true',help='analyze arrays that are already complete again')
+    batch.add_argument('--native-depth',action='store_true')
+    batch.add_argument('--preview',action='store_true')
+    batch.add_argument('--cache-dir',help='folder to cache segmentation results in')
+    
+    both=commands.add_parser('acquire-count',help='count the objects while the array is acquired (acquireAndCount)')
+    addAcquisition(both)
+    both.add_argument('mag',help="objective lens used, '10x', '20x' or '40x'")
+    both.add_argument('--profile',action='store_true',help='time each step and save a report')
+    both.add_argument('--storage',default='png',choices=['png','stack'])
+    both.add_argument('--native-depth',action='store_true')
+    both.add_argument('--preview',action='store_true')
+    both.add_argument('--columnar',action='store_true')
+    both.add_argument('--no-save',action='store_true',help='count the images without saving them')
+    
+    args=parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return
+    
+    if args.command=='count':
+        count=DropletCellCount(args.directory,args.array_label,args.nrows,args.ncols,args.mag,nworkers=args.workers,
+                               resume=args.resume,cache_dir=args.cache_dir,show=args.show,preview=args.preview,
+                               columnar=args.columnar,storage=args.storage,native_depth=args.native_depth,
+                               crop=args.crop,skip_empty=args.skip_empty,profile=args.profile)
+        print('{} objects counted in {} images'.format(int(count.sum()),len(count)))
+        return
+    
+    if args.command=='batch':
+        from Batch_Analysis import batchCount #imported here since Batch_Analysis.py imports this file
+        rows=batchCount(args.root,args.mag,nworkers=args.workers,force=args.force,columnar=args.columnar,
+                        crop=args.crop,skip_empty=args.skip_empty,native_depth=args.native_depth,
+                        preview=args.preview,cache_dir=args.cache_dir)
+        for row in rows:
+            print('{Directory} {Array}: {Images} images, {Status}'.format(**row))
+        return
+    
+    positions=None
+    if args.positions is not None:
+        positions=loadPositions(args.positions)
+    
+    with HardwareSession(args.config,args.port) as hardware:
+        if args.command=='acquire':
+            arrayAcquisition_ShutterControl(args.ncols,args.nrows,args.dx,args.dy,args.expBF,args.expFL,args.array_label,
+                                            args.directory,pipelined=args.pipelined,show=args.show,order=args.order,
+                                            settle=args.settle,positions=positions,plan=args.plan,resume=args.resume,
+                                            preview=args.preview,storage=args.storage,native_depth=args.native_depth,
+                                            session=hardware,profile=args.profile,camera=args.camera,
+                                            settle_time=args.settle_time)
+        else:
+            for row in acquireAndCount(args.ncols,args.nrows,args.dx,args.dy,args.expBF,args.expFL,args.array_label,
+                                       args.directory,args.mag,save_images=not args.no_save,order=args.order,
+                                       positions=positions,plan=args.plan,preview=args.preview,
+                                       columnar=args.columnar,storage=args.storage,native_depth=args.native_depth,
+                                       session=hardware,profile=args.profile,camera=args.camera):
+                print('{} {} {}'.format(row['Image'],row['Cell Count'],row['Flags']))
 
 
+if __name__=='__main__':
+    main()
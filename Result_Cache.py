@@ -0,0 +1,143 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import numpy as np
+
+'''
+On-disk cache of segmentation results for DropletCellCount in Inkjet_Acquisition_Analysis.py.
+
+The watershed segmentation only depends on the image and on the segmentation parameters, not on the
+size limits (diam_min, diam_max) or the magnification used to flag the regions. Each result is saved
+under a key made from the hash of the image file and the segmentation parameters, so changing only the
+flagging parameters re-flags an array from the cached region areas without segmenting it again.
+'''
+
+#%%
+def segmentationKey(file_hash,params):
+
+    '''
+    segmentationKey: cache key for an image file (sha1 of its contents, see fileHash in Array_Manifest.py)
+    segmented with the parameters in the dictionary params
+    '''
+
+    text=json.dumps({'file': file_hash, 'params': params},sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+#%%
+class SegmentationCache(object):
+
+    '''
+    SegmentationCache: folder of segmentation results, one compressed .npz file per key holding the
+    watershed label image (markers), the area of each region and the width of the image.
+
+    The cache is kept under max_bytes by prune(), which deletes the least recently used results first
+    (every hit updates the modification time of the file). Results are written to a temporary file
+    and renamed, so worker processes can share the folder.
+
+    inputs:
+        directory: folder to keep the cache in, created if needed
+        max_bytes: size limit of the cache used by prune() (default 2 GB)
+
+    usage:
+        cache=SegmentationCache(directory)
+        key=segmentationKey(file_hash,params)
+        cached=cache.getAreas(key) #(area, width) or None
+        cache.put(key,markers,area,width)
+        cache.prune()
+    '''
+
+    def __init__(self,directory,max_bytes=2*1024**3):
+        self.directory=directory
+        self.max_bytes=max_bytes
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError: #made by another process in the meantime
+                pass
+
+    def _path(self,key):
+
+        return os.path.join(self.directory,key+'.npz')
+
+    def _load(self,key,names):
+
+        path=self._path(key)
+        try:
+            with np.load(path) as data:
+                values=[data[name] for name in names] #only the arrays asked for are decompressed
+            os.utime(path,None) #mark as recently used
+        except (IOError,OSError,KeyError,ValueError): #not in the cache, or unreadable
+            return None
+
+        return values
+
+    def get(self,key):
+
+        '''
+        get: (markers, area, width) for a key, or None if it is not in the cache
+        '''
+
+        values=self._load(key,['markers','area','width'])
+        if values is None:
+            return None
+
+        markers,area,width=values
+        return markers, area, int(width)
+
+    def getAreas(self,key):
+
+        '''
+        getAreas: (area, width) for a key, without reading the label image, or None if it is not in the cache
+        '''
+
+        values=self._load(key,['area','width'])
+        if values is None:
+            return None
+
+        area,width=values
+        return area, int(width)
+
+    def put(self,key,markers,area,width):
+
+        '''
+        put: saves the segmentation result of an image under a key
+        '''
+
+        path=self._path(key)
+        temp='{}.{}.tmp'.format(path,os.getpid())
+        with open(temp,'wb') as f:
+            np.savez_compressed(f,markers=markers,area=area,width=width)
+        try:
+            os.rename(temp,path)
+        except OSError: #already saved by another process (windows does not replace existing files)
+            os.remove(temp)
+
+    def prune(self):
+
+        '''
+        prune: deletes the least recently used results until the cache is under max_bytes.
+        returns the number of results deleted
+        '''
+
+        entries=[]
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                path=os.path.join(self.directory,name)
+                stat=os.stat(path)
+                entries.append((stat.st_mtime,stat.st_size,path))
+
+        total=sum(entry[1] for entry in entries)
+        nremoved=0
+        for mtime,size,path in sorted(entries): #oldest first
+            if total<=self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total=total-size
+            nremoved=nremoved+1
+
+        return nremoved
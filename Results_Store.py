@@ -0,0 +1,223 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import json
+import os
+import numpy as np
+
+'''
+Columnar copy of the CellCount_array{label}.csv results of DropletCellCount and acquireAndCount in
+Inkjet_Acquisition_Analysis.py, for loading many arrays at once (e.g. to train a classifier) without
+parsing the lists of diameters and areas written as text in the .csv file.
+
+The results of an array are saved in a folder, CellCount_array{label}_columns, holding:
+    images.npy: one record per image (see IMAGE_FIELDS), in image order
+    diameters.npy: the diameters of the objects of all images one after the other, in microns
+    areas.npy: the areas of the objects of all images one after the other, in microns^2
+    info.json: the array label and the number of images
+
+The objects of image i are diameters[images['diameter_start'][i]:images['diameter_stop'][i]] (and the
+same for areas). There are not always as many diameters as areas for an image, since the background
+region is left out of each list by a different size limit, so each list has its own offsets.
+
+All files are plain .npy files, so they can be opened with np.load(mmap_mode='r') and only the parts
+that are used are read from disk.
+'''
+
+###fields of images.npy, the widths of the text fields are set when the results are saved
+IMAGE_FIELDS=[('image','i4'),('cell_count','i4'),('flags','U'),
+              ('diameter_start','i8'),('diameter_stop','i8'),('area_start','i8'),('area_stop','i8'),
+              ('file_path','U'),('file_name','U')]
+
+#%%
+def columnsPath(array_label,directory='.'):
+
+    '''
+    columnsPath: folder the columnar results of an array are saved to
+    '''
+
+    return os.path.join(directory,'CellCount_array{}_columns'.format(array_label))
+
+#%%
+class ResultsWriter(object):
+
+    '''
+    ResultsWriter: collects the rows of the .csv file of an array and saves them as columns
+
+    inputs:
+        folder: folder to save the results to, created if needed (see columnsPath)
+        array_label: label of the array, saved in info.json
+
+    usage:
+        results=ResultsWriter(columnsPath(array_label),array_label)
+        results.add(row) #for each row written to the .csv file, kept in the same order
+        results.save()
+    '''
+
+    def __init__(self,folder,array_label):
+        self.folder=folder
+        self.array_label=array_label
+        self.rows=[]
+
+    def add(self,row):
+
+        '''
+        add: adds the row of an image, a dictionary with one entry per column of the .csv file (see makeRow)
+        '''
+
+        self.rows.append(row)
+
+    def save(self):
+
+        '''
+        save: writes the results to the folder, replacing any results saved there before
+        '''
+
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+
+        diameters=[np.asarray(row['Diameters (microns)'],np.float64) for row in self.rows]
+        areas=[np.asarray(row['Areas (microns^2)'],np.float64) for row in self.rows]
+        diameter_stops=np.cumsum([len(d) for d in diameters],dtype=np.int64)
+        area_stops=np.cumsum([len(a) for a in areas],dtype=np.int64)
+
+        ###text fields are as wide as their longest entry
+        widths={'flags': 1,'file_path': 1,'file_name': 1}
+        columns={'flags': 'Flags','file_path': 'File Path','file_name': 'File Name'}
+        for row in self.rows:
+            for field,column in columns.items():
+                widths[field]=max(widths[field],len(row[column]))
+        dtype=[(name,kind+str(widths[name])) if kind=='U' else (name,kind) for name,kind in IMAGE_FIELDS]
+
+        images=np.zeros(len(self.rows),dtype=dtype)
+        for i,row in enumerate(self.rows):
+            images[i]=(int(row['Image']),row['Cell Count'],row['Flags'],
+                       diameter_stops[i]-len(diameters[i]),diameter_stops[i],
+                       area_stops[i]-len(areas[i]),area_stops[i],
+                       row['File Path'],row['File Name'])
+
+        np.save(os.path.join(self.folder,'images.npy'),images)
+        np.save(os.path.join(self.folder,'diameters.npy'),
+                np.concatenate(diameters) if diameters else np.zeros(0,np.float64))
+        np.save(os.path.join(self.folder,'areas.npy'),
+                np.concatenate(areas) if areas else np.zeros(0,np.float64))
+        with open(os.path.join(self.folder,'info.json'),'w') as f:
+            json.dump({'array_label': str(self.array_label),'nimages': len(self.rows)},f)
+
+#%%
+class ArrayResults(object):
+
+    '''
+    ArrayResults: the columnar results of one array, memory-mapped
+
+    inputs:
+        folder: folder the results were saved to by ResultsWriter
+
+    attributes:
+        array_label: label of the array
+        images: record array with one record per image (see IMAGE_FIELDS), e.g. images['cell_count']
+        diameters, areas: the objects of all images, in microns and microns^2
+
+    usage:
+        results=ArrayResults(columnsPath(array_label))
+        results.images['cell_count']
+        results.objectDiameters(i), results.objectAreas(i) #objects of the image in row i of images
+    '''
+
+    def __init__(self,folder):
+        self.folder=folder
+        with open(os.path.join(folder,'info.json')) as f:
+            self.array_label=json.load(f)['array_label']
+        self.images=np.load(os.path.join(folder,'images.npy'),mmap_mode='r')
+        self.diameters=np.load(os.path.join(folder,'diameters.npy'),mmap_mode='r')
+        self.areas=np.load(os.path.join(folder,'areas.npy'),mmap_mode='r')
+
+    def objectDiameters(self,i):
+
+        return self.diameters[self.images['diameter_start'][i]:self.images['diameter_stop'][i]]
+
+    def objectAreas(self,i):
+
+        return self.areas[self.images['area_start'][i]:self.images['area_stop'][i]]
+
+#%%
+def objectIndex(starts,stops):
+
+    '''
+    objectIndex: indices of the objects of several images in an object list, from their start and stop offsets
+    '''
+
+    lengths=np.asarray(stops,np.int64)-np.asarray(starts,np.int64)
+    ###position of each object within its image, added to the start of its image
+    within=np.arange(lengths.sum())-np.repeat(np.cumsum(lengths)-lengths,lengths)
+
+    return np.repeat(np.asarray(starts,np.int64),lengths)+within
+
+#%%
+def loadResults(folders,where=None):
+
+    '''
+    loadResults: combines the columnar results of many arrays into one set of tables, keeping only the
+    images selected by where
+
+    inputs:
+        folders: folders saved by ResultsWriter, one per array (see columnsPath)
+        where: function given the images record array of an array, returning a boolean array of the
+        images to keep, e.g. lambda images: images['cell_count']==1. default None (all images)
+
+    returns:
+        images: record array of the images kept from all arrays, with an 'array' field holding the label
+        of the array each image is from. The start/stop fields index into diameters and areas below
+        diameters, areas: the objects of the images kept, one after the other
+    '''
+
+    tables=[]
+    diameters=[]
+    areas=[]
+    ndiameters=0
+    nareas=0
+    for folder in folders:
+        results=ArrayResults(folder)
+        images=results.images
+        keep=np.ones(len(images),bool) if where is None else np.asarray(where(images),bool)
+        selected=np.array(images[keep]) #only the records kept are read from disk
+
+        ###objects of the images kept, copied in one go per list
+        d_index=objectIndex(selected['diameter_start'],selected['diameter_stop'])
+        a_index=objectIndex(selected['area_start'],selected['area_stop'])
+        diameters.append(np.asarray(results.diameters[d_index]))
+        areas.append(np.asarray(results.areas[a_index]))
+
+        ###offsets into the combined lists
+        d_lengths=selected['diameter_stop']-selected['diameter_start']
+        a_lengths=selected['area_stop']-selected['area_start']
+        selected['diameter_stop']=ndiameters+np.cumsum(d_lengths)
+        selected['diameter_start']=selected['diameter_stop']-d_lengths
+        selected['area_stop']=nareas+np.cumsum(a_lengths)
+        selected['area_start']=selected['area_stop']-a_lengths
+        ndiameters=ndiameters+len(d_index)
+        nareas=nareas+len(a_index)
+
+        tables.append((results.array_label,selected))
+
+    ###text fields of the combined table are as wide as the widest of all arrays
+    widths={}
+    for label,selected in tables:
+        for name in selected.dtype.names:
+            if selected.dtype[name].kind=='U':
+                widths[name]=max(widths.get(name,1),selected.dtype[name].itemsize//4)
+    width=max([len(label) for label,selected in tables]+[1])
+    dtype=[('array','U'+str(width))]+[(name,'U'+str(widths[name])) if kind=='U' else (name,kind)
+                                      for name,kind in IMAGE_FIELDS]
+
+    images=np.zeros(sum(len(selected) for label,selected in tables),dtype=dtype)
+    start=0
+    for label,selected in tables:
+        stop=start+len(selected)
+        images['array'][start:stop]=label
+        for name in selected.dtype.names:
+            images[name][start:stop]=selected[name]
+        start=stop
+
+    if diameters:
+        return images, np.concatenate(diameters), np.concatenate(areas)
+    return images, np.zeros(0,np.float64), np.zeros(0,np.float64)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import csv
+import numpy as np
+
+'''
+Droplet layouts and the order the stage visits them in, for arrayAcquisition_ShutterControl in
+Inkjet_Acquisition_Analysis.py.
+
+Droplet positions are XY stage positions in microns, relative to the origin set at the first droplet
+(mmc.setOriginXY), i.e. the positions the stage has to be moved to for the camera to be centered on
+each droplet. Moving the stage left (-x) centers the camera on the droplet to the right, and moving
+it down (-y) centers the camera on the next row.
+
+The number of each image is the position of its droplet in the layout (first droplet = image 0001),
+so the images are numbered the same no matter which order the droplets are visited in.
+'''
+
+#%%
+def rectangularGrid(ncols,nrows,dx,dy):
+
+    '''
+    rectangularGrid: positions of a rectangular array of droplets, listed from left to right on odd
+    number rows and right to left on even number rows, from the top of the array (the order and
+    numbering of the original acquisition)
+
+    inputs:
+        ncols, nrows: number of columns and rows in the array
+        dx, dy: horizontal and vertical distance between droplets, in microns
+
+    returns:
+        positions: array of (x, y) stage positions, shape (ncols*nrows, 2)
+    '''
+
+    positions=[]
+    for row in range(nrows):
+        if row%2==0:
+            cols=range(ncols) #left to right
+        else:
+            cols=range(ncols-1,-1,-1) #right to left
+        for col in cols:
+            positions.append((-col*dx,-row*dy))
+
+    return np.array(positions,dtype=float)
+
+#%%
+def hexGrid(ncols,nrows,dx,dy):
+
+    '''
+    hexGrid: same as rectangularGrid, but every second row is shifted right by half a column (dx/2)
+    '''
+
+    positions=rectangularGrid(ncols,nrows,dx,dy)
+    shifted=(np.round(-positions[:,1]/dy).astype(int)%2)==1 if dy!=0 else np.zeros(len(positions),bool)
+    positions[shifted,0]=positions[shifted,0]-dx/2.0
+
+    return positions
+
+#%%
+def loadPositions(filename):
+
+    '''
+    loadPositions: reads droplet positions from a .csv file with one droplet per row, x in the first
+    column and y in the second (stage positions in microns, relative to the first droplet).
+    A header row is skipped.
+
+    returns:
+        positions: array of (x, y) stage positions, shape (ndroplets, 2)
+    '''
+
+    positions=[]
+    with open(filename) as f:
+        for row in csv.reader(f):
+            if len(row)<2:
+                continue
+            try:
+                positions.append((float(row[0]),float(row[1])))
+            except ValueError: #header
+                continue
+
+    return np.array(positions,dtype=float)
+
+#%%
+def pathLength(positions,order,start=(0,0)):
+
+    '''
+    pathLength: total distance travelled by the stage visiting positions in order, from start, in microns
+    '''
+
+    points=np.vstack([np.asarray(start,dtype=float)[None,:],positions[order]])
+    return np.sqrt((np.diff(points,axis=0)**2).sum(axis=1)).sum()
+
+#%%
+def serpentineOrder(positions,row_tol=None):
+
+    '''
+    serpentineOrder: visits the droplets row by row from the top (largest y), alternating between
+    decreasing and increasing x. Droplets whose y differs by less than row_tol are in the same row
+    (default: half the smallest spacing between rows).
+
+    returns:
+        order: indices of positions in the order they are visited
+    '''
+
+    y=positions[:,1]
+    levels=np.unique(y)
+    if row_tol is None:
+        gaps=np.diff(levels)
+        gaps=gaps[gaps>1e-6]
+        row_tol=gaps.min()/2.0 if len(gaps) else 1.0
+
+    ###assign rows from the top down, starting a new row whenever y drops by more than row_tol
+    by_y=np.argsort(-y,kind='mergesort')
+    rows=np.zeros(len(y),int)
+    row=0
+    for previous,current in zip(by_y[:-1],by_y[1:]):
+        if y[previous]-y[current]>row_tol:
+            row=row+1
+        rows[current]=row
+
+    order=[]
+    for row in range(rows.max()+1 if len(rows) else 0):
+        members=np.nonzero(rows==row)[0]
+        members=members[np.argsort(positions[members,0],kind='mergesort')]
+        if row%2==0:
+            members=members[::-1] #decreasing x (stage moves left)
+        order.extend(members.tolist())
+
+    return order
+
+#%%
+def nearestNeighborOrder(positions,start=(0,0)):
+
+    '''
+    nearestNeighborOrder: from start, always visits the closest droplet not yet visited
+
+    returns:
+        order: indices of positions in the order they are visited
+    '''
+
+    remaining=np.ones(len(positions),bool)
+    current=np.asarray(start,dtype=float)
+    order=[]
+    for i in range(len(positions)):
+        distance=((positions-current)**2).sum(axis=1)
+        distance[~remaining]=np.inf
+        nearest=int(np.argmin(distance))
+        order.append(nearest)
+        remaining[nearest]=False
+        current=positions[nearest]
+
+    return order
+
+#%%
+def twoOpt(positions,order,start=(0,0),max_passes=50):
+
+    '''
+    twoOpt: shortens a path by reversing sections of it (2-opt) until no reversal makes it shorter.
+    The path starts at start and can end anywhere.
+
+    returns:
+        order: indices of positions in the improved order
+    '''
+
+    points=np.vstack([np.asarray(start,dtype=float)[None,:],positions])
+    route=np.concatenate([[0],np.asarray(order,int)+1]) #node 0 is the start, it is never moved
+    n=len(route)
+
+    def distance(a,b):
+        return np.sqrt(((a-b)**2).sum(axis=-1))
+
+    for npass in range(max_passes):
+        improved=False
+        for i in range(1,n-1):
+            ###reversing route[i..j] replaces the edges (i-1,i) and (j,j+1) with (i-1,j) and (i,j+1)
+            j=np.arange(i+1,n)
+            a=points[route[i-1]]
+            b=points[route[i]]
+            c=points[route[j]]
+            delta=distance(a,c)-distance(a,b)
+            has_next=j<n-1 #the last droplet has no edge after it
+            d=points[route[j[has_next]+1]]
+            delta[has_next]=delta[has_next]+distance(b,d)-distance(c[has_next],d)
+
+            best=int(np.argmin(delta))
+            if delta[best]<-1e-9:
+                route[i:j[best]+1]=route[i:j[best]+1][::-1]
+                improved=True
+        if not improved:
+            break
+
+    return (route[1:]-1).tolist()
+
+#%%
+def planPath(positions,method='serpentine',start=(0,0)):
+
+    '''
+    planPath: order to visit the droplets in
+
+    inputs:
+        positions: array of (x, y) stage positions, from rectangularGrid, hexGrid or loadPositions
+        method: 'layout' (the order of positions), 'serpentine', 'nearest' (nearest neighbor)
+        or '2opt' (nearest neighbor improved with 2-opt). default 'serpentine'
+        start: position of the stage before the first droplet (default the origin)
+
+    returns:
+        order: indices of positions in the order they are visited
+    '''
+
+    positions=np.asarray(positions,dtype=float)
+
+    if method=='layout':
+        order=list(range(len(positions)))
+    elif method=='serpentine':
+        order=serpentineOrder(positions)
+    elif method=='nearest':
+        order=nearestNeighborOrder(positions,start)
+    elif method=='2opt':
+        order=twoOpt(positions,nearestNeighborOrder(positions,start),start)
+    else:
+        raise ValueError("method must be 'layout', 'serpentine', 'nearest' or '2opt'")
+
+    return order
@@ -0,0 +1,151 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import deque
+
+'''
+Streaming frames from the camera with a micromanager sequence acquisition, for
+arrayAcquisition_ShutterControl(camera='sequence') in Inkjet_Acquisition_Analysis.py.
+
+With mmc.snapImage() every image pays for a full software round trip to the camera (arm, expose, read
+out, hand over) before the next command can be sent. In a sequence acquisition the camera runs on its
+own at a fixed exposure and puts every frame into the micromanager circular buffer. A consumer thread
+takes the frames out of the buffer as they arrive (mmc.popNextImage), and the acquisition only has to
+pick the first frame that was exposed after the stage settled and the shutter moved.
+
+The exposure is set once when the sequence is started. Changing it (e.g. for the other channel) means
+stopping and starting the sequence again, so the gain is largest when many images in a row have the
+same exposure, as in arrayAcquisition_ShutterControl(order='two-pass').
+
+Only tested so far against the simulated camera in benchmarks/fake_hardware.py (FakeCore), not against
+micromanager itself. Try it on the micromanager demo camera (DemoCamera in MMConfig_demo.cfg, no hardware
+needed) before using it on the microscope.
+'''
+
+#%%
+class SequenceError(Exception):
+
+    '''
+    SequenceError: raised when no frame arrives from the sequence acquisition in time
+    '''
+
+    pass
+
+#%%
+class SequenceCamera(object):
+
+    '''
+    SequenceCamera: the camera running a continuous sequence acquisition, with a thread that keeps
+    the newest frames from the circular buffer
+
+    inputs:
+        mmc: micromanager core with the camera loaded
+        readout_time: time from the end of the exposure of a frame to it being in the circular buffer, in s.
+        A frame is only used if it arrived at least exposure + readout_time after it was asked for, and
+        if it is not the frame the camera was already on when it was asked for (the frames already in 
+        the buffer and taken out of it are counted), so it was exposed after that (default 0.02)
+        timeout: longest wait for a frame, in s, as well as the exposure (default 5)
+        poll_interval: time between checks of the circular buffer when it is empty, in s (default 0.001)
+        keep: number of the newest frames kept (default 4), older frames are dropped
+
+    attributes:
+        nframes: number of frames taken from the circular buffer
+        nused: number of frames returned by nextFrame
+
+    usage:
+        sequence=SequenceCamera(mmc)
+        sequence.start(exposure) #in ms
+        ... #move the stage, open or close the shutter
+        img=sequence.nextFrame() #first frame exposed after this call
+        sequence.start(other_exposure) #restarts the sequence at another exposure
+        sequence.stop()
+    '''
+
+    def __init__(self,mmc,readout_time=0.02,timeout=5,poll_interval=0.001,keep=4):
+        self.mmc=mmc
+        self.readout_time=readout_time
+        self.timeout=timeout
+        self.poll_interval=poll_interval
+        self.frames=deque(maxlen=keep) #(frame number, time the frame was taken from the buffer, frame)
+        self.condition=threading.Condition()
+        self.exposure=None
+        self.running=False
+        self.thread=None
+        self.error=None
+        self.nframes=0
+        self.nused=0
+
+    def start(self,exposure):
+
+        '''
+        start: starts a continuous sequence acquisition at an exposure in ms, stopping the one running
+        '''
+
+        self.stop()
+        self.mmc.setExposure(exposure)
+        self.exposure=exposure
+        self.frames.clear()
+        self.mmc.clearCircularBuffer()
+        self.mmc.startContinuousSequenceAcquisition(0) #as fast as the exposure allows
+
+        self.running=True
+        self.thread=threading.Thread(target=self._run)
+        self.thread.daemon=True
+        self.thread.start()
+
+    def stop(self):
+
+        '''
+        stop: stops the sequence acquisition and the consumer thread
+        '''
+
+        if not self.running:
+            return
+        self.running=False
+        self.thread.join()
+        self.mmc.stopSequenceAcquisition()
+
+    def nextFrame(self):
+
+        '''
+        nextFrame: the first frame exposed after this call, waits for it to arrive. Raises a
+        SequenceError if none arrives within the exposure + timeout
+        '''
+
+        if not self.running:
+            raise SequenceError('The sequence acquisition is not running, call start first')
+
+        earliest=time.time()+self.exposure/1000.0+self.readout_time #first arrival of a frame exposed from now
+        deadline=earliest+self.timeout
+        with self.condition:
+            ###frames finished before now, the next one may already be exposing
+            first=self.nframes+self.mmc.getRemainingImageCount()+1
+            while True:
+                for number, arrived, frame in self.frames:
+                    if number>=first and arrived>=earliest:
+                        self.nused=self.nused+1
+                        return frame
+                if self.error is not None:
+                    raise self.error
+                remaining=deadline-time.time()
+                if remaining<=0:
+                    raise SequenceError('No frame from the camera {} s after the exposure'.format(self.timeout))
+                self.condition.wait(min(remaining,0.1))
+
+    def _run(self):
+
+        try:
+            while self.running:
+                if self.mmc.getRemainingImageCount()==0:
+                    time.sleep(self.poll_interval)
+                    continue
+                with self.condition: #frames are counted as they leave the buffer, see nextFrame
+                    frame=self.mmc.popNextImage()
+                    self.frames.append((self.nframes,time.time(),frame))
+                    self.nframes=self.nframes+1
+                    self.condition.notify_all()
+        except Exception as e:
+            with self.condition:
+                self.error=e
+                self.condition.notify_all()
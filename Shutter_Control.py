@@ -0,0 +1,159 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import time
+import numpy as np
+
+'''
+Python side of the shutter handshake with shutterControlv2_lab.ino.
+
+The arduino sweeps the servo when it receives 'a' (open) or 'z' (close), and replies with a line
+'o' or 'c' once the sweep is finished. ShutterController sends the command and blocks on the serial
+port (with a timeout) until the reply arrives, instead of spinning in a loop, and keeps track of how
+long each move took.
+'''
+
+#%%
+class ShutterError(Exception):
+
+    '''
+    ShutterError: raised when the arduino does not confirm a shutter move
+    '''
+
+    pass
+
+#%%
+class ShutterController(object):
+
+    '''
+    ShutterController: opens and closes the shutter through the serial connection to the arduino.
+
+    Every move waits for the reply from the arduino with a blocking read, so no cpu is used while
+    the servo sweeps. Lines other than the expected reply (e.g. garbled bytes) are ignored. If no reply
+    arrives within the timeout the command is sent again, up to retries times, then a ShutterError
+    is raised. Note that a repeated command makes the arduino redo the whole sweep.
+
+    The time of every move (from sending the command to receiving the reply) is recorded, so the
+    servo sweep in shutterControlv2_lab.ino (31 steps x 50 ms) can be tuned against measured numbers,
+    see printLatencies and latencyHistogram.
+
+    The position of the shutter is tracked, and a command to move to the position the shutter is
+    already in is not sent (unless force=True), so the order of the images can be chosen to avoid
+    servo sweeps. The position is unknown until the first move, so the first command is always sent.
+
+    inputs:
+        port: open serial.Serial connection to the arduino
+        timeout: time to wait for the reply to a command, in s (default 5)
+        retries: number of times a command is sent again if there is no reply (default 2)
+
+    usage:
+        shutter=ShutterController(arduino)
+        shutter.openShutter() #for brightfield images
+        shutter.closeShutter() #for fluorescent images
+        shutter.printLatencies()
+    '''
+
+    commands={'open': ('a','o'), 'closed': ('z','c')} #command sent and reply expected for each position
+
+    def __init__(self,port,timeout=5,retries=2):
+        self.port=port
+        self.timeout=timeout
+        self.retries=retries
+        self.latencies={'open': [], 'closed': []} #time of each move, in s
+        self.nretries=0 #number of commands that had to be sent again
+        self.ignored=[] #unexpected lines received from the arduino
+        self.position=None #'open' or 'closed' once known
+        self.nskipped=0 #number of moves not needed because the shutter was already in position
+
+    def openShutter(self,force=False):
+
+        '''
+        openShutter: opens the shutter and waits for the arduino to confirm. returns the time taken, in s
+        '''
+
+        return self._move('open',force)
+
+    def closeShutter(self,force=False):
+
+        '''
+        closeShutter: closes the shutter and waits for the arduino to confirm. returns the time taken, in s
+        '''
+
+        return self._move('closed',force)
+
+    def _move(self,position,force):
+
+        if self.position==position and not force:
+            self.nskipped=self.nskipped+1
+            return 0
+
+        command,reply=self.commands[position]
+        self.position=None #unknown until the arduino confirms the move
+        start=time.time()
+
+        for attempt in range(self.retries+1):
+            if attempt>0:
+                self.nretries=self.nretries+1
+                print('No reply from shutter, sending command again')
+
+            self.port.reset_input_buffer() #discard anything left over from before this command
+            self.port.write(command.encode('ascii'))
+
+            deadline=time.time()+self.timeout
+            while True:
+                remaining=deadline-time.time()
+                if remaining<=0:
+                    break
+                self.port.timeout=remaining #readline blocks until a full line arrives or the time is up
+                line=self.port.readline()
+                if not line.endswith(b'\n'): #timed out
+                    break
+
+                data=line.decode('ascii','replace').strip() #\r\n are characters that get appended to data sent from Arduino
+                if data==reply:
+                    latency=time.time()-start
+                    self.latencies[position].append(latency)
+                    self.position=position
+                    return latency
+                self.ignored.append(data)
+
+        raise ShutterError('Shutter did not confirm {} position after {} attempts ({:.1f} s)'.format(
+                           position,self.retries+1,time.time()-start))
+
+    def latencyHistogram(self,position,bins=10):
+
+        '''
+        latencyHistogram: histogram of the move times to a position ('open' or 'closed')
+
+        returns:
+            counts, bin_edges: as np.histogram, bin edges in s
+        '''
+
+        latencies=self.latencies[position]
+        low,high=min(latencies),max(latencies)
+        if high<=low: #all moves took the same time
+            high=low+0.001
+
+        return np.histogram(latencies,bins=bins,range=(low,high))
+
+    def printLatencies(self,bins=10):
+
+        '''
+        printLatencies: prints percentiles and a histogram of the move times in each direction
+        '''
+
+        for position in ('open','closed'):
+            latencies=np.array(self.latencies[position])
+            if len(latencies)==0:
+                continue
+
+            print('Shutter {}: {} moves, median {:.3f} s, 95th percentile {:.3f} s, max {:.3f} s'.format(
+                  position,len(latencies),np.percentile(latencies,50),np.percentile(latencies,95),latencies.max()))
+
+            counts,edges=self.latencyHistogram(position,bins)
+            for n,low,high in zip(counts,edges[:-1],edges[1:]):
+                print('    {:.3f}-{:.3f} s | {}'.format(low,high,'#'*int(n)))
+
+        if self.nskipped>0:
+            print('Shutter: {} moves skipped, shutter was already in position'.format(self.nskipped))
+        if self.nretries>0 or self.ignored:
+            print('Shutter: {} commands sent again, {} unexpected lines ignored'.format(self.nretries,len(self.ignored)))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import csv
+import time
+import cv2
+import numpy as np
+
+'''
+Waiting for the XY stage to settle after a move, for arrayAcquisition_ShutterControl in
+Inkjet_Acquisition_Analysis.py.
+'''
+
+#%%
+def imageSharpness(img):
+
+    '''
+    imageSharpness: variance of the laplacian of an image, larger for sharper images
+    '''
+
+    return cv2.Laplacian(np.asarray(img,np.float32),cv2.CV_32F).var()
+
+#%%
+class StageSettler(object):
+
+    '''
+    StageSettler: waits for the stage to settle after each move and logs how long each wait took.
+
+    modes:
+        'fixed': waits settle_time after the move was sent (the original 0.5 s delay)
+        'busy': polls mmc.deviceBusy for the stage until it reports the move is finished
+        'sharpness': as 'busy', then snaps images until the sharpness of two images in a row
+        differs by less than sharpness_tol (a fraction), or max_snaps images have been taken.
+        These images are not kept. Uses the exposure that is currently set.
+
+    inputs:
+        mmc: initialized micromanager core
+        mode: 'fixed', 'busy' or 'sharpness' (default 'fixed')
+        stage: name of the XY stage device (default 'XYStage')
+        settle_time: delay for 'fixed' mode, in s (default 0.5)
+        timeout: longest wait for the stage in 'busy' and 'sharpness' mode, in s (default 5)
+        poll_interval: time between deviceBusy checks, in s (default 0.005)
+        sharpness_tol, max_snaps: see 'sharpness' mode (defaults 0.05 and 5)
+
+    usage:
+        settler=StageSettler(mmc,'busy')
+        mmc.setRelativeXYPosition('XYStage',dx,0)
+        moved=time.time()
+        ... #anything that can happen while the stage moves
+        settler.settle(moved)
+        settler.printSummary()
+        settler.writeLog(filename) #one row per move
+    '''
+
+    def __init__(self,mmc,mode='fixed',stage='XYStage',settle_time=0.5,timeout=5,poll_interval=0.005,
+                 sharpness_tol=0.05,max_snaps=5):
+        if mode not in ('fixed','busy','sharpness'):
+            raise ValueError("mode must be 'fixed', 'busy' or 'sharpness'")
+
+        self.mmc=mmc
+        self.mode=mode
+        self.stage=stage
+        self.settle_time=settle_time
+        self.timeout=timeout
+        self.poll_interval=poll_interval
+        self.sharpness_tol=sharpness_tol
+        self.max_snaps=max_snaps
+        self.log=[] #(move number, time from sending the move to settled, time spent waiting, images snapped), in s
+
+    def settle(self,moved):
+
+        '''
+        settle: waits until the stage has settled after a move sent at time moved (from time.time()).
+        returns the time spent waiting, in s
+        '''
+
+        start=time.time()
+        nsnaps=0
+
+        if self.mode=='fixed':
+            time.sleep(max(0,self.settle_time-(start-moved))) #only wait for what is left of the delay
+
+        else:
+            while self.mmc.deviceBusy(self.stage):
+                if time.time()-moved>self.timeout:
+                    print('Warning: stage still busy {} s after move'.format(self.timeout))
+                    break
+                time.sleep(self.poll_interval)
+
+            if self.mode=='sharpness':
+                previous=None
+                while nsnaps<self.max_snaps:
+                    self.mmc.snapImage()
+                    sharpness=imageSharpness(self.mmc.getImage())
+                    nsnaps=nsnaps+1
+                    if previous is not None and abs(sharpness-previous)<=self.sharpness_tol*max(previous,1e-9):
+                        break
+                    previous=sharpness
+
+        end=time.time()
+        self.log.append((len(self.log)+1,end-moved,end-start,nsnaps))
+
+        return end-start
+
+    def printSummary(self):
+
+        '''
+        printSummary: prints the total and per-move time spent waiting for the stage
+        '''
+
+        if not self.log:
+            return
+
+        waits=np.array([entry[2] for entry in self.log])
+        print('Stage settle ({}): {} moves, {:.1f} s waiting in total, median {:.3f} s, max {:.3f} s per move'.format(
+              self.mode,len(waits),waits.sum(),np.median(waits),waits.max()))
+
+    def writeLog(self,filename):
+
+        '''
+        writeLog: writes one row per move to a .csv file
+        '''
+
+        with open(filename,'w') as f:
+            writer=csv.writer(f)
+            writer.writerow(['Move','Move to settled (s)','Waiting (s)','Focus images'])
+            for move,total,waiting,nsnaps in self.log:
+                writer.writerow([move,round(total,4),round(waiting,4),nsnaps])
@@ -0,0 +1,261 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import csv
+import json
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+
+'''
+Timing of each step of the acquisition and the analysis (imread, threshold, distance transform,
+watershed, shutter, snap, stage move, ...), for DropletCellCount, arrayAcquisition_ShutterControl and
+acquireAndCount in Inkjet_Acquisition_Analysis.py (profile=True).
+
+The steps are timed where they happen with
+
+    with timed('watershed'):
+        markers=cv2.watershed(img,markers)
+
+which records the time into the profiler that is switched on with profiling(profiler) on the same thread,
+so arrays analyzed at once on different threads (e.g. by batchCount) each get their own times. Threads
+that work for an acquisition or an analysis (e.g. the image writer thread) take over the profiler of the
+thread that starts them (see activeProfiler). While no profiler is switched on, timed() returns the same
+do-nothing context manager every time, so the timers can stay in the code for good.
+
+The worker processes of DropletCellCount time each image with their own profiler and send the times
+back with the result, where they are added to the profiler of the array (see merge).
+'''
+
+#%%
+class _Off(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        return False
+
+_off=_Off() #timer used while profiling is off
+
+class _Timer(object):
+
+    def __init__(self,profiler,step):
+        self.profiler=profiler
+        self.step=step
+
+    def __enter__(self):
+        self.start=time.time()
+        return self
+
+    def __exit__(self,*exc):
+        self.profiler.record(self.step,time.time()-self.start)
+        return False
+
+#%%
+class StepProfiler(object):
+
+    '''
+    StepProfiler: time of every step of an array, with percentiles per step
+
+    inputs:
+        label: label of the array, passed to the hooks and written to the report (default None)
+
+    attributes:
+        samples: dictionary of step name -> list of times, in s, in the order they were recorded
+
+    usage:
+        profiler=StepProfiler(array_label)
+        profiler.addHook(collector) #optional, collector(step, seconds, label) is called for every time recorded
+        with profiling(profiler):
+            ... #code with timed() steps, or DropletCellCount(...,profile=profiler)
+        profiler.printSummary()
+        profiler.writeReport('profile.json') #or .csv
+    '''
+
+    def __init__(self,label=None):
+        self.label=label
+        self.samples={}
+        self.hooks=[]
+        self.lock=threading.Lock() #steps are recorded from more than one thread
+
+    def addHook(self,hook):
+
+        '''
+        addHook: hook(step, seconds, label) is called for every time recorded, from the thread that
+        recorded it. For sending the times to another metrics collector
+        '''
+
+        self.hooks.append(hook)
+
+    def step(self,step):
+
+        '''
+        step: context manager that records the time spent inside it under step
+        '''
+
+        return _Timer(self,step)
+
+    def record(self,step,seconds):
+
+        '''
+        record: adds one time, in s, to a step
+        '''
+
+        with self.lock:
+            self.samples.setdefault(step,[]).append(seconds)
+        for hook in self.hooks:
+            hook(step,seconds,self.label)
+
+    def merge(self,samples):
+
+        '''
+        merge: adds the times of another profiler (its samples), e.g. from a worker process
+        '''
+
+        for step in sorted(samples):
+            for seconds in samples[step]:
+                self.record(step,seconds)
+
+    def summary(self):
+
+        '''
+        summary: one dictionary per step, with the number of times it was timed and the total, mean,
+        median, 90th and 99th percentile and max time, in s. Steps with the largest total first
+        '''
+
+        rows=[]
+        with self.lock:
+            samples=dict((step,np.array(times)) for step,times in self.samples.items())
+        for step,times in samples.items():
+            rows.append({'Step': step,
+                         'Count': len(times),
+                         'Total (s)': float(times.sum()),
+                         'Mean (s)': float(times.mean()),
+                         'Median (s)': float(np.percentile(times,50)),
+                         '90th percentile (s)': float(np.percentile(times,90)),
+                         '99th percentile (s)': float(np.percentile(times,99)),
+                         'Max (s)': float(times.max())})
+        rows.sort(key=lambda row: -row['Total (s)'])
+
+        return rows
+
+    def printSummary(self):
+
+        '''
+        printSummary: prints the total, median, 90th percentile and max time of each step
+        '''
+
+        rows=self.summary()
+        if not rows:
+            return
+
+        print('Time per step{}:'.format('' if self.label is None else ' (array {})'.format(self.label)))
+        for row in rows:
+            print('  {:<20} {:6d} x  total {:8.3f} s  median {:8.2f} ms  90% {:8.2f} ms  max {:8.2f} ms'.format(
+                  row['Step'],row['Count'],row['Total (s)'],1000*row['Median (s)'],
+                  1000*row['90th percentile (s)'],1000*row['Max (s)']))
+
+    def writeReport(self,filename):
+
+        '''
+        writeReport: writes the summary to a .json file (with the label of the array) or to a .csv file,
+        one row per step, depending on the extension of filename
+        '''
+
+        rows=self.summary()
+        if filename.endswith('.json'):
+            with open(filename,'w') as f:
+                json.dump({'label': self.label, 'steps': rows},f,indent=1,sort_keys=True)
+            return
+
+        columns=['Step','Count','Total (s)','Mean (s)','Median (s)','90th percentile (s)','99th percentile (s)','Max (s)']
+        with open(filename,'w') as f:
+            writer=csv.DictWriter(f,fieldnames=columns)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(dict((column,row[column] if column=='Step' else round(row[column],6))
+                                     for column in columns))
+
+#%%
+_local=threading.local() #profilers switched on with profiling() on each thread, the last one records the times
+
+def _active():
+
+    if not hasattr(_local,'profilers'):
+        _local.profilers=[]
+    return _local.profilers
+
+def activeProfiler():
+
+    '''
+    activeProfiler: the profiler switched on on this thread, or None. A thread started to work for an
+    acquisition or an analysis switches it on for itself, e.g.
+
+        profiler=activeProfiler() #on the thread starting the helper thread
+        ...
+        with profiling(profiler): #on the helper thread
+    '''
+
+    active=getattr(_local,'profilers',None) #timed() is called for every step, so no list is made here
+    if not active:
+        return None
+    return active[-1]
+
+def startProfiling(profiler):
+
+    '''
+    startProfiling: switches profiler on for the steps timed from now on on this thread, until
+    stopProfiling. Does nothing if profiler is None
+    '''
+
+    if profiler is not None:
+        _active().append(profiler)
+
+def stopProfiling(profiler):
+
+    '''
+    stopProfiling: switches a profiler started with startProfiling off again
+    '''
+
+    active=_active()
+    if profiler is not None and profiler in active:
+        active.remove(profiler)
+
+@contextmanager
+def profiling(profiler):
+
+    '''
+    profiling: switches profiler on for the steps timed inside the with block, see startProfiling
+    '''
+
+    startProfiling(profiler)
+    try:
+        yield profiler
+    finally:
+        stopProfiling(profiler)
+
+def timed(step):
+
+    '''
+    timed: context manager that times a step into the profiler that is switched on on this thread, if any
+    '''
+
+    profiler=activeProfiler()
+    if profiler is None:
+        return _off
+    return profiler.step(step)
+
+def makeProfiler(profile,label=None):
+
+    '''
+    makeProfiler: the profiler for the profile argument of the acquisition and analysis functions:
+    None if profile is False or None, a new StepProfiler if it is True, or profile itself if it is
+    already a StepProfiler (e.g. one with hooks added)
+    '''
+
+    if profile is None or profile is False:
+        return None
+    if profile is True:
+        return StepProfiler(label)
+    return profile
@@ -0,0 +1,147 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import os
+import sys
+
+'''
+Baselines of the benchmarks, so a run can fail (exit code 1) when a change makes the counts wrong
+or the throughput drop, e.g. in CI.
+
+There are two baselines, both holding for each benchmark and size it was run at one entry per configuration:
+
+    baseline.json: the number of correct results each configuration must get. It is committed with the
+    benchmarks and is the known truth of the synthetic data wherever the configuration can reach it
+    (e.g. 48/48 for the skip_empty configurations of bench_analysis). Edit it by hand when a change is
+    meant to change the accuracy of a configuration.
+
+    throughput.json: the throughput of each configuration. Throughput depends on the machine, so this file
+    is not committed. The machine that checks the benchmarks saves its own with --save-throughput (e.g.
+    from the target branch, before the change is checked), and the throughput is only checked once it exists.
+
+A run fails if a configuration gets fewer correct results than baseline.json, or its throughput is below
+(1 - tolerance) times throughput.json.
+
+usage (in a benchmark):
+    parser=benchmarkParser('Benchmark of ...')
+    parser.add_argument(...) #the options of the benchmark
+    args=parser.parse_args()
+    results=benchmark(...) #dictionary of configuration -> (throughput, number correct)
+    finish('bench_name 48 droplets',results,args,failures) #exits with 1 if anything failed
+'''
+
+BASELINE_FILE=os.path.join(os.path.dirname(os.path.abspath(__file__)),'baseline.json')
+THROUGHPUT_FILE=os.path.join(os.path.dirname(os.path.abspath(__file__)),'throughput.json')
+
+#%%
+def benchmarkParser(description):
+
+    '''
+    benchmarkParser: argument parser with the baseline options shared by the benchmarks
+    '''
+
+    parser=argparse.ArgumentParser(description=description)
+    parser.add_argument('--tolerance',type=float,default=0.5,
+                        help='fraction the throughput may drop below the throughput baseline before failing (default 0.5)')
+    parser.add_argument('--save-throughput',action='store_true',
+                        help='save the throughput of this run as the throughput baseline of this machine')
+    parser.add_argument('--baseline',default=BASELINE_FILE,help='accuracy targets (default baseline.json next to the benchmarks)')
+    parser.add_argument('--throughput',default=THROUGHPUT_FILE,
+                        help='throughput baseline of this machine (default throughput.json next to the benchmarks)')
+
+    return parser
+
+#%%
+def loadBaseline(filename):
+
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+#%%
+def compareAccuracy(key,results,filename=BASELINE_FILE):
+
+    '''
+    compareAccuracy: compares the number of correct results of a benchmark with the targets stored under key
+
+    inputs:
+        key: name of the benchmark and the size it was run at
+        results: dictionary of configuration -> (throughput, number correct)
+
+    returns:
+        failures: list of messages, one per configuration below its target
+    '''
+
+    targets=loadBaseline(filename).get(key)
+    if targets is None:
+        print('No accuracy targets for {}'.format(key))
+        return []
+
+    failures=[]
+    for name in sorted(results):
+        if name in targets and results[name][1]<targets[name]:
+            failures.append('{}: {} correct, target {}'.format(name,results[name][1],targets[name]))
+
+    return failures
+
+#%%
+def compareThroughput(key,results,tolerance=0.5,filename=THROUGHPUT_FILE):
+
+    '''
+    compareThroughput: compares the throughput of a benchmark with the throughput baseline stored under key
+
+    inputs:
+        key: name of the benchmark and the size it was run at
+        results: dictionary of configuration -> (throughput, number correct)
+        tolerance: fraction the throughput may drop below the baseline (default 0.5)
+
+    returns:
+        failures: list of messages, one per configuration slower than the baseline allows
+    '''
+
+    baseline=loadBaseline(filename).get(key)
+    if baseline is None:
+        print('No throughput baseline for {} on this machine, save one with --save-throughput'.format(key))
+        return []
+
+    failures=[]
+    for name in sorted(results):
+        if name in baseline and results[name][0]<(1-tolerance)*baseline[name]:
+            failures.append('{}: {:.2f} per s, baseline {:.2f} per s'.format(name,results[name][0],baseline[name]))
+
+    return failures
+
+#%%
+def saveThroughput(key,results,filename=THROUGHPUT_FILE):
+
+    '''
+    saveThroughput: stores the throughput of a benchmark as the baseline under key, keeping the other benchmarks
+    '''
+
+    baseline=loadBaseline(filename)
+    baseline[key]=dict((name,round(rate,3)) for name,(rate,correct) in results.items())
+    with open(filename,'w') as f:
+        json.dump(baseline,f,indent=1,sort_keys=True)
+        f.write('\n')
+
+#%%
+def finish(key,results,args,failures=()):
+
+    '''
+    finish: checks the results against the accuracy targets and the throughput baseline (or saves the
+    throughput baseline), prints the failures and exits with 1 if there are any. failures are the checks
+    of the benchmark itself that failed (e.g. images saved wrong)
+    '''
+
+    failures=list(failures)+compareAccuracy(key,results,args.baseline)
+    if args.save_throughput:
+        saveThroughput(key,results,args.throughput)
+        print('Throughput baseline saved for {}'.format(key))
+    else:
+        failures.extend(compareThroughput(key,results,args.tolerance,args.throughput))
+
+    for failure in failures:
+        print('FAILED {}'.format(failure))
+    sys.exit(1 if failures else 0)
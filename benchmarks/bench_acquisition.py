@@ -0,0 +1,133 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import time
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Scan_Path import rectangularGrid
+from Image_Stack import stackPath, openStack, CHANNELS
+from synthetic_droplets import SyntheticArray
+from fake_hardware import FakeCore, FakeArduino
+from Hardware_Session import HardwareSession
+from Step_Profiler import StepProfiler
+import Inkjet_Acquisition_Analysis as script
+from bench_analysis import Quiet
+from baseline import benchmarkParser, finish
+
+'''
+Benchmark of arrayAcquisition_ShutterControl on simulated hardware (see fake_hardware.py): the time to
+acquire a synthetic array with each shutter order, settle mode, storage and camera mode, split into the
+time spent waiting for the shutter, taking images (snaps, or frames from a sequence acquisition), waiting
+for the stage and everything else (saving, plotting, bookkeeping), from the profile of the acquisition
+(see Step_Profiler.py). Every saved image is compared with the frame the camera was shown, so a configuration that
+saves the wrong channel or droplet, or a frame exposed while the stage or the shutter moved, is caught.
+
+The servo sweep, stage speed and camera readout can be set to those of the real setup, so the effect of
+a change to the acquisition can be estimated before it is tried on the microscope.
+
+Fails (exit code 1) if any image is saved wrong, or if a configuration is slower than the baselines
+(see baseline.py).
+
+usage:
+    python benchmarks/bench_acquisition.py [number of droplets] [shutter sweep time in s] [--tolerance 0.5] [--save-throughput]
+'''
+
+CHANNEL_CONFIG={'BF': ('Channel','BF'),'FL': ('Channel','FL')} #applied between the passes, as on the microscope
+
+#%%
+def savedCorrect(array,directory,array_label,storage):
+
+    '''
+    savedCorrect: number of saved images equal to the frame of their droplet and channel
+    '''
+
+    if storage=='stack':
+        stack=openStack(stackPath(directory,array_label))
+    correct=0
+    for nimg in range(1,array.ndroplets+1):
+        frames=dict(zip(['BF','FL'],array.frames(nimg)))
+        for channel in CHANNELS:
+            if storage=='stack':
+                saved=stack[nimg-1,CHANNELS.index(channel)]
+                expected=frames[channel]
+            else:
+                saved=cv2.imread('{}/array{}_{}image{}.png'.format(directory,array_label,channel,str(nimg).zfill(4)),-1)
+                expected=frames[channel].astype('uint8') #as writeImage saves them
+            if saved is not None and saved.shape==expected.shape and (saved==expected).all():
+                correct=correct+1
+
+    return correct
+
+#%%
+def benchmark(ndroplets=24,sweep_time=0.1,expBF=5,expFL=20,settle_time=0.1):
+
+    ncols=6
+    nrows=max(1,ndroplets//ncols)
+    ndroplets=ncols*nrows
+    dx,dy=300,300
+    array=SyntheticArray(ndroplets)
+    positions=rectangularGrid(ncols,nrows,dx,dy)
+
+    configurations=[('pairs, fixed settle',{}),
+                    ('pairs, busy settle',{'settle': 'busy'}),
+                    ('alternate, busy, pipelined',{'order': 'alternate','settle': 'busy','pipelined': True}),
+                    ('two-pass, busy, pipelined',{'order': 'two-pass','settle': 'busy','pipelined': True}),
+                    ('two-pass, busy, pipelined, sequence',{'order': 'two-pass','settle': 'busy','pipelined': True,
+                                                            'camera': 'sequence','channel_config': CHANNEL_CONFIG}),
+                    ('alternate, busy, stack',{'order': 'alternate','settle': 'busy','storage': 'stack'})]
+
+    print('{} droplets, {} s shutter sweep, {} ms BF and {} ms FL exposure, {} s fixed settle'.format(
+          ndroplets,sweep_time,expBF,expFL,settle_time))
+    print('{:>36}  {:>8} {:>9} {:>8} {:>8} {:>8} {:>8}  {}'.format(
+          '','total s','images/s','shutter','camera','settle','other','images correct'))
+
+    results={} #configuration -> (images/s, images correct)
+    failures=[]
+    cwd=os.getcwd()
+    for name,options in configurations:
+        directory=tempfile.mkdtemp()
+        try:
+            os.chdir(directory)
+            arduino=FakeArduino(sweep_time=sweep_time)
+            core=FakeCore(array,positions,arduino)
+            session=HardwareSession(mmc=core,arduino=arduino)
+            profiler=StepProfiler()
+
+            start=time.time()
+            with Quiet():
+                script.arrayAcquisition_ShutterControl(ncols,nrows,dx,dy,expBF,expFL,'Bench',directory,
+                                                       show=False,session=session,profile=profiler,
+                                                       settle_time=settle_time,**options)
+            elapsed=time.time()-start
+
+            steps=dict((step,sum(times)) for step,times in profiler.samples.items())
+            shutter_time=steps.get('shutter',0)
+            camera=sum(steps.get(step,0) for step in ('exposure','snap','get image','frame'))
+            settle=steps.get('settle',0)
+            other=elapsed-shutter_time-camera-settle
+            correct=savedCorrect(array,directory,'Bench',options.get('storage','png'))
+            results[name]=(2*ndroplets/elapsed,correct)
+            if correct!=2*ndroplets:
+                failures.append('{}: {} of {} images saved wrong'.format(name,2*ndroplets-correct,2*ndroplets))
+            print('{:>36}: {:8.2f} {:9.1f} {:8.2f} {:8.2f} {:8.2f} {:8.2f}  {}/{}'.format(
+                  name,elapsed,2*ndroplets/elapsed,shutter_time,camera,settle,other,correct,2*ndroplets))
+
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(directory,ignore_errors=True)
+
+    return results, failures
+
+
+if __name__=='__main__':
+    parser=benchmarkParser('Benchmark of arrayAcquisition_ShutterControl on simulated hardware')
+    parser.add_argument('ndroplets',type=int,nargs='?',default=24)
+    parser.add_argument('sweep_time',type=float,nargs='?',default=0.1)
+    args=parser.parse_args()
+    results,failures=benchmark(args.ndroplets,args.sweep_time)
+    finish('bench_acquisition {} droplets, {} s sweep'.format(args.ndroplets,args.sweep_time),results,args,failures)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Droplet_Segmentation import loadImage, segmentImage, regionAreas, flagRegions, isEmpty, loadFrame, brightfieldPath
+from Droplet_Localization import locateDroplet
+from synthetic_droplets import SyntheticArray
+from Inkjet_Acquisition_Analysis import DropletCellCount
+from baseline import benchmarkParser, finish
+
+'''
+Benchmark of DropletCellCount on a synthetic array saved as pngs (see SyntheticArray in synthetic_droplets.py):
+images per second and count accuracy against the known number of beads in each droplet, for the default
+analysis and its options, and the time of each step of the analysis of one image.
+
+Fails (exit code 1) if the counts with worker processes differ from the counts of the same options with
+one process, or if a configuration is less accurate or slower than the baselines (see baseline.py).
+
+usage:
+    python benchmarks/bench_analysis.py [number of droplets] [mean number of beads per droplet] [number of workers]
+                                        [--tolerance 0.5] [--save-throughput]
+'''
+
+#%%
+class Quiet(object):
+
+    '''
+    Quiet: hides what is printed inside a with block (the flag messages of DropletCellCount)
+    '''
+
+    def __enter__(self):
+        self.stdout=sys.stdout
+        sys.stdout=open(os.devnull,'w')
+
+    def __exit__(self,*exc):
+        sys.stdout.close()
+        sys.stdout=self.stdout
+
+#%%
+def stageTimes(directory,array_label,nimgs,pixels_to_um=2.2,diam_min=8,diam_max=18):
+
+    '''
+    stageTimes: average time of each step of the analysis of one image, in s
+    '''
+
+    steps=['read','find droplet','empty check','segment','measure']
+    times=dict((step,0.0) for step in steps)
+    for i in range(nimgs):
+        imgPath='{}/array{}_FLimage{}.png'.format(directory,array_label,str(i+1).zfill(4))
+
+        start=time.time()
+        img,img_gray=loadImage(imgPath)
+        times['read']+=time.time()-start
+
+        start=time.time()
+        locateDroplet(loadFrame(brightfieldPath(imgPath)),pixels_to_um,50,400)
+        times['find droplet']+=time.time()-start
+
+        start=time.time()
+        isEmpty(img_gray)
+        times['empty check']+=time.time()-start
+
+        start=time.time()
+        markers=segmentImage(img,img_gray)
+        times['segment']+=time.time()-start
+
+        start=time.time()
+        flagRegions(regionAreas(markers),markers.shape[1],pixels_to_um,diam_min,diam_max,imgPath)
+        times['measure']+=time.time()-start
+
+    return [(step,times[step]/nimgs) for step in steps]
+
+#%%
+def benchmark(ndroplets=48,loading=1.0,nworkers=4,missing=0.1):
+
+    ncols=8
+    nrows=max(1,ndroplets//ncols)
+    ndroplets=ncols*nrows
+    array=SyntheticArray(ndroplets,loading=loading,missing=missing)
+
+    directory=tempfile.mkdtemp()
+    cwd=os.getcwd()
+    try:
+        array.writePngs(directory,'Bench')
+        os.chdir(directory) #DropletCellCount writes its .csv file to the working directory
+
+        print('{} droplets, {:.0f}% empty, {:.0f}% not printed (mean loading {})'.format(
+              ndroplets,100*np.mean(array.truth==0),100*missing,loading))
+        configurations=[('default',{}),
+                        ('skip_empty',{'skip_empty': True}),
+                        ('crop',{'crop': True}),
+                        ('crop+skip_empty',{'crop': True,'skip_empty': True}),
+                        ('native_depth',{'native_depth': True}),
+                        ('{} workers'.format(nworkers),{'nworkers': nworkers}),
+                        ('{} workers, crop+skip_empty'.format(nworkers),{'nworkers': nworkers,'crop': True,'skip_empty': True})]
+        results={} #configuration -> (images/s, counts correct)
+        counts={}
+        for name,options in configurations:
+            start=time.time()
+            with Quiet():
+                count=DropletCellCount(directory,'Bench',nrows,ncols,'20X',show=False,**options)
+            elapsed=time.time()-start
+            correct=int((count==array.truth).sum())
+            results[name]=(ndroplets/elapsed,correct)
+            counts[name]=count
+            print('{:>32}: {:6.1f} images/s, {}/{} counts correct'.format(name,ndroplets/elapsed,correct,ndroplets))
+
+        print('time per image of each step:')
+        for step,seconds in stageTimes(directory,'Bench',min(ndroplets,16)):
+            print('{:>32}: {:6.1f} ms'.format(step,1000*seconds))
+
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory,ignore_errors=True)
+
+    ###the worker processes must give the same counts as one process
+    failures=[]
+    for serial,workers in (('default','{} workers'.format(nworkers)),
+                           ('crop+skip_empty','{} workers, crop+skip_empty'.format(nworkers))):
+        if not (counts[serial]==counts[workers]).all():
+            failures.append('{}: counts differ from {}'.format(workers,serial))
+
+    return results, failures
+
+
+if __name__=='__main__':
+    parser=benchmarkParser('Benchmark of DropletCellCount on a synthetic array')
+    parser.add_argument('ndroplets',type=int,nargs='?',default=48)
+    parser.add_argument('loading',type=float,nargs='?',default=1.0)
+    parser.add_argument('nworkers',type=int,nargs='?',default=4)
+    args=parser.parse_args()
+    results,failures=benchmark(args.ndroplets,args.loading,args.nworkers)
+    finish('bench_analysis {} droplets, loading {}, {} workers'.format(args.ndroplets,args.loading,args.nworkers),
+           results,args,failures)
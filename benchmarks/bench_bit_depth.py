@@ -0,0 +1,67 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Droplet_Segmentation import frameToImages, segmentImage, segmentFrame, regionAreas, flagRegions
+from synthetic_droplets import beadFrame
+from baseline import benchmarkParser, finish
+
+'''
+Benchmark of the 8-bit path of DropletCellCount (frames converted with astype('uint8') as they are
+saved, then segmented with segmentImage) against the native bit depth path (segmentFrame on the frame
+from the camera).
+
+Synthetic 12-bit fluorescent frames with 0 to 3 beads each (bright disks of bead size on a noisy
+background) are counted with both paths. The number of beads put in each frame is the ground truth
+for the count accuracy, given separately for frames with beads and empty frames (Otsu thresholding
+splits the background noise of an empty frame into many regions with either path).
+
+Fails (exit code 1) if a path is less accurate or slower than the baselines (see baseline.py).
+
+usage:
+    python benchmarks/bench_bit_depth.py [number of frames] [--tolerance 0.5] [--save-throughput]
+'''
+
+#%%
+def count8bit(frame,pixels_to_um,diam_min,diam_max):
+
+    img,img_gray=frameToImages(frame) #astype('uint8'), as the frame is saved to png
+    markers=segmentImage(img,img_gray)
+    return flagRegions(regionAreas(markers),markers.shape[1],pixels_to_um,diam_min,diam_max,'frame')[0]
+
+#%%
+def countNative(frame,pixels_to_um,diam_min,diam_max):
+
+    markers=segmentFrame(frame)
+    return flagRegions(regionAreas(markers),markers.shape[1],pixels_to_um,diam_min,diam_max,'frame')[0]
+
+#%%
+def benchmark(nframes=40,pixels_to_um=2.2,diam_min=8,diam_max=18):
+
+    truth=[i%4 for i in range(nframes)]
+    frames=[beadFrame(n,pixels_to_um=pixels_to_um,seed=i) for i,n in enumerate(truth)]
+
+    results={} #path -> (frames/s, counts correct)
+    for name,function in (('8-bit',count8bit),('native depth',countNative)):
+        start=time.time()
+        counts=[function(frame,pixels_to_um,diam_min,diam_max) for frame in frames]
+        elapsed=time.time()-start
+        correct=np.array(counts)==np.array(truth)
+        beads=np.array(truth)>0
+        print('{:>13}: {:6.1f} frames/s, counts correct for {}/{} frames with beads and {}/{} empty frames'.format(
+              name,nframes/elapsed,correct[beads].sum(),beads.sum(),correct[~beads].sum(),(~beads).sum()))
+        results[name]=(nframes/elapsed,int(correct.sum()))
+
+    return results
+
+
+if __name__=='__main__':
+    parser=benchmarkParser('Benchmark of the 8-bit and native bit depth segmentation')
+    parser.add_argument('nframes',type=int,nargs='?',default=40)
+    args=parser.parse_args()
+    finish('bench_bit_depth {} frames'.format(args.nframes),benchmark(args.nframes),args)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Droplet_Segmentation import readAndSegment, regionAreas, flagRegions
+from synthetic_droplets import beadFrame
+from baseline import benchmarkParser, finish
+
+'''
+Benchmark of the empty droplet check of DropletCellCount (skip_empty=True): the time to count an array
+of droplets loaded with a Poisson distributed number of beads, with and without the check.
+
+Frames are 8-bit synthetic fluorescent frames (see beadFrame in synthetic_droplets.py) counted with the
+same steps as DropletCellCount. Droplets with beads that the check calls empty would be miscounted, so
+their number is printed too.
+
+Fails (exit code 1) if a droplet with beads is called empty, or if either way of counting is less accurate
+or slower than the baselines (see baseline.py).
+
+usage:
+    python benchmarks/bench_empty_droplets.py [number of frames] [mean number of beads per droplet]
+                                              [--tolerance 0.5] [--save-throughput]
+'''
+
+#%%
+def countFrame(frame,empty_contrast,pixels_to_um=2.2,diam_min=8,diam_max=18):
+
+    markers=readAndSegment(None,frame=frame,empty_contrast=empty_contrast)
+    if markers is None:
+        return 0
+    return flagRegions(regionAreas(markers),markers.shape[1],pixels_to_um,diam_min,diam_max,'frame')[0]
+
+#%%
+def benchmark(nframes=60,loading=1.0,empty_contrast=6):
+
+    rng=np.random.RandomState(0)
+    truth=np.minimum(rng.poisson(loading,nframes),4)
+    frames=[beadFrame(n,max_value=255,seed=i) for i,n in enumerate(truth)]
+
+    counts={}
+    timings={}
+    for name,contrast in (('segment all',None),('skip empty',empty_contrast)):
+        start=time.time()
+        counts[name]=np.array([countFrame(frame,contrast) for frame in frames])
+        timings[name]=time.time()-start
+
+    empty=truth==0
+    skipped=counts['skip empty']==0
+    print('{} frames, {:.0f}% empty (Poisson loading {})'.format(nframes,100*empty.mean(),loading))
+    for name in ('segment all','skip empty'):
+        print('{:>12}: {:6.1f} frames/s, {}/{} counts correct'.format(
+              name,nframes/timings[name],(counts[name]==truth).sum(),nframes))
+    print('speedup: {:.1f}x, droplets with beads called empty: {}'.format(
+          timings['segment all']/timings['skip empty'],(skipped&~empty).sum()))
+
+    results=dict((name,(nframes/timings[name],int((counts[name]==truth).sum()))) for name in timings)
+    failures=[]
+    if (skipped&~empty).any():
+        failures.append('skip empty: {} droplets with beads called empty'.format((skipped&~empty).sum()))
+
+    return results, failures
+
+
+if __name__=='__main__':
+    parser=benchmarkParser('Benchmark of the empty droplet check')
+    parser.add_argument('nframes',type=int,nargs='?',default=60)
+    parser.add_argument('loading',type=float,nargs='?',default=1.0)
+    args=parser.parse_args()
+    results,failures=benchmark(args.nframes,args.loading)
+    finish('bench_empty_droplets {} frames, loading {}'.format(args.nframes,args.loading),results,args,failures)
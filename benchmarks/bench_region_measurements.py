@@ -0,0 +1,80 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Droplet_Segmentation import segmentImage, measureRegions, measureRegionsBatch
+from baseline import benchmarkParser, finish
+
+'''
+Benchmark of the region measurement step of DropletCellCount: measureRegions (a python loop over
+skimage regionprops) against measureRegionsBatch (np.bincount over the label image).
+
+Crowded synthetic fluorescent images (many bright disks on a noisy background) are segmented once,
+then both measurement functions are timed on the same watershed label images and their outputs
+are checked to be identical.
+
+Fails (exit code 1) if the outputs differ, or if either function is slower than the baselines (see baseline.py).
+
+usage:
+    python benchmarks/bench_region_measurements.py [number of objects per image] [--tolerance 0.5] [--save-throughput]
+'''
+
+#%%
+def crowdedImage(nobjects,shape=(1024,1024),seed=0):
+
+    '''
+    crowdedImage: grayscale image with nobjects bright disks of random size on a noisy background
+    '''
+
+    rng=np.random.RandomState(seed)
+    img=rng.normal(20,4,shape).clip(0,255)
+    for i in range(nobjects):
+        y,x=rng.randint(10,shape[0]-10),rng.randint(10,shape[1]-10)
+        cv2.circle(img,(int(x),int(y)),int(rng.randint(3,14)),float(rng.randint(120,250)),-1)
+    return img.astype('uint8')
+
+#%%
+def benchmark(nobjects=400,nimgs=5,repeats=5,pixels_to_um=2.2,diam_min=8,diam_max=18):
+
+    labelled=[]
+    for i in range(nimgs):
+        img_gray=crowdedImage(nobjects,seed=i)
+        img=cv2.cvtColor(img_gray,cv2.COLOR_GRAY2BGR)
+        labelled.append((segmentImage(img,img_gray),img_gray))
+
+    nregions=np.mean([len(np.unique(markers))-2 for markers,img_gray in labelled]) #not counting -1 and the background
+
+    timings={}
+    outputs={}
+    for function in (measureRegions,measureRegionsBatch):
+        start=time.time()
+        for r in range(repeats):
+            outputs[function.__name__]=[function(markers,img_gray,pixels_to_um,diam_min,diam_max,'image')
+                                        for markers,img_gray in labelled]
+        timings[function.__name__]=(time.time()-start)/(repeats*nimgs)
+
+    identical=outputs['measureRegions']==outputs['measureRegionsBatch']
+
+    print('{} images, {:.0f} regions per image'.format(nimgs,nregions))
+    for name in ('measureRegions','measureRegionsBatch'):
+        print('{:>20}: {:8.2f} ms per image'.format(name,1000*timings[name]))
+    print('speedup: {:.1f}x, identical output: {}'.format(timings['measureRegions']/timings['measureRegionsBatch'],identical))
+
+    return timings, identical
+
+
+if __name__=='__main__':
+    parser=benchmarkParser('Benchmark of measureRegions against measureRegionsBatch')
+    parser.add_argument('nobjects',type=int,nargs='?',default=400)
+    args=parser.parse_args()
+    nimgs=5
+    timings,identical=benchmark(args.nobjects,nimgs)
+    results=dict((name,(1.0/seconds,nimgs if identical else 0)) for name,seconds in timings.items()) #images/s
+    failures=[] if identical else ['measureRegionsBatch: output differs from measureRegions']
+    finish('bench_region_measurements {} objects'.format(args.nobjects),results,args,failures)
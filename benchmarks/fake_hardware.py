@@ -0,0 +1,256 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import os
+import sys
+import threading
+import time
+from collections import deque
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Scan_Path import rectangularGrid
+
+'''
+Stand-ins for the microscope and the arduino, so the acquisition can be run and timed without hardware.
+
+FakeCore takes the place of MMCorePy.CMMCore: an XY stage that takes time to move, and a camera that
+shows the droplet of a SyntheticArray (see synthetic_droplets.py) under the stage, brightfield when the
+shutter is open and fluorescent when it is closed. Frames exposed while the stage moves or the shutter
+changes are blank, so an acquisition that does not wait for them saves blank images. The camera can
+snap images or run a continuous sequence acquisition into a circular buffer. FakeArduino takes the place of the serial.Serial
+connection to shutterControlv2_lab.ino: it replies 'o' or 'c' once the servo sweep time has passed.
+
+usage:
+    array=SyntheticArray(ncols*nrows)
+    arduino=FakeArduino(sweep_time=0.2)
+    core=FakeCore(array,rectangularGrid(ncols,nrows,dx,dy),arduino)
+    arrayAcquisition_ShutterControl(ncols,nrows,dx,dy,...,session=HardwareSession(mmc=core,arduino=arduino))
+'''
+
+#%%
+class FakeArduino(object):
+
+    '''
+    FakeArduino: serial connection to a simulated shutterControlv2_lab.ino
+
+    inputs:
+        port, baudrate: as serial.Serial, not used
+        timeout: read timeout in s, as serial.Serial (default None, wait forever)
+        sweep_time: time the servo takes to open or close the shutter, in s (default 0, the real sweep is 31 x 50 ms)
+    '''
+
+    replies={'a': ('open',b'o\r\n'), 'z': ('closed',b'c\r\n')}
+
+    def __init__(self,port='FAKE',baudrate=9600,timeout=None,sweep_time=0.0):
+        self.name=port
+        self.baudrate=baudrate
+        self.timeout=timeout
+        self.sweep_time=sweep_time
+        self.position='closed'
+        self.sweep_end=0.0 #time the servo stops moving
+        self.pending=[] #(time the reply is sent, reply)
+        self.nmoves=0
+
+    def write(self,data):
+        for command in data.decode('ascii'):
+            if command in self.replies:
+                position,reply=self.replies[command]
+                start=max([time.time()]+[ready for ready,line in self.pending]) #one sweep after the other
+                self.pending.append((start+self.sweep_time,reply))
+                self.sweep_end=start+self.sweep_time
+                self.position=position
+                self.nmoves=self.nmoves+1
+        return len(data)
+
+    def readline(self):
+        if not self.pending:
+            if self.timeout is not None:
+                time.sleep(self.timeout)
+            return b''
+        ready,reply=self.pending[0]
+        wait=ready-time.time()
+        if self.timeout is not None and wait>self.timeout:
+            time.sleep(self.timeout)
+            return b''
+        time.sleep(max(0,wait))
+        self.pending.pop(0)
+        return reply
+
+    def reset_input_buffer(self):
+        self.pending=[(ready,reply) for ready,reply in self.pending if ready>time.time()] #replies already received are dropped
+
+    def close(self):
+        pass
+
+#%%
+class FakeCore(object):
+
+    '''
+    FakeCore: simulated micromanager core with an XY stage and a camera
+
+    inputs:
+        array: SyntheticArray the camera looks at (default None, blank frames)
+        positions: XY stage position of each droplet of the array, relative to the first droplet
+        (default: rectangularGrid of the array in one row)
+        arduino: FakeArduino whose shutter position decides the channel the camera sees (default None, always FL)
+        readout_time: time to read a frame out of the camera after the exposure, in s (default 0.01)
+        snap_overhead: software round trip of each snapImage (arming the camera, triggering it, handing the
+        image over), in s, on top of the exposure and readout. Frames of a sequence acquisition do not pay it
+        (default 0.03)
+        move_overhead: time for any stage move, in s (default 0.02)
+        move_speed: stage speed in microns/s (default 20000)
+        shape: size of the blank frames if there is no array (default (512, 640))
+        buffer_frames: size of the circular buffer of the sequence acquisition, in frames (default 16)
+
+    attributes:
+        nsnaps, snap_time: number of images snapped, time spent in snapImage in s
+        nmoves: number of stage moves
+        nsequence: number of frames put in the circular buffer by sequence acquisitions
+    '''
+
+    def __init__(self,array=None,positions=None,arduino=None,readout_time=0.01,snap_overhead=0.03,move_overhead=0.02,
+                 move_speed=20000.0,shape=(512,640),buffer_frames=16):
+        self.arduino=arduino
+        self.readout_time=readout_time
+        self.snap_overhead=snap_overhead
+        self.move_overhead=move_overhead
+        self.move_speed=move_speed
+
+        ###all frames are made up front, so making them is not timed
+        self.frames=[]
+        if array is not None:
+            self.frames=[array.frames(nimg) for nimg in range(1,array.ndroplets+1)]
+            shape=array.shape
+        self.blank=np.zeros(shape,np.uint16)
+        if positions is None:
+            positions=rectangularGrid(len(self.frames),1,900,900)
+        self.positions=np.asarray(positions,dtype=float)
+
+        self.position=np.zeros(2)
+        self.move_end=0.0
+        self.exposure=10.0
+        self.image=None
+        self.nsnaps=0
+        self.snap_time=0.0
+        self.nmoves=0
+
+        self.buffer=deque(maxlen=buffer_frames) #circular buffer, the oldest frames are overwritten
+        self.sequence=None #thread of the running sequence acquisition
+        self.nsequence=0
+        self.config={}
+
+    def getVersionInfo(self):
+        return 'FakeCore'
+
+    def getAPIVersionInfo(self):
+        return 'FakeCore'
+
+    def loadSystemConfiguration(self,filename):
+        pass
+
+    def initializeAllDevices(self):
+        pass
+
+    def setOriginXY(self,stage=None):
+        self.position=np.zeros(2)
+
+    def getXYPosition(self,stage=None):
+        return float(self.position[0]), float(self.position[1])
+
+    def _move(self,target):
+        distance=np.sqrt(((target-self.position)**2).sum())
+        self.move_end=time.time()+self.move_overhead+distance/self.move_speed
+        self.position=target
+        self.nmoves=self.nmoves+1
+
+    def setXYPosition(self,stage,x,y):
+        self._move(np.array([x,y],dtype=float))
+
+    def setRelativeXYPosition(self,stage,dx,dy):
+        self._move(self.position+np.array([dx,dy],dtype=float))
+
+    def deviceBusy(self,device):
+        return time.time()<self.move_end
+
+    def setExposure(self,exposure):
+        if self.sequence is not None:
+            raise RuntimeError('Cannot change the exposure while a sequence acquisition is running')
+        self.exposure=exposure
+
+    def getExposure(self):
+        return self.exposure
+
+    def setConfig(self,group,preset):
+        if self.sequence is not None: #as most camera adapters, busy acquiring
+            raise RuntimeError('Cannot apply a configuration while a sequence acquisition is running')
+        self.config[group]=preset
+
+    def waitForConfig(self,group,preset):
+        pass
+
+    def snapImage(self):
+        if self.sequence is not None:
+            raise RuntimeError('Cannot snap an image while a sequence acquisition is running')
+        start=time.time()
+        time.sleep(self.snap_overhead/2) #arming and triggering the camera
+        self.image=self._expose()
+        time.sleep(self.readout_time+self.snap_overhead/2) #readout and handing the image over
+        self.nsnaps=self.nsnaps+1
+        self.snap_time=self.snap_time+time.time()-start
+
+    def getImage(self):
+        return self.image.copy()
+
+    def startContinuousSequenceAcquisition(self,interval_ms):
+        self.stopSequenceAcquisition()
+        self.sequence=threading.Thread(target=self._stream)
+        self.sequence.daemon=True
+        self.sequence.start()
+
+    def stopSequenceAcquisition(self):
+        sequence,self.sequence=self.sequence,None
+        if sequence is not None:
+            sequence.join()
+
+    def isSequenceRunning(self):
+        return self.sequence is not None
+
+    def getRemainingImageCount(self):
+        return len(self.buffer)
+
+    def popNextImage(self):
+        return self.buffer.popleft().copy()
+
+    def clearCircularBuffer(self):
+        self.buffer.clear()
+
+    def _stream(self):
+        while self.sequence is not None:
+            frame=self._expose()
+            time.sleep(self.readout_time) #the next exposure starts after the readout
+            self.buffer.append(frame)
+            self.nsequence=self.nsequence+1
+
+    def _still(self):
+        still=time.time()>=self.move_end
+        if self.arduino is not None:
+            still=still and time.time()>=self.arduino.sweep_end
+        return still
+
+    def _expose(self):
+        still=self._still()
+        moves=(self.nmoves,self.arduino.nmoves if self.arduino is not None else 0)
+        time.sleep(self.exposure/1000.0)
+        frame=self._frame()
+        if not still or moves!=(self.nmoves,self.arduino.nmoves if self.arduino is not None else 0):
+            return self.blank #the stage or the shutter moved during the exposure
+        return frame
+
+    def _frame(self):
+        if not self.frames:
+            return self.blank
+        droplet=int(np.argmin(((self.positions-self.position)**2).sum(axis=1))) #droplet closest to the camera
+        bf,fl=self.frames[droplet]
+        if self.arduino is not None and self.arduino.position=='open':
+            return bf
+        return fl
@@ -0,0 +1,143 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+import os
+import cv2
+import numpy as np
+
+'''
+Synthetic droplet images for the benchmarks, with a known number of beads in every droplet.
+
+Fluorescent frames are bright disks of bead size (the beads) on a dim noisy background. Brightfield
+frames are a bright noisy background with the printed droplet as a slightly darker disk with a dark
+edge, or no droplet at all where nothing was printed.
+'''
+
+#%%
+def beadFrame(nbeads,shape=(1024,1024),max_value=4095,pixels_to_um=2.2,seed=0,bead_diam=(9,17),
+              center=None,radius=None):
+
+    '''
+    beadFrame: uint16 fluorescent frame with nbeads non-overlapping beads on a noisy background
+
+    inputs:
+        nbeads: number of beads
+        shape: size of the frame in pixels
+        max_value: brightest value of the camera, e.g. 255 for 8-bit, 4095 for 12-bit (default 4095)
+        pixels_to_um: pixels per micron (default 2.2, 20X)
+        seed: seed of the random number generator
+        bead_diam: (min, max) diameter of the beads, in microns (default (9, 17))
+        center, radius: (x, y) center and radius of the droplet in pixels, to keep the beads inside it
+        (default None, anywhere in the frame)
+    '''
+
+    rng=np.random.RandomState(seed)
+    frame=rng.normal(0.08*max_value,0.01*max_value,shape)
+    centers=[]
+    for attempt in range(100000): #random positions until the beads fit without overlapping
+        if len(centers)==nbeads:
+            break
+        bead_radius=rng.uniform(bead_diam[0]/2.0,bead_diam[1]/2.0)*pixels_to_um
+        if center is None:
+            y,x=rng.uniform(bead_radius+5,shape[0]-bead_radius-5),rng.uniform(bead_radius+5,shape[1]-bead_radius-5)
+        else:
+            angle,distance=rng.uniform(0,2*np.pi),np.sqrt(rng.uniform())*max(0,radius-bead_radius-5)
+            x,y=center[0]+distance*np.cos(angle),center[1]+distance*np.sin(angle)
+        if all((y-cy)**2+(x-cx)**2>(bead_radius+cr+10)**2 for cy,cx,cr in centers):
+            centers.append((y,x,bead_radius))
+            cv2.circle(frame,(int(x),int(y)),int(bead_radius),float(rng.uniform(0.5,0.95)*max_value),-1)
+
+    return frame.clip(0,max_value).astype(np.uint16)
+
+#%%
+def brightfieldFrame(shape,center=None,radius=None,max_value=4095,seed=0):
+
+    '''
+    brightfieldFrame: uint16 brightfield frame with a droplet of radius pixels at center (x, y),
+    or with no droplet if center is None
+    '''
+
+    rng=np.random.RandomState(seed)
+    frame=rng.normal(0.65*max_value,0.015*max_value,shape)
+    if center is not None:
+        cv2.circle(frame,(int(center[0]),int(center[1])),int(radius),0.58*max_value,-1)
+        cv2.circle(frame,(int(center[0]),int(center[1])),int(radius),0.2*max_value,max(2,int(radius/40)))
+
+    return frame.clip(0,max_value).astype(np.uint16)
+
+#%%
+class SyntheticArray(object):
+
+    '''
+    SyntheticArray: an array of printed droplets with a Poisson distributed number of beads in each
+
+    inputs:
+        ndroplets: number of droplets in the array
+        loading: mean number of beads per droplet (default 1.0)
+        shape: size of the frames in pixels (default (512, 640))
+        max_value: brightest value of the camera (default 255, frames saved as 8-bit pngs as they are now)
+        pixels_to_um: pixels per micron (default 2.2, 20X)
+        droplet_diam: (min, max) diameter of the droplets, in microns (default (100, 200))
+        missing: fraction of positions where no droplet was printed (default 0)
+        max_beads: most beads in one droplet (default 4)
+        seed: seed of the random number generator
+
+    attributes:
+        truth: number of beads in each droplet, 0 where no droplet was printed
+        printed: True where a droplet was printed
+
+    usage:
+        array=SyntheticArray(48,loading=0.5)
+        bf,fl=array.frames(nimg) #image number 1, 2, ...
+        array.writePngs(directory,array_label) #as arrayAcquisition saves them
+    '''
+
+    def __init__(self,ndroplets,loading=1.0,shape=(512,640),max_value=255,pixels_to_um=2.2,droplet_diam=(100,200),
+                 missing=0.0,max_beads=4,seed=0):
+        self.ndroplets=ndroplets
+        self.shape=shape
+        self.max_value=max_value
+        self.pixels_to_um=pixels_to_um
+        self.seed=seed
+
+        rng=np.random.RandomState(seed)
+        self.printed=rng.uniform(size=ndroplets)>=missing
+        self.truth=np.where(self.printed,np.minimum(rng.poisson(loading,ndroplets),max_beads),0)
+        self.radius=rng.uniform(droplet_diam[0]/2.0,droplet_diam[1]/2.0,ndroplets)*pixels_to_um
+        self.radius=np.minimum(self.radius,min(shape)/2.0-10) #the whole droplet is in the frame
+        self.center=[(shape[1]/2.0+rng.uniform(-0.1,0.1)*shape[1],shape[0]/2.0+rng.uniform(-0.1,0.1)*shape[0])
+                     for i in range(ndroplets)]
+
+    def frames(self,nimg):
+
+        '''
+        frames: (brightfield, fluorescent) frames of droplet nimg (1, 2, ...)
+        '''
+
+        i=nimg-1
+        seed=self.seed*100003+i
+        if self.printed[i]:
+            bf=brightfieldFrame(self.shape,self.center[i],self.radius[i],self.max_value,seed)
+            fl=beadFrame(self.truth[i],self.shape,self.max_value,self.pixels_to_um,seed,
+                         center=self.center[i],radius=self.radius[i])
+        else:
+            bf=brightfieldFrame(self.shape,max_value=self.max_value,seed=seed)
+            fl=beadFrame(0,self.shape,self.max_value,self.pixels_to_um,seed)
+
+        return bf, fl
+
+    def writePngs(self,directory,array_label):
+
+        '''
+        writePngs: saves the frames of every droplet as array{label}_BFimage####.png and _FLimage####.png
+        in directory, 8-bit if max_value is 255, otherwise 16-bit
+        '''
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        for nimg in range(1,self.ndroplets+1):
+            bf,fl=self.frames(nimg)
+            if self.max_value<=255:
+                bf,fl=bf.astype(np.uint8),fl.astype(np.uint8)
+            for channel,frame in (('BF',bf),('FL',fl)):
+                cv2.imwrite('{}/array{}_{}image{}.png'.format(directory,array_label,channel,str(nimg).zfill(4)),frame)